@@ -0,0 +1,107 @@
+import numpy as np
+
+GENRES = [28, 12, 16, 35, 80, 99, 18, 10751, 14, 36, 27, 10402, 9648, 10749, 878, 10770, 53, 10752, 37]
+TITLE_WORDS = ["the", "star", "wars", "return", "of", "king", "night", "amélie", "city", "love", "dark", "knight",
+               "lost", "story", "toy", "matrix", "godfather", "alien", "blade", "runner", "café", "man", "woman",
+               "last", "first", "summer", "winter", "house", "game", "road"]
+
+
+class Fixture:
+    # a synthetic MovienderDB: movies, users with friend lists, their ratings and open sessions
+    def __init__(self, movies, users, ratings, sessions, friend_pairs):
+        self.movies = movies
+        self.users = users
+        self.ratings = ratings
+        self.sessions = sessions
+        # pairs that are friends and not in a session, free to start one
+        self.friend_pairs = friend_pairs
+        self.session_ids = []
+
+    def counts(self):
+        return {"movies": len(self.movies), "users": len(self.users),
+                "ratings": sum(len(user["ratings"]) for user in self.ratings), "sessions": len(self.sessions)}
+
+
+def generate(n_movies: int, n_users: int, ratings_per_user: int, friends_per_user: int, session_share: float,
+             n_factors: int = 8, seed: int = 0):
+    rng = np.random.default_rng(seed)
+
+    # ratings come from hidden user and movie factors so the trained models have something to find
+    movie_factors = rng.normal(0, 0.6, (n_movies, n_factors))
+    user_factors = rng.normal(0, 0.6, (n_users, n_factors))
+    movie_bias = rng.normal(0, 0.5, n_movies)
+    popularity = rng.lognormal(2, 1.2, n_movies)
+
+    movie_ids = [str(movie) for movie in range(1, n_movies + 1)]
+    movies = []
+    for row, movie_id in enumerate(movie_ids):
+        title = " ".join(rng.choice(TITLE_WORDS, rng.integers(1, 5))).title()
+        movies.append({"movielens_id": movie_id, "title": f"{title} {movie_id}", "overview": "A synthetic movie.",
+                       "release_date": f"{rng.integers(1950, 2023)}-01-01", "poster_path": f"/{movie_id}.jpg",
+                       "genre_ids": [int(genre) for genre in rng.choice(GENRES, rng.integers(1, 4), replace=False)],
+                       "popularity": float(popularity[row]), "vote_average": float(np.round(rng.uniform(2, 9), 1)),
+                       "vote_count": int(rng.integers(0, 20000))})
+
+    uids = [f"user-{user}" for user in range(n_users)]
+    # popular movies are rated more often, drawn from the popularity cdf and deduplicated
+    cdf = np.cumsum(popularity) / popularity.sum()
+    ratings = []
+    for user, uid in enumerate(uids):
+        draws = np.minimum(np.searchsorted(cdf, rng.random(ratings_per_user * 3)), n_movies - 1)
+        _, first = np.unique(draws, return_index=True)
+        rated = draws[np.sort(first)][:ratings_per_user]
+        values = 3 + movie_bias[rated] + movie_factors[rated] @ user_factors[user] + rng.normal(0, 0.5, len(rated))
+        values = np.clip(np.round(values * 2) / 2, 0.5, 5)
+        ratings.append({"uid": uid,
+                        "ratings": {movie_ids[movie]: float(value) for movie, value in zip(rated, values)}})
+
+    friend_lists = {uid: {} for uid in uids}
+    for user, uid in enumerate(uids):
+        for friend in rng.choice(n_users, friends_per_user, replace=False):
+            friend_uid = uids[friend]
+            if friend_uid != uid:
+                friend_lists[uid][friend_uid] = 3
+                friend_lists[friend_uid][uid] = 3
+
+    pairs = sorted({tuple(sorted((uid, friend_uid)))
+                    for uid, friends in friend_lists.items() for friend_uid in friends})
+    rng.shuffle(pairs)
+    n_sessions = int(len(pairs) * session_share)
+    sessions = []
+    for uid, friend_uid in pairs[:n_sessions]:
+        friend_lists[uid][friend_uid] = 4
+        friend_lists[friend_uid][uid] = 4
+        recommendations = [movie_ids[movie] for movie in rng.choice(n_movies, 50, replace=False)]
+        sessions.append({"users_in_session": [uid, friend_uid],
+                         "users_session_info": {uid: {"state": 30, "voted_movies": []},
+                                                friend_uid: {"state": 30, "voted_movies": []}},
+                         "results": [], "users_voted": 0, "recommendations": recommendations, "is_active": True,
+                         "state": 20})
+
+    users = [{"uid": uid, "username": f"username-{user}", "profile_pic": f"https://pics/{user}.jpg",
+              "is_user_initialized": True,
+              "genre_preference": [int(genre) for genre in rng.choice(GENRES, 3, replace=False)],
+              "friend_list": friend_lists[uid], "fcm_token": None} for user, uid in enumerate(uids)]
+
+    return Fixture(movies, users, ratings, sessions, [list(pair) for pair in pairs[n_sessions:]])
+
+
+async def load(database, fixture: Fixture, chunk_size: int = 5000):
+    # database is a Motor database, or mongomock_motor's in-memory stand-in
+    inserted_ids = {}
+    for name, documents in (("Movies", fixture.movies), ("Users", fixture.users), ("Ratings", fixture.ratings),
+                            ("Sessions", fixture.sessions)):
+        await database[name].delete_many({})
+        inserted_ids[name] = []
+        for start in range(0, len(documents), chunk_size):
+            # copies, insert_many adds an _id to the documents it is given
+            result = await database[name].insert_many([dict(document)
+                                                       for document in documents[start:start + chunk_size]])
+            inserted_ids[name] += result.inserted_ids
+    # in the order of fixture.sessions
+    fixture.session_ids = [str(session_id) for session_id in inserted_ids["Sessions"]]
+
+
+def raw_ratings(fixture: Fixture):
+    return [(user["uid"], movie_id, rating, None) for user in fixture.ratings
+            for movie_id, rating in user["ratings"].items()]
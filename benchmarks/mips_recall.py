@@ -0,0 +1,75 @@
+import argparse
+import importlib
+import os
+import sys
+import time
+
+import numpy as np
+from surprise import SVD, Dataset, Reader
+
+import fixtures
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+scoring = importlib.import_module("moviender-app.scoring")
+mips = importlib.import_module("moviender-app.mips")
+
+
+def percentiles(seconds):
+    return [np.percentile(seconds, q) * 1000 for q in (50, 99)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall and latency of the inner product index against brute force")
+    parser.add_argument("--movies", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--ratings-per-user", type=int, default=100)
+    parser.add_argument("--factors", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("-k", type=int, default=100)
+    parser.add_argument("--probes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    fixture = fixtures.generate(args.movies, args.users, args.ratings_per_user, friends_per_user=1, session_share=0,
+                                seed=args.seed)
+    trainset = Dataset(Reader(rating_scale=(0.5, 5))).construct_trainset(fixtures.raw_ratings(fixture))
+    algo = SVD(n_factors=args.factors, random_state=args.seed)
+    algo.fit(trainset)
+    model = scoring.SVDFactors.from_algo(algo)
+
+    started = time.perf_counter()
+    index = mips.InnerProductIndex(mips.item_vectors(model))
+    print(f"{len(index)} movies, {index.n_partitions} partitions, built in {time.perf_counter() - started:.2f} s")
+
+    rng = np.random.default_rng(args.seed)
+    queries = []
+    for user in rng.choice(fixture.ratings, min(args.queries, len(fixture.ratings)), replace=False):
+        exclude = np.zeros(len(index), dtype=bool)
+        watched = model.inner_iids(list(user["ratings"].keys()))
+        exclude[watched[watched >= 0]] = True
+        queries.append((mips.user_query(model, model.pu[model.inner_uid(user["uid"])]), exclude))
+
+    exact = []
+    seconds = []
+    for query, exclude in queries:
+        started = time.perf_counter()
+        items, _ = index.brute_force(query, args.k, exclude)
+        seconds.append(time.perf_counter() - started)
+        exact.append(set(items.tolist()))
+    p50, p99 = percentiles(seconds)
+    print(f"{'brute force':>12}: recall@{args.k} 1.000, p50 {p50:.3f} ms, p99 {p99:.3f} ms")
+
+    for n_probe in args.probes:
+        recalls = []
+        seconds = []
+        for (query, exclude), expected in zip(queries, exact):
+            started = time.perf_counter()
+            items, _ = index.search(query, args.k, n_probe, exclude)
+            seconds.append(time.perf_counter() - started)
+            recalls.append(len(expected.intersection(items.tolist())) / len(expected))
+        p50, p99 = percentiles(seconds)
+        print(f"{n_probe:>6} probes: recall@{args.k} {np.mean(recalls):.3f}, p50 {p50:.3f} ms, p99 {p99:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import argparse
+import importlib
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from surprise import SVD, Dataset, Reader, dump
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+scoring = importlib.import_module("moviender-app.scoring")
+
+
+def synthetic_trainset(n_users: int, n_movies: int, n_ratings: int, seed: int):
+    rng = np.random.default_rng(seed)
+    raw_ratings = [(str(user), str(movie), float(rating), None) for user, movie, rating in
+                   zip(rng.integers(0, n_users, n_ratings), rng.integers(0, n_movies, n_ratings),
+                       rng.integers(1, 6, n_ratings))]
+    return Dataset(Reader(rating_scale=(1, 5))).construct_trainset(raw_ratings)
+
+
+def anonymous_mb():
+    # memory that is private to this process, mapped model files are page cache shared by every worker
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Anonymous:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def load_in_fresh_process(loader: str, path: str, queue):
+    before = anonymous_mb()
+    started = time.perf_counter()
+    if loader == "pickle":
+        model = scoring.load_svd_factors(path)
+    else:
+        model = scoring.SVDFactors.load(path, verify=loader == "mmap, verified")
+    seconds = time.perf_counter() - started
+    estimates = scoring.estimate_ratings(model, ["1", "2"], model.inner_iids([str(movie) for movie in range(100)]))
+    queue.put((seconds, anonymous_mb() - before, estimates))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare loading the pickled SVD with the memory-mapped export")
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--movies", type=int, default=20000)
+    parser.add_argument("--ratings", type=int, default=2000000)
+    parser.add_argument("--factors", type=int, default=150)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    algo = SVD(n_factors=args.factors, n_epochs=1, random_state=args.seed)
+    algo.fit(synthetic_trainset(args.users, args.movies, args.ratings, args.seed))
+
+    directory = tempfile.mkdtemp(prefix="moviender-models-")
+    pickle_path = os.path.join(directory, "trainedSVDAlgo.model")
+    manifest_path = os.path.join(directory, "svd.json")
+    dump.dump(pickle_path, algo=algo)
+    export = scoring.SVDFactors.from_algo(algo).save(manifest_path)
+    export_size = sum(entry.stat().st_size for entry in os.scandir(os.path.join(directory, export)))
+    print(f"pickle {os.path.getsize(pickle_path) / 2 ** 20:.0f} MB, export {export_size / 2 ** 20:.0f} MB")
+
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    for loader, path in (("pickle", pickle_path), ("mmap", manifest_path), ("mmap, verified", manifest_path)):
+        queue = context.Queue()
+        process = context.Process(target=load_in_fresh_process, args=(loader, path, queue))
+        process.start()
+        results[loader] = queue.get()
+        process.join()
+        seconds, private_mb, _ = results[loader]
+        print(f"{loader:>16}: {seconds * 1000:9.1f} ms, {private_mb:7.1f} MB private memory")
+
+    print(f"same estimates: {np.array_equal(results['pickle'][2], results['mmap'][2])}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import argparse
+import importlib
+import os
+import sys
+import time
+
+import numpy as np
+from surprise import SVD, Dataset, Reader
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+scoring = importlib.import_module("moviender-app.scoring")
+
+
+def synthetic_dataset(n_users: int, n_movies: int, n_ratings: int, seed: int):
+    rng = np.random.default_rng(seed)
+    users = rng.integers(0, n_users, n_ratings)
+    movies = rng.integers(0, n_movies, n_ratings)
+    ratings = rng.integers(1, 6, n_ratings)
+
+    raw_ratings = [(str(user), str(movie), float(rating), None) for user, movie, rating in zip(users, movies, ratings)]
+    reader = Reader(rating_scale=(1, 5))
+    data = Dataset(reader)
+    return data.construct_trainset(raw_ratings)
+
+
+def loop_final_list(algo, uid, friend_uid, list_of_movies):
+    # the per-movie predict loop that get_final_list used before the vectorized scorer
+    user_combined_predictions = []
+    for movie_id in list_of_movies:
+        user_pred = algo.predict(uid, movie_id)
+        friend_user_pred = algo.predict(friend_uid, movie_id)
+        user_combined_predictions.append((movie_id, user_pred.est * friend_user_pred.est))
+
+    user_combined_predictions.sort(key=lambda x: x[1], reverse=True)
+    return user_combined_predictions[0:50]
+
+
+def best_of(repeat: int, function, *args):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function(*args)
+        timings.append(time.perf_counter() - started)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the predict loop with the vectorized group scorer")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--movies", type=int, default=8000)
+    parser.add_argument("--ratings", type=int, default=200000)
+    parser.add_argument("--factors", type=int, default=150)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    trainset = synthetic_dataset(args.users, args.movies, args.ratings, args.seed)
+    algo = SVD(n_factors=args.factors, n_epochs=5, random_state=args.seed)
+    algo.fit(trainset)
+    model = scoring.SVDFactors.from_algo(algo)
+
+    # candidates include a few movies the model does not know, and one of the users is unknown too
+    list_of_movies = [str(movie) for movie in range(args.movies + 50)]
+    pairs = [("1", "2"), ("3", "unknown-user")]
+
+    for uid, friend_uid in pairs:
+        loop_time, expected = best_of(args.repeat, loop_final_list, algo, uid, friend_uid, list_of_movies)
+        vector_time, result = best_of(args.repeat, scoring.score_group, model, [uid, friend_uid], list_of_movies)
+
+        same_ranking = [movie for movie, _ in expected] == [movie for movie, _ in result]
+        max_difference = max(abs(a[1] - b[1]) for a, b in zip(expected, result))
+        print(f"pair ({uid}, {friend_uid}), {len(list_of_movies)} candidates")
+        print(f"  predict loop: {loop_time * 1000:9.2f} ms")
+        print(f"  vectorized:   {vector_time * 1000:9.2f} ms ({loop_time / vector_time:.0f}x)")
+        print(f"  same ranking: {same_ranking}, max score difference: {max_difference:.2e}")
+
+    # group sessions score one users x candidates matrix, so latency should barely move with the group size
+    print(f"group sessions, {len(list_of_movies)} candidates")
+    for aggregation in scoring.AGGREGATIONS:
+        timings = []
+        for group_size in (2, 4, 6, 8, 10):
+            uids = [str(user) for user in range(group_size)]
+            group_time, _ = best_of(args.repeat, scoring.score_group, model, uids, list_of_movies, aggregation)
+            timings.append(f"{group_size}: {group_time * 1000:6.2f} ms")
+        print(f"  {aggregation:>12}  " + "  ".join(timings))
+
+
+if __name__ == "__main__":
+    main()
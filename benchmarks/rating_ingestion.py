@@ -0,0 +1,109 @@
+import argparse
+import asyncio
+import importlib
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+rating_buffer = importlib.import_module("moviender-app.rating_buffer")
+
+
+class Collections:
+    # the Ratings collection the way RatingWriteBuffer reaches it, counting the updates it is sent
+    def __init__(self, ratings):
+        self._ratings = ratings
+        self.writes = 0
+
+    @property
+    def Ratings(self):
+        return self
+
+    async def update_one(self, *args, **kwargs):
+        self.writes += 1
+        return await self._ratings.update_one(*args, **kwargs)
+
+
+def connect(mongo_uri: str):
+    if mongo_uri:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        return AsyncIOMotorClient(mongo_uri)["MovienderBenchmark"]
+
+    # without a server the numbers only compare round trips through the driver api
+    from mongomock_motor import AsyncMongoMockClient
+    return AsyncMongoMockClient()["MovienderBenchmark"]
+
+
+def onboarding_bursts(n_users: int, batch_size: int, n_movies: int, repeat_share: float, seed: int):
+    # every user rates a batch of movies, some of them more than once as they change their mind
+    rng = random.Random(seed)
+    bursts = []
+    for user in range(n_users):
+        ratings = []
+        for _ in range(batch_size):
+            if ratings and rng.random() < repeat_share:
+                movie_id = rng.choice(ratings)[0]
+            else:
+                movie_id = str(rng.randrange(n_movies))
+            ratings.append((movie_id, rng.choice([0, 1, 2, 3, 4, 5])))
+        bursts.append((f"user-{user}", ratings))
+    return bursts
+
+
+async def one_update_per_rating(collections, bursts):
+    for uid, ratings in bursts:
+        for movie_id, rating in ratings:
+            await collections.Ratings.update_one({"uid": uid}, rating_buffer.ratings_update(
+                {movie_id: float(rating) if rating else None}))
+
+
+async def one_update_per_batch(collections, bursts):
+    for uid, ratings in bursts:
+        operations = {movie_id: float(rating) if rating else None for movie_id, rating in ratings}
+        await collections.Ratings.update_one({"uid": uid}, rating_buffer.ratings_update(operations))
+
+
+async def write_behind(collections, bursts):
+    # the same single-rating requests as one_update_per_rating, coalesced by the buffer
+    buffer = rating_buffer.RatingWriteBuffer(collections, window=0.05)
+    for uid, ratings in bursts:
+        for movie_id, rating in ratings:
+            buffer.add(uid, {movie_id: float(rating) if rating else None})
+    await buffer.flush_all()
+
+
+async def run(args):
+    database = connect(args.mongo_uri)
+    bursts = onboarding_bursts(args.users, args.batch_size, args.movies, args.repeat_share, args.seed)
+    n_ratings = sum(len(ratings) for _, ratings in bursts)
+
+    print(f"{args.users} users, {n_ratings} ratings")
+    print(f"{'strategy':>22} {'seconds':>9} {'ratings/s':>10} {'writes':>7}")
+    for strategy in (one_update_per_rating, one_update_per_batch, write_behind):
+        await database.Ratings.delete_many({})
+        await database.Ratings.insert_many([{"uid": uid, "ratings": {}} for uid, _ in bursts])
+        collections = Collections(database.Ratings)
+
+        started = time.perf_counter()
+        await strategy(collections, bursts)
+        elapsed = time.perf_counter() - started
+        print(f"{strategy.__name__:>22} {elapsed:9.3f} {n_ratings / elapsed:10.0f} {collections.writes:7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-rating writes with batched and write-behind writes")
+    parser.add_argument("--mongo-uri", default=os.getenv("BENCHMARK_MONGO_URI"),
+                        help="a disposable MongoDB server, mongomock is used when not set")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--batch-size", type=int, default=20)
+    parser.add_argument("--movies", type=int, default=5000)
+    parser.add_argument("--repeat-share", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import argparse
+import asyncio
+import importlib
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import fixtures
+import suite
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+HEAVY_MODULES = ("surprise", "firebase_admin", "firebase_admin.messaging")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Import time and time to ready of a fresh API worker")
+    parser.add_argument("--mongo-uri", default=os.getenv("BENCHMARK_MONGO_URI"),
+                        help="a disposable MongoDB server, the in-memory mongomock stand-in is used when not set")
+    parser.add_argument("--db-name", default="MovienderBenchmark")
+    parser.add_argument("--movies", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=5000)
+    parser.add_argument("--ratings-per-user", type=int, default=20)
+    parser.add_argument("--svd-factors", type=int, default=100)
+    parser.add_argument("--svd-epochs", type=int, default=5)
+    parser.add_argument("--knn-movies", type=int, default=1000)
+    parser.add_argument("--runs", type=int, default=3, help="fresh worker processes measured")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="where the models are trained, a temporary directory by default")
+    return parser.parse_args()
+
+
+async def start_worker(fixture, mongo_uri):
+    started = time.perf_counter()
+    main = importlib.import_module("moviender-app.main")
+    import_seconds = time.perf_counter() - started
+    heavy = [module for module in HEAVY_MODULES if module in sys.modules]
+
+    db = importlib.import_module("moviender-app.dependencies").get_db_client()
+    if mongo_uri is None:
+        from mongomock_motor import AsyncMongoMockClient
+
+        # an in-memory database starts empty in every process, loading it is not part of the startup
+        db.connect(AsyncMongoMockClient())
+        await fixtures.load(db.database, fixture)
+
+    import httpx
+
+    async with httpx.AsyncClient(app=main.app, base_url="http://benchmark") as client:
+        started = time.perf_counter()
+        await main.app.router.startup()
+        live_seconds = time.perf_counter() - started
+        while (await client.get("/readyz")).status_code != 200:
+            await asyncio.sleep(0.01)
+        ready_seconds = time.perf_counter() - started
+
+        # what the first user waits for once the worker is in the load balancer
+        pair = fixture.friend_pairs[0]
+        started = time.perf_counter()
+        response = await client.post(f"/session_recommendations/{pair[0]}",
+                                     json={"friend_uid": pair[1], "genres_ids": []})
+        first_request_seconds = time.perf_counter() - started
+        steps = main.warm_up.status()["steps"]
+        await main.app.router.shutdown()
+
+    return {"import": import_seconds, "live": live_seconds, "ready": ready_seconds,
+            "first_request": first_request_seconds, "first_request_status": response.status_code, "steps": steps,
+            "heavy_imports": heavy}
+
+
+def measure_in_fresh_process(workdir, fixture, mongo_uri, queue):
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    queue.put(asyncio.run(start_worker(fixture, mongo_uri)))
+
+
+def main():
+    args = parse_args()
+    fixture = fixtures.generate(args.movies, args.users, args.ratings_per_user, friends_per_user=3,
+                                session_share=0.1, seed=args.seed)
+
+    # the API loads its models from ./TrainedModels, so every worker starts in the work directory
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="moviender-startup-"))
+    os.chdir(workdir)
+    trained = suite.train_models(fixture, args)
+    print(f"models trained in {trained['svd_seconds']:.1f}s (SVD) and {trained['knn_seconds']:.1f}s (KNN)")
+
+    os.environ["DB_NAME"] = args.db_name
+    os.environ["NOTIFICATION_TRANSPORT"] = "local"
+    if args.mongo_uri:
+        os.environ["DB_CONNECTION_STRING"] = args.mongo_uri
+        asyncio.run(load_fixture(args.mongo_uri, args.db_name, fixture))
+    else:
+        os.environ["ENSURE_INDEXES"] = "0"
+
+    context = multiprocessing.get_context("spawn")
+    runs = []
+    for _ in range(args.runs):
+        queue = context.Queue()
+        process = context.Process(target=measure_in_fresh_process, args=(workdir, fixture, args.mongo_uri, queue))
+        process.start()
+        runs.append(queue.get())
+        process.join()
+
+    for name in ("import", "live", "ready", "first_request"):
+        seconds = np.array([run[name] for run in runs]) * 1000
+        print(f"{name:>14}: median {np.median(seconds):9.1f} ms, max {seconds.max():9.1f} ms")
+    for name in runs[0]["steps"]:
+        print(f"{'warm-up ' + name:>22}: median {np.median([run['steps'][name] for run in runs]) * 1000:9.1f} ms")
+    print(f"first request statuses: {[run['first_request_status'] for run in runs]}")
+    print(f"heavy modules imported with main: {runs[0]['heavy_imports'] or 'none'}")
+
+
+async def load_fixture(mongo_uri, db_name, fixture):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(mongo_uri)
+    await fixtures.load(client[db_name], fixture)
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import numpy as np
+
+import fixtures
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the recommendation functions and every API endpoint "
+                                                 "against a synthetic MovienderDB")
+    parser.add_argument("--mongo-uri", default=os.getenv("BENCHMARK_MONGO_URI"),
+                        help="a disposable MongoDB server, the in-memory mongomock stand-in is used when not set")
+    parser.add_argument("--db-name", default="MovienderBenchmark", help="database the fixture is written to")
+    parser.add_argument("--movies", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--ratings-per-user", type=int, default=20)
+    parser.add_argument("--friends-per-user", type=int, default=5)
+    parser.add_argument("--session-share", type=float, default=0.1, help="share of friend pairs in a session")
+    parser.add_argument("--svd-factors", type=int, default=50)
+    parser.add_argument("--svd-epochs", type=int, default=10)
+    parser.add_argument("--knn-movies", type=int, default=2000,
+                        help="KNNBaseline is trained on the most rated movies only, its similarity matrix is dense")
+    parser.add_argument("--repeat", type=int, default=50, help="calls per micro-benchmark")
+    parser.add_argument("--requests", type=int, default=500, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", help="where the models are trained, a temporary directory by default")
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--baseline", help="results of an earlier run to compare with")
+    return parser.parse_args()
+
+
+def percentiles(timings):
+    timings = np.array(timings) * 1000
+    return {"mean_ms": float(timings.mean()), "p50_ms": float(np.percentile(timings, 50)),
+            "p95_ms": float(np.percentile(timings, 95)), "p99_ms": float(np.percentile(timings, 99))}
+
+
+def train_models(fixture, args):
+    # the same training functions trainModels.py uses, on the fixture's ratings, written to ./TrainedModels
+    from surprise import Dataset, Reader
+    import trainModels
+
+    os.makedirs("TrainedModels", exist_ok=True)
+    raw_ratings = fixtures.raw_ratings(fixture)
+    reader = Reader(rating_scale=(0.5, 5))
+
+    started = time.perf_counter()
+    trainset = Dataset(reader).construct_trainset(raw_ratings)
+    trainModels.train_svd(trainset, {**trainModels.SVD_PARAMS, "n_factors": args.svd_factors,
+                                     "n_epochs": args.svd_epochs, "random_state": args.seed})
+    svd_seconds = time.perf_counter() - started
+
+    rated = Counter(movie_id for _, movie_id, _, _ in raw_ratings)
+    knn_movies = {movie_id for movie_id, _ in rated.most_common(args.knn_movies)}
+    started = time.perf_counter()
+    knn_trainset = Dataset(reader).construct_trainset([rating for rating in raw_ratings if rating[1] in knn_movies])
+    trainModels.train_knn(knn_trainset, {**trainModels.KNN_PARAMS, "verbose": False})
+    knn_seconds = time.perf_counter() - started
+
+    return {"svd_seconds": svd_seconds, "knn_seconds": knn_seconds, "knn_movies": sorted(knn_movies, key=int)}
+
+
+def time_calls(repeat, function, *args):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - started)
+    return percentiles(timings)
+
+
+async def micro_benchmarks(fixture, trained, args):
+    utils = importlib.import_module("moviender-app.utils")
+    dependencies = importlib.import_module("moviender-app.dependencies")
+    rng = np.random.default_rng(args.seed)
+
+    snapshot = await dependencies.get_catalog().current()
+    index = dependencies.get_title_search().index
+    pair = fixture.friend_pairs[0]
+    group = [user["uid"] for user in fixture.users[:6]]
+    pair_ratings = await utils.fetch_users_ratings(pair)
+    group_ratings = await utils.fetch_users_ratings(group)
+    pair_movies = await utils.fetch_movies(pair_ratings, [])
+    group_movies = await utils.fetch_movies(group_ratings, [])
+    watched = list(fixture.ratings[0]["ratings"])
+    votes = {"recommendations": [str(movie) for movie in range(50)],
+             "users_session_info": {uid: {"voted_movies": (rng.random(50) < 0.6).tolist()} for uid in group}}
+
+    results = {
+        "get_final_list_pair": time_calls(args.repeat, utils.get_final_list, pair, pair_movies, pair_ratings),
+        "get_final_list_group_6": time_calls(args.repeat, utils.get_final_list, group, group_movies, group_ratings),
+        "rank_personal_recommendations": time_calls(args.repeat, utils.rank_personal_recommendations, snapshot,
+                                                    watched, fixture.users[0]["genre_preference"]),
+        "calculate_score": time_calls(args.repeat, utils.calculate_score, rng.random(len(snapshot)),
+                                      snapshot.vote_average, snapshot.vote_count, snapshot.popularity),
+        "get_similar_movies": time_calls(args.repeat, utils.get_similar_movies, trained["knn_movies"][0]),
+        "title_search": time_calls(args.repeat, index.search, "the dark", ["movielens_id", "poster_path", "title"]),
+        "get_result_movies_votes": time_calls(args.repeat, utils.get_result_movies_votes, votes,
+                                              votes["recommendations"]),
+    }
+    return results
+
+
+class Endpoint:
+    def __init__(self, name, method, request, limit=None):
+        self.name = name
+        self.method = method
+        # i -> (path, params, json body)
+        self.request = request
+        self.limit = limit
+
+
+def endpoints(fixture, trained, rng):
+    users = [user["uid"] for user in fixture.users]
+    movies = [movie["movielens_id"] for movie in fixture.movies]
+    sessions = fixture.session_ids
+    pairs = fixture.friend_pairs
+    # session creation changes the friend states, every request needs a pair that is not in a session yet
+    half = len(pairs) // 2
+
+    def user():
+        return users[rng.integers(len(users))]
+
+    def movie():
+        return movies[rng.integers(len(movies))]
+
+    def session():
+        return sessions[rng.integers(len(sessions))]
+
+    def session_movies(i):
+        session = rng.integers(len(sessions))
+        uid = fixture.sessions[session]["users_in_session"][0]
+        return f"/session_movies/{sessions[session]}", {"uid": uid}, None
+
+    def movies_page(i):
+        return "/movies", {"genres": [int(rng.choice(fixtures.GENRES))]}, None
+
+    def ratings(i):
+        return "/ratings", None, {"uid": user(), "ratings": [{"movielens_id": movie(), "rating": 4.0}
+                                                              for _ in range(10)]}
+
+    return [
+        Endpoint("GET /starter", "GET", lambda i: ("/starter", None, None)),
+        Endpoint("GET /movies", "GET", movies_page),
+        Endpoint("GET /movies/{page}", "GET", lambda i: (f"/movies/{rng.integers(1, 50)}", None, None)),
+        Endpoint("GET /movie_details/{movie_id}", "GET",
+                 lambda i: (f"/movie_details/{movie()}", {"uid": user()}, None)),
+        Endpoint("GET /search", "GET",
+                 lambda i: ("/search", {"title": str(rng.choice(fixtures.TITLE_WORDS))}, None)),
+        Endpoint("GET /user_recommendations/{page}", "GET",
+                 lambda i: ("/user_recommendations/1", {"uid": user()}, None)),
+        Endpoint("GET /friends/{uid}", "GET", lambda i: (f"/friends/{user()}", None, None)),
+        Endpoint("GET /session_movies/{session_id}", "GET", session_movies),
+        Endpoint("GET /session_state/{session_id}", "GET", lambda i: (f"/session_state/{session()}", None, None)),
+        Endpoint("POST /ratings", "POST", ratings),
+        Endpoint("POST /session_recommendations/{uid}", "POST",
+                 lambda i: (f"/session_recommendations/{pairs[i][0]}", None,
+                            {"friend_uid": pairs[i][1], "genres_ids": []}), limit=half),
+        Endpoint("POST /session_sim/{uid}", "POST",
+                 lambda i: (f"/session_sim/{pairs[half + i][0]}", None,
+                            {"friend_uid": pairs[half + i][1],
+                             "movielens_id": trained["knn_movies"][i % len(trained["knn_movies"])]}), limit=half),
+    ]
+
+
+async def load_endpoint(client, endpoint, n_requests, concurrency):
+    n_requests = min(n_requests, endpoint.limit) if endpoint.limit is not None else n_requests
+    requests = [endpoint.request(i) for i in range(n_requests)]
+    timings = []
+    statuses = Counter()
+    next_request = iter(requests)
+
+    async def worker():
+        for path, params, body in next_request:
+            started = time.perf_counter()
+            try:
+                response = await client.request(endpoint.method, path, params=params, json=body)
+                statuses[response.status_code] += 1
+            except Exception as e:
+                statuses[type(e).__name__] += 1
+            timings.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    return {**percentiles(timings), "requests": n_requests, "requests_per_second": n_requests / elapsed,
+            "statuses": {str(status): count for status, count in statuses.items()}}
+
+
+async def endpoint_benchmarks(app, fixture, trained, args):
+    import httpx
+
+    rng = np.random.default_rng(args.seed)
+    results = {}
+    async with httpx.AsyncClient(app=app, base_url="http://benchmark") as client:
+        for endpoint in endpoints(fixture, trained, rng):
+            # a few requests first so caches and lazily built indexes are warm, except for one-shot requests
+            if endpoint.limit is None:
+                for i in range(min(10, args.requests)):
+                    path, params, body = endpoint.request(i)
+                    await client.request(endpoint.method, path, params=params, json=body)
+            results[endpoint.name] = await load_endpoint(client, endpoint, args.requests, args.concurrency)
+            print(f"{endpoint.name:>36}  p50 {results[endpoint.name]['p50_ms']:8.2f} ms  "
+                  f"p99 {results[endpoint.name]['p99_ms']:8.2f} ms  "
+                  f"{results[endpoint.name]['requests_per_second']:8.0f} req/s")
+    return results
+
+
+async def run(args, fixture, trained):
+    main = importlib.import_module("moviender-app.main")
+    dependencies = importlib.import_module("moviender-app.dependencies")
+
+    db = dependencies.get_db_client()
+    if args.mongo_uri is None:
+        from mongomock_motor import AsyncMongoMockClient
+        db.connect(AsyncMongoMockClient())
+
+    started = time.perf_counter()
+    await fixtures.load(db.database, fixture)
+    load_seconds = time.perf_counter() - started
+
+    await main.app.router.startup()
+    # models and catalog load in the background, measure the worker once it would report ready
+    await main.warm_up.wait()
+    try:
+        micro = await micro_benchmarks(fixture, trained, args)
+        for name, result in micro.items():
+            print(f"{name:>36}  p50 {result['p50_ms']:8.2f} ms  p95 {result['p95_ms']:8.2f} ms")
+        endpoint_results = await endpoint_benchmarks(main.app, fixture, trained, args)
+    finally:
+        await main.app.router.shutdown()
+
+    return {"load_seconds": load_seconds, "micro": micro, "endpoints": endpoint_results}
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    print(f"compared with {baseline['meta'].get('revision')}")
+    for section, key in (("micro", "p50_ms"), ("endpoints", "p95_ms")):
+        for name, result in results[section].items():
+            before = baseline.get(section, {}).get(name)
+            if before is not None and before[key] > 0:
+                print(f"{name:>36}  {key} {before[key]:8.2f} -> {result[key]:8.2f}  ({result[key] / before[key]:.2f}x)")
+
+
+def main():
+    args = parse_args()
+    output = os.path.abspath(args.output)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    started = time.perf_counter()
+    fixture = fixtures.generate(args.movies, args.users, args.ratings_per_user, args.friends_per_user,
+                                args.session_share, seed=args.seed)
+    generate_seconds = time.perf_counter() - started
+    print(f"fixture {fixture.counts()} generated in {generate_seconds:.1f}s")
+
+    # the API loads its models from ./TrainedModels, so everything runs from the work directory
+    os.chdir(args.workdir or tempfile.mkdtemp(prefix="moviender-benchmark-"))
+    trained = train_models(fixture, args)
+    print(f"models trained in {trained['svd_seconds']:.1f}s (SVD) and {trained['knn_seconds']:.1f}s (KNN)")
+
+    os.environ["DB_NAME"] = args.db_name
+    os.environ["NOTIFICATION_TRANSPORT"] = "local"
+    if args.mongo_uri:
+        os.environ["DB_CONNECTION_STRING"] = args.mongo_uri
+    else:
+        # mongomock has no index support worth measuring
+        os.environ["ENSURE_INDEXES"] = "0"
+
+    measured = asyncio.run(run(args, fixture, trained))
+    results = {
+        "meta": {"revision": git_revision(), "timestamp": time.time(), "python": platform.python_version(),
+                 "backend": "mongod" if args.mongo_uri else "mongomock",
+                 "args": {key: value for key, value in vars(args).items() if key != "mongo_uri"},
+                 "fixture": fixture.counts(), "generate_seconds": generate_seconds,
+                 "load_seconds": measured["load_seconds"], "svd_seconds": trained["svd_seconds"],
+                 "knn_seconds": trained["knn_seconds"]},
+        "micro": measured["micro"],
+        "endpoints": measured["endpoints"],
+    }
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {output}")
+
+    if baseline is not None:
+        compare(results, baseline)
+
+
+if __name__ == "__main__":
+    main()
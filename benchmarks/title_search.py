@@ -0,0 +1,66 @@
+import argparse
+import importlib
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+catalog = importlib.import_module("moviender-app.catalog")
+search = importlib.import_module("moviender-app.search")
+
+WORDS = ["the", "star", "wars", "return", "of", "king", "night", "amélie", "city", "love", "dark", "knight", "lost",
+         "story", "toy", "matrix", "godfather", "alien", "blade", "runner", "café", "señor", "zoë", "man", "woman"]
+QUERIES = ["", "s", "ki", "the", "star", "amelie", "dark knight", "toy story", "xyz", "(", "godfather part"]
+
+
+def synthetic_movies(n_movies: int, seed: int):
+    rng = random.Random(seed)
+    return [{"movielens_id": str(movie_id), "title": " ".join(rng.choices(WORDS, k=rng.randint(1, 4))).title(),
+             "poster_path": f"/{movie_id}.jpg", "popularity": rng.random() * 100, "genre_ids": []}
+            for movie_id in range(n_movies)]
+
+
+def regex_search(movies_by_popularity, title: str):
+    # what Mongo does for the old $regex path: scan every title, then keep the 20 most popular
+    regx = re.compile(f".*{title}.*", re.IGNORECASE)
+    return [movie["movielens_id"] for movie in movies_by_popularity if regx.match(movie["title"])][:20]
+
+
+def timed(repeat: int, function, *args):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = function(*args)
+    return (time.perf_counter() - started) / repeat, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the regex title scan with the n-gram title index")
+    parser.add_argument("--movies", type=int, default=60000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    movies = synthetic_movies(args.movies, args.seed)
+    snapshot = catalog.CatalogSnapshot(movies, version=1)
+    movies_by_popularity = [movies[row] for row in snapshot.popularity_order]
+
+    started = time.perf_counter()
+    index = search.TitleSearchIndex(snapshot)
+    print(f"{args.movies} titles, index built in {time.perf_counter() - started:.2f}s")
+    print(f"{'query':>16} {'regex ms':>10} {'index ms':>10} {'speedup':>8}")
+
+    for query in QUERIES:
+        index_time, _ = timed(args.repeat, index.search, query, ["movielens_id"])
+        try:
+            regex_time, _ = timed(args.repeat, regex_search, movies_by_popularity, query)
+        except re.error:
+            # unescaped metacharacters make the old path fail outright
+            print(f"{query!r:>16} {'error':>10} {index_time * 1000:10.3f}")
+            continue
+        print(f"{query!r:>16} {regex_time * 1000:10.3f} {index_time * 1000:10.3f} {regex_time / index_time:7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+import asyncio
+import base64
+import binascii
+import hashlib
+import json
+import logging
+import time
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import bson
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.int64)
+METADATA_FIELDS = ["movielens_id", "title", "overview", "release_date", "poster_path", "genre_ids", "vote_average",
+                   "vote_count", "popularity"]
+_MISSING = object()
+
+
+def encode_page_key(popularity: float, movielens_id: str):
+    # opaque to clients, it names the last movie of a page rather than a position so it survives catalog refreshes
+    return base64.urlsafe_b64encode(json.dumps([popularity, movielens_id]).encode()).decode()
+
+
+def decode_page_key(page_key: str) -> Tuple[float, str]:
+    try:
+        popularity, movielens_id = json.loads(base64.urlsafe_b64decode(page_key.encode()))
+        return float(popularity), str(movielens_id)
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid page key {page_key!r}") from e
+
+
+def movies_digest(movies: List[dict]):
+    digest = hashlib.sha256()
+    for movie in movies:
+        digest.update(bson.BSON.encode(movie))
+    return digest.hexdigest()
+
+
+class CatalogSnapshot:
+    # a read-only columnar copy of the Movies collection, rows keep the collection's natural order
+    def __init__(self, movies: List[dict], version: int):
+        self.version = version
+        self.loaded_at = time.time()
+        self.movielens_ids = [movie["movielens_id"] for movie in movies]
+        self.index = {movielens_id: row for row, movielens_id in enumerate(self.movielens_ids)}
+        self.columns = {field: [movie.get(field, _MISSING) for movie in movies] for field in METADATA_FIELDS}
+
+        self.popularity = self._numeric_column(movies, "popularity")
+        self.vote_average = self._numeric_column(movies, "vote_average")
+        self.vote_count = self._numeric_column(movies, "vote_count")
+
+        genre_ids = sorted({genre_id for movie in movies for genre_id in movie.get("genre_ids", [])})
+        if len(genre_ids) > 64:
+            raise ValueError(f"The catalog has {len(genre_ids)} genres, genre masks hold at most 64")
+        self.genre_bits = {genre_id: np.uint64(1) << np.uint64(bit) for bit, genre_id in enumerate(genre_ids)}
+        self.genre_masks = np.zeros(len(movies), dtype=np.uint64)
+        for row, movie in enumerate(movies):
+            for genre_id in movie.get("genre_ids", []):
+                self.genre_masks[row] |= self.genre_bits[genre_id]
+        self.genre_counts = np.array([len(movie.get("genre_ids", [])) for movie in movies], dtype=np.int64)
+
+        # most popular first, ties broken by movielens_id so pages are deterministic
+        id_order = np.argsort(np.array(self.movielens_ids, dtype=str), kind="stable")
+        id_rank = np.empty(len(movies), dtype=np.int64)
+        id_rank[id_order] = np.arange(len(movies))
+        self.popularity_order = np.lexsort((id_rank, -self.popularity))
+        self._ordered_popularity = -self.popularity[self.popularity_order]
+        self._ordered_ids = np.array(self.movielens_ids, dtype=str)[self.popularity_order]
+
+    def __len__(self):
+        return len(self.movielens_ids)
+
+    @staticmethod
+    def _numeric_column(movies: List[dict], field: str):
+        return np.array([movie.get(field) or 0 for movie in movies], dtype=np.float64)
+
+    def genres_mask(self, genres_ids: Iterable[int]):
+        mask = np.uint64(0)
+        for genre_id in genres_ids:
+            mask |= self.genre_bits.get(genre_id, np.uint64(0))
+        return mask
+
+    def genre_overlap(self, genres_ids: Iterable[int], rows=None):
+        # number of the given genres each movie has, a popcount of the masked genre bits
+        masks = self.genre_masks if rows is None else self.genre_masks[rows]
+        shared = np.ascontiguousarray(masks & self.genres_mask(genres_ids))
+        return _POPCOUNT[shared.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+    def rows_with_any_genre(self, genres_ids: Iterable[int]):
+        return (self.genre_masks & self.genres_mask(genres_ids)) != 0
+
+    def rows(self, movielens_ids: Iterable[str]):
+        return [self.index[movielens_id] for movielens_id in movielens_ids if movielens_id in self.index]
+
+    def document(self, row: int, fields: List[str]):
+        # the same shape a $project on these fields returns, missing fields are left out
+        document = {}
+        for field in fields:
+            value = self.columns[field][row]
+            if value is not _MISSING:
+                document[field] = value
+        return document
+
+    def documents(self, rows: Iterable[int], fields: List[str]):
+        return [self.document(row, fields) for row in rows]
+
+    def position_after(self, popularity: float, movielens_id: str):
+        # where a movie with this popularity and id is, or would be, in popularity_order, plus one
+        start = np.searchsorted(self._ordered_popularity, -popularity, side="left")
+        end = np.searchsorted(self._ordered_popularity, -popularity, side="right")
+        return int(start + np.searchsorted(self._ordered_ids[start:end], movielens_id, side="right"))
+
+    def page(self, limit: int, page_key: Optional[str] = None, genres_ids: Iterable[int] = ()):
+        # rows of the page after page_key in popularity order, from a binary search and a short forward scan,
+        # so a page costs the same at any depth
+        position = self.position_after(*decode_page_key(page_key)) if page_key else 0
+        genres_mask = self.genres_mask(genres_ids)
+        if not genres_ids:
+            rows = self.popularity_order[position:position + limit]
+        elif genres_mask == 0:
+            rows = np.empty(0, dtype=np.int64)
+        else:
+            rows = np.empty(0, dtype=np.int64)
+            chunk = limit * 4
+            while position < len(self) and len(rows) < limit:
+                candidates = self.popularity_order[position:position + chunk]
+                matches = candidates[(self.genre_masks[candidates] & genres_mask) != 0]
+                rows = np.concatenate([rows, matches[:limit - len(rows)]])
+                position += chunk
+                chunk *= 2
+
+        next_page_key = None
+        if len(rows) == limit:
+            last = rows[-1]
+            next_page_key = encode_page_key(float(self.popularity[last]), self.movielens_ids[last])
+        return rows, next_page_key
+
+
+class MovieCatalog:
+    def __init__(self, db):
+        self._db = db
+        self._snapshot = None
+        self._digest = None
+        self._listeners: List[Callable[[CatalogSnapshot], None]] = []
+        self._refresh_lock = None
+
+    @property
+    def version(self):
+        return self._snapshot.version if self._snapshot is not None else 0
+
+    def add_refresh_listener(self, listener: Callable[[CatalogSnapshot], None]):
+        self._listeners.append(listener)
+
+    async def current(self) -> CatalogSnapshot:
+        if self._snapshot is None:
+            return await self.refresh()
+        return self._snapshot
+
+    async def refresh(self) -> CatalogSnapshot:
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+
+        async with self._refresh_lock:
+            started = time.perf_counter()
+            projection = {"_id": 0, **{field: 1 for field in METADATA_FIELDS}}
+            movies = await self._db.Movies.find({}, projection).to_list(length=None)
+            # an unchanged collection keeps its version, so the caches keyed on it and the search index stay valid
+            digest = await run_in_threadpool(movies_digest, movies)
+            if self._snapshot is not None and digest == self._digest:
+                logger.debug("Catalog version %s is unchanged", self._snapshot.version)
+                return self._snapshot
+            snapshot = await run_in_threadpool(CatalogSnapshot, movies, self.version + 1)
+
+            # what the listeners derive from the snapshot is built before any request can see it, until then
+            # requests keep the previous snapshot, readers keep whichever snapshot they already hold
+            for listener in self._listeners:
+                await run_in_threadpool(listener, snapshot)
+            self._snapshot = snapshot
+            self._digest = digest
+
+            logger.info("Loaded catalog version %s with %s movies in %.2fs", snapshot.version, len(snapshot),
+                        time.perf_counter() - started)
+            return snapshot
+
+    async def refresh_periodically(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Refreshing the movie catalog failed")
@@ -0,0 +1,64 @@
+from motor.motor_asyncio import AsyncIOMotorClient
+
+
+class Database:
+    # async access to the MovienderDB collections, the client is created on first use or by connect()
+    def __init__(self, connection_string: str, name: str = "MovienderDB", **client_options):
+        self._connection_string = connection_string
+        self._name = name
+        self._client_options = client_options
+        self._client = None
+        self._db = None
+
+    def connect(self, client=None, name: str = None):
+        # any Motor compatible client can be passed in, e.g. mongomock_motor.AsyncMongoMockClient() in tests,
+        # without one an existing connection is kept
+        if name is not None:
+            self._name = name
+        if client is None:
+            if self._client is not None:
+                return self._db
+            client = AsyncIOMotorClient(self._connection_string, **self._client_options)
+
+        self._client = client
+        self._db = client[self._name]
+        return self._db
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+        self._client = None
+        self._db = None
+
+    @property
+    def client(self):
+        if self._client is None:
+            self.connect()
+        return self._client
+
+    @property
+    def database(self):
+        if self._db is None:
+            self.connect()
+        return self._db
+
+    def collection(self, name: str):
+        if self._db is None:
+            self.connect()
+        return self._db[name]
+
+    @property
+    def Users(self):
+        return self.collection("Users")
+
+    @property
+    def Ratings(self):
+        return self.collection("Ratings")
+
+    @property
+    def Movies(self):
+        return self.collection("Movies")
+
+    @property
+    def Sessions(self):
+        return self.collection("Sessions")
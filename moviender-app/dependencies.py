@@ -1,12 +1,89 @@
-from pymongo import MongoClient
+from cachetools import TTLCache
 from dotenv import load_dotenv
+from functools import partial
 import os
 
+from .catalog import MovieCatalog
+from .database import Database
+from .events import EventHub, LocalEventBackend, MongoEventBackend
+from .fold_in import FoldInCache
+from .http_cache import ResponseCache
+from .metrics import MongoCommandListener
+from .mips import ItemFactorIndex
+from .model_registry import ModelRegistry
+from .neighbours import NeighbourTable, load_knn_neighbours
+from .notifications import FirebaseTransport, LocalTransport, NotificationDispatcher
+from .profiles import ProfileCache
+from .rating_buffer import RatingWriteBuffer
+from .scoring import SVDFactors, load_svd_factors
+from .search import TitleSearch
+
 load_dotenv()
 
-client = MongoClient(os.getenv("DB_CONNECTION_STRING"))
-db = client.MovienderDB
+db = Database(
+    os.getenv("DB_CONNECTION_STRING"),
+    name=os.getenv("DB_NAME", "MovienderDB"),
+    maxPoolSize=int(os.getenv("DB_MAX_POOL_SIZE", "100")),
+    minPoolSize=int(os.getenv("DB_MIN_POOL_SIZE", "0")),
+    maxIdleTimeMS=int(os.getenv("DB_MAX_IDLE_TIME_MS", "60000")),
+    waitQueueTimeoutMS=int(os.getenv("DB_WAIT_QUEUE_TIMEOUT_MS", "5000")),
+    event_listeners=[MongoCommandListener()]
+)
 PAGE_SIZE = 15
+ENSURE_INDEXES = os.getenv("ENSURE_INDEXES", "1") == "1"
+READINESS_PING_TIMEOUT = float(os.getenv("READINESS_PING_TIMEOUT", "2"))
+# new Movies documents reach every worker within this interval, or right away through /admin/catalog_refresh
+CATALOG_REFRESH_SECONDS = float(os.getenv("CATALOG_REFRESH_SECONDS", "300"))
+# the /admin endpoints answer 403 while no token is set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+catalog = MovieCatalog(db)
+title_search = TitleSearch()
+catalog.add_refresh_listener(title_search.rebuild)
+# other workers only drop their entries on expiry, so the ttl bounds how stale a user's list can get
+recommendation_cache = TTLCache(maxsize=int(os.getenv("RECOMMENDATION_CACHE_SIZE", "10000")),
+                                ttl=float(os.getenv("RECOMMENDATION_CACHE_TTL", "300")))
+fold_in_cache = FoldInCache(maxsize=int(os.getenv("FOLD_IN_CACHE_SIZE", "10000")))
+# encoded bodies of the catalog routes, clients revalidate them with If-None-Match after max-age
+response_cache = ResponseCache(maxsize=int(os.getenv("HTTP_CACHE_SIZE", "2048")),
+                               max_age=int(os.getenv("HTTP_CACHE_MAX_AGE", "60")))
+profile_cache = ProfileCache(db, maxsize=int(os.getenv("PROFILE_CACHE_SIZE", "10000")),
+                             ttl=float(os.getenv("PROFILE_CACHE_TTL", "300")))
+
+# ratings are written right away unless a window is set, then each user's ratings are written once per window
+# a failed write is retried after twice as long each time, then the ratings are dropped
+rating_buffer = RatingWriteBuffer(db, window=float(os.getenv("RATING_BUFFER_SECONDS", "0")),
+                                  max_retries=int(os.getenv("RATING_BUFFER_MAX_RETRIES", "5")))
+
+# session events reach subscribers on every uvicorn worker only through the mongo backend
+if os.getenv("EVENT_BACKEND", "local") == "mongo":
+    event_hub = EventHub(MongoEventBackend(db))
+else:
+    event_hub = EventHub(LocalEventBackend())
+SESSION_EVENTS_KEEPALIVE_SECONDS = float(os.getenv("SESSION_EVENTS_KEEPALIVE_SECONDS", "15"))
+
+# NOTIFICATION_TRANSPORT=local keeps notifications in memory instead of sending them through Firebase
+notification_dispatcher = NotificationDispatcher(
+    db,
+    LocalTransport() if os.getenv("NOTIFICATION_TRANSPORT", "firebase") == "local" else FirebaseTransport(),
+    batch_size=int(os.getenv("NOTIFICATION_BATCH_SIZE", "500")),
+    max_retries=int(os.getenv("NOTIFICATION_MAX_RETRIES", "5"))
+)
+
+# every array file of the svd export is re-hashed on each load, otherwise only their sizes are checked
+VERIFY_MODEL_CHECKSUMS = os.getenv("VERIFY_MODEL_CHECKSUMS", "0") == "1"
+model_registry = ModelRegistry(check_interval=float(os.getenv("MODEL_CHECK_INTERVAL", "30")))
+# the memory-mapped export of trainModels.py when there is one, models trained before it existed are pickles
+model_registry.register("svd", "TrainedModels/svd.json", partial(SVDFactors.load, verify=VERIFY_MODEL_CHECKSUMS),
+                        fallback=("TrainedModels/trainedSVDAlgo.model", load_svd_factors))
+# deployments not retrained since the table was exported only have the pickled KNNBaseline
+model_registry.register("knn_neighbours", "TrainedModels/knnNeighbours.npy", NeighbourTable.load,
+                        fallback=("TrainedModels/trainedKNNBaseline.model", load_knn_neighbours))
+# the svd item factors partitioned for top-k search, more probed partitions trade latency for recall
+item_factor_index = ItemFactorIndex(n_probe=int(os.getenv("MIPS_PROBES", "16")))
+model_registry.add_load_listener("svd", item_factor_index.rebuild)
+# share of the svd predicted rating in personal recommendations, 0 ranks by the catalog heuristic alone
+PERSONAL_MODEL_WEIGHT = float(os.getenv("PERSONAL_MODEL_WEIGHT", "0"))
 
 
 def get_db_client():
@@ -15,3 +92,47 @@ def get_db_client():
 
 def get_page_size():
     return PAGE_SIZE
+
+
+def get_model_registry():
+    return model_registry
+
+
+def get_catalog():
+    return catalog
+
+
+def get_recommendation_cache():
+    return recommendation_cache
+
+
+def get_fold_in_cache():
+    return fold_in_cache
+
+
+def get_profile_cache():
+    return profile_cache
+
+
+def get_response_cache():
+    return response_cache
+
+
+def get_title_search():
+    return title_search
+
+
+def get_event_hub():
+    return event_hub
+
+
+def get_rating_buffer():
+    return rating_buffer
+
+
+def get_notification_dispatcher():
+    return notification_dispatcher
+
+
+def get_item_factor_index():
+    return item_factor_index
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+from contextlib import contextmanager
+from typing import Callable, Dict, Set
+
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+
+logger = logging.getLogger(__name__)
+
+
+class LocalEventBackend:
+    # delivers events to the subscribers of this process only, enough for a single worker and for tests
+    async def start(self, deliver: Callable[[str, dict], None]):
+        self._deliver = deliver
+
+    async def stop(self):
+        pass
+
+    async def publish(self, channel: str, event: dict):
+        self._deliver(channel, event)
+
+
+class MongoEventBackend:
+    # events go through a capped collection that every worker tails, so subscribers connected to any worker
+    # see events published by all of them
+    def __init__(self, db, collection: str = "SessionEvents", size: int = 16 * 1024 * 1024,
+                 retry_interval: float = 1.0):
+        self._db = db
+        self._collection = collection
+        self._size = size
+        self._retry_interval = retry_interval
+        self._task = None
+
+    async def start(self, deliver: Callable[[str, dict], None]):
+        try:
+            await self._db.database.create_collection(self._collection, capped=True, size=self._size)
+        except CollectionInvalid:
+            pass
+        self._task = asyncio.create_task(self._tail(deliver))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def publish(self, channel: str, event: dict):
+        await self._db.collection(self._collection).insert_one({"channel": channel, "event": event})
+
+    async def _tail(self, deliver: Callable[[str, dict], None]):
+        collection = self._db.collection(self._collection)
+        # only events published after this worker started are delivered
+        last = await collection.find_one({}, sort=[("$natural", -1)])
+        last_id = last["_id"] if last is not None else None
+
+        while True:
+            try:
+                query = {"_id": {"$gt": last_id}} if last_id is not None else {}
+                cursor = collection.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+                while cursor.alive:
+                    async for document in cursor:
+                        last_id = document["_id"]
+                        deliver(document["channel"], document["event"])
+                    await asyncio.sleep(self._retry_interval)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Tailing the %s collection failed", self._collection)
+            # a tailable cursor on an empty capped collection dies right away, wait before opening another one
+            await asyncio.sleep(self._retry_interval)
+
+
+class EventHub:
+    # fans published events out to the local subscribers of each channel through a backend
+    def __init__(self, backend, queue_size: int = 100):
+        self._backend = backend
+        self._queue_size = queue_size
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+
+    async def start(self):
+        await self._backend.start(self._deliver)
+
+    async def stop(self):
+        await self._backend.stop()
+
+    async def publish(self, channel: str, event: dict):
+        # the state change is already stored, a lost event must not fail the request that made it
+        try:
+            await self._backend.publish(channel, event)
+        except Exception:
+            logger.exception("Publishing an event to %s failed", channel)
+
+    @contextmanager
+    def subscribe(self, channel: str):
+        queue = asyncio.Queue(maxsize=self._queue_size)
+        self._subscribers.setdefault(channel, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            subscribers = self._subscribers.get(channel)
+            subscribers.discard(queue)
+            if not subscribers:
+                del self._subscribers[channel]
+
+    def subscribers(self, channel: str):
+        return len(self._subscribers.get(channel, ()))
+
+    def _deliver(self, channel: str, event: dict):
+        for queue in self._subscribers.get(channel, ()):
+            if queue.full():
+                # events carry the whole new state, a subscriber that fell behind only needs the latest ones
+                queue.get_nowait()
+            queue.put_nowait(event)
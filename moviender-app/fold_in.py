@@ -0,0 +1,73 @@
+import threading
+from typing import Dict, Iterable
+
+import numpy as np
+from cachetools import LRUCache
+
+from .metrics import record_cache_lookup
+from .model_registry import LoadedModel
+from .scoring import SVDFactors
+
+
+def fold_in_user(model: SVDFactors, ratings: Dict[str, float]):
+    # bias and factor vector of a user the model was not trained on: a ridge regression of the user's ratings
+    # on the frozen item biases and factors, with the regularization the model was trained with. Surprise's SGD
+    # applies the penalty with every rating, so it is scaled by the number of ratings here
+    inner_iids = model.inner_iids(list(ratings.keys()))
+    rated = inner_iids >= 0
+    if not rated.any():
+        return None
+
+    inner_iids = inner_iids[rated]
+    values = np.fromiter(ratings.values(), dtype=np.float64, count=len(ratings))[rated]
+    item_factors = model.qi[inner_iids]
+
+    if model.biased:
+        design = np.hstack([np.ones((len(inner_iids), 1)), item_factors])
+        targets = values - model.global_mean - model.bi[inner_iids]
+        regularization = np.array([model.reg_bu] + [model.reg_pu] * item_factors.shape[1])
+    else:
+        design = item_factors
+        targets = values
+        regularization = np.full(item_factors.shape[1], model.reg_pu)
+
+    solution = np.linalg.solve(design.T @ design + len(values) * np.diag(regularization),
+                               design.T @ targets)
+
+    if model.biased:
+        return solution[0], solution[1:]
+    return 0.0, solution
+
+
+class FoldInCache:
+    # folded-in users per uid, dropped when the model version changes or the user's ratings do
+    def __init__(self, maxsize: int = 10000):
+        self._cache = LRUCache(maxsize=maxsize)
+        self._lock = threading.Lock()
+
+    def factors(self, entry: LoadedModel, uid: str, ratings: Dict[str, float]):
+        with self._lock:
+            cached = self._cache.get(uid)
+        if cached is not None and cached[0] == entry.version:
+            record_cache_lookup("fold_in", True)
+            return cached[1]
+        record_cache_lookup("fold_in", False)
+
+        factors = fold_in_user(entry.model, ratings)
+        with self._lock:
+            self._cache[uid] = (entry.version, factors)
+        return factors
+
+    def fold_in_users(self, entry: LoadedModel, users_ratings: Dict[str, Dict[str, float]]):
+        fold_ins = {}
+        for uid, ratings in users_ratings.items():
+            if entry.model.inner_uid(uid) is None:
+                factors = self.factors(entry, uid, ratings)
+                if factors is not None:
+                    fold_ins[uid] = factors
+        return fold_ins
+
+    def invalidate(self, uids: Iterable[str]):
+        with self._lock:
+            for uid in uids:
+                self._cache.pop(uid, None)
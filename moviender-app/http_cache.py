@@ -0,0 +1,63 @@
+import hashlib
+import json
+from typing import Awaitable, Callable, NamedTuple
+
+from cachetools import LRUCache
+from fastapi.encoders import jsonable_encoder
+from starlette.requests import Request
+from starlette.responses import Response
+
+from .metrics import record_cache_lookup
+
+
+class CachedBody(NamedTuple):
+    body: bytes
+    etag: str
+
+
+def encode_json(content):
+    # the same bytes JSONResponse renders
+    return json.dumps(jsonable_encoder(content), ensure_ascii=False, allow_nan=False, indent=None,
+                      separators=(",", ":")).encode("utf-8")
+
+
+def make_etag(body: bytes):
+    # from the body alone, so every worker gives the same response the same tag
+    return f'"{hashlib.blake2b(body, digest_size=12).hexdigest()}"'
+
+
+def etag_matches(request: Request, etag: str):
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is None:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+class ResponseCache:
+    # encoded JSON bodies of responses that only change with the catalog, keyed by route, parameters and catalog
+    # version, entries of older versions are left for the LRU to evict
+    def __init__(self, maxsize: int = 2048, max_age: int = 60):
+        self._cache = LRUCache(maxsize=maxsize)
+        self.max_age = max_age
+
+    async def body(self, key: tuple, version: int, build: Callable[[], Awaitable[object]]) -> CachedBody:
+        cached = self._cache.get((key, version))
+        record_cache_lookup("http", cached is not None)
+        if cached is None:
+            body = encode_json(await build())
+            cached = CachedBody(body, make_etag(body))
+            self._cache[(key, version)] = cached
+        return cached
+
+    def response(self, request: Request, cached: CachedBody, cache_control: str = None):
+        headers = {"ETag": cached.etag, "Cache-Control": cache_control or f"public, max-age={self.max_age}"}
+        if etag_matches(request, cached.etag):
+            return Response(status_code=304, headers=headers)
+        return Response(cached.body, media_type="application/json", headers=headers)
+
+    async def respond(self, request: Request, key: tuple, version: int, build: Callable[[], Awaitable[object]]):
+        return self.response(request, await self.body(key, version, build))
+
+    def clear(self):
+        self._cache.clear()
@@ -0,0 +1,63 @@
+import argparse
+import asyncio
+import logging
+from typing import Dict, List
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+logger = logging.getLogger(__name__)
+
+# every index the API relies on, friend_list.<uid> lookups are always anchored on the unique uid
+INDEXES: Dict[str, List[IndexModel]] = {
+    "Users": [
+        IndexModel([("uid", ASCENDING)], name="uid", unique=True),
+        IndexModel([("username", ASCENDING)], name="username", unique=True),
+    ],
+    "Ratings": [
+        IndexModel([("uid", ASCENDING)], name="uid", unique=True),
+    ],
+    "Movies": [
+        IndexModel([("movielens_id", ASCENDING)], name="movielens_id", unique=True),
+        IndexModel([("genre_ids", ASCENDING), ("popularity", DESCENDING)], name="genre_ids_popularity"),
+    ],
+    "Sessions": [
+        IndexModel([("users_in_session", ASCENDING)], name="users_in_session"),
+    ],
+}
+
+
+async def ensure_indexes(db):
+    # creating an index that already exists is a no-op, so this runs on every startup
+    for collection, indexes in INDEXES.items():
+        names = await db.collection(collection).create_indexes(indexes)
+        logger.info("Ensured indexes %s on %s", ", ".join(names), collection)
+
+
+def plan_stages(plan: dict):
+    # the stages of an explained winning plan, the slot based engine wraps the plan in queryPlan
+    if "stage" in plan:
+        yield plan["stage"]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from plan_stages(plan[key])
+    for stage in plan.get("inputStages", []):
+        yield from plan_stages(stage)
+
+
+async def run(args):
+    from .dependencies import get_db_client
+
+    await ensure_indexes(get_db_client())
+
+
+def main():
+    # the query plans are checked by tests/test_indexes.py against the queries the routes actually send
+    parser = argparse.ArgumentParser(description="Create the indexes of MovienderDB")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
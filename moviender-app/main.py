@@ -1,15 +1,133 @@
-import firebase_admin
-from fastapi import FastAPI
+import asyncio
+import hmac
+import logging
+import numpy as np
+from fastapi import FastAPI, Header, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
+from .dependencies import get_db_client, get_model_registry, get_catalog, get_event_hub, get_rating_buffer, \
+    get_notification_dispatcher, CATALOG_REFRESH_SECONDS, ENSURE_INDEXES, READINESS_PING_TIMEOUT, ADMIN_TOKEN
+from .indexes import ensure_indexes
+from .metrics import MetricsMiddleware, latest_metrics
+from .model_registry import ModelNotLoaded
 from .routers import users, movies, friends, sessions
+from .scoring import estimate_ratings
+from .warmup import WarmUp
 
-default_app = firebase_admin.initialize_app()
+logger = logging.getLogger(__name__)
+
+# refresh requests go through the event hub, with the mongo backend they reach every worker
+CATALOG_CHANNEL = "catalog"
 
 app = FastAPI()
+app.add_middleware(MetricsMiddleware)
 app.include_router(users.router)
 app.include_router(movies.router)
 app.include_router(friends.router)
 app.include_router(sessions.router)
 
+warm_up = WarmUp()
+
+
+@app.exception_handler(ModelNotLoaded)
+async def model_not_loaded(request: Request, e: ModelNotLoaded):
+    # the warm-up is still loading the model or retrying a failed load, requests never load it themselves
+    return JSONResponse(status_code=503, content={"detail": str(e)},
+                        headers={"Retry-After": str(int(warm_up.retry_interval))})
+
+
+async def load_models():
+    # the svd item factor index is built by the registry's load listener, on every later reload as well
+    await run_in_threadpool(get_model_registry().load_all)
+
+
+def predict_once():
+    # the first prediction pages in the memory-mapped item factors and initializes BLAS
+    model = get_model_registry().get("svd")
+    estimate_ratings(model, [str(model.user_ids[0])] if len(model.user_ids) else [], np.arange(len(model.item_ids)))
+
+
+async def warm_up_models():
+    await run_in_threadpool(predict_once)
+
+
+async def load_catalog():
+    # the title search index is built by the catalog's refresh listener
+    await get_catalog().refresh()
+    if CATALOG_REFRESH_SECONDS > 0:
+        asyncio.create_task(get_catalog().refresh_periodically(CATALOG_REFRESH_SECONDS))
+
+
+async def follow_catalog_refreshes():
+    with get_event_hub().subscribe(CATALOG_CHANNEL) as events:
+        while True:
+            await events.get()
+            try:
+                await get_catalog().refresh()
+            except Exception:
+                logger.exception("Refreshing the catalog on request failed")
+
+
+@app.on_event("startup")
+async def connect_to_database():
+    get_db_client().connect()
+
+
+@app.on_event("startup")
+async def create_indexes():
+    if not ENSURE_INDEXES:
+        return
+    try:
+        await ensure_indexes(get_db_client())
+    except Exception:
+        # e.g. duplicate usernames block the unique index, the API still works without it, only slower
+        logger.exception("Creating the database indexes failed")
+
+
+@app.on_event("startup")
+async def start_event_hub():
+    await get_event_hub().start()
+
+
+@app.on_event("startup")
+async def start_following_catalog_refreshes():
+    asyncio.create_task(follow_catalog_refreshes())
+
+
+@app.on_event("startup")
+async def start_notification_dispatcher():
+    await get_notification_dispatcher().start()
+
+
+@app.on_event("startup")
+async def start_warm_up():
+    warm_up.start([("models", load_models), ("catalog", load_catalog), ("predict", warm_up_models)])
+
+
+@app.on_event("shutdown")
+async def stop_warm_up():
+    await warm_up.stop()
+
+
+@app.on_event("shutdown")
+async def stop_notification_dispatcher():
+    await get_notification_dispatcher().stop()
+
+
+@app.on_event("shutdown")
+async def stop_event_hub():
+    await get_event_hub().stop()
+
+
+@app.on_event("shutdown")
+async def flush_ratings():
+    await get_rating_buffer().flush_all()
+
+
+@app.on_event("shutdown")
+async def close_database():
+    get_db_client().close()
+
 
 @app.get("/")
 async def root():
@@ -21,3 +139,43 @@ async def say_hello(name: str):
     return {"message": f"Hello {name}"}
 
 
+@app.get("/healthz")
+async def get_liveness():
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+async def get_readiness(response: Response):
+    status = warm_up.status()
+    if status["ready"]:
+        try:
+            await asyncio.wait_for(get_db_client().database.command("ping"), READINESS_PING_TIMEOUT)
+        except Exception as e:
+            status = {**status, "ready": False, "error": f"database: {e}"}
+    if not status["ready"]:
+        response.status_code = 503
+    return status
+
+
+@app.get("/model_versions")
+async def get_model_versions():
+    return get_model_registry().versions()
+
+
+@app.get("/notification_queue")
+async def get_notification_queue():
+    return get_notification_dispatcher().stats()
+
+
+@app.post("/admin/catalog_refresh")
+async def request_catalog_refresh(x_admin_token: str = Header(None)):
+    if not ADMIN_TOKEN or not hmac.compare_digest(x_admin_token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    await get_event_hub().publish(CATALOG_CHANNEL, {"type": "refresh", "data": {}})
+    return {"catalog_version": get_catalog().version}
+
+
+@app.get("/metrics")
+async def get_metrics():
+    content, content_type = latest_metrics()
+    return Response(content=content, headers={"Content-Type": content_type})
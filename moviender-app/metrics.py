@@ -0,0 +1,104 @@
+import os
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+from pymongo import monitoring
+
+REQUEST_DURATION = Histogram("moviender_request_duration_seconds", "HTTP request latency",
+                             ["method", "route", "status"])
+# server-sent event streams stay open for as long as the client watches, they would swamp the request latencies
+STREAM_DURATION = Histogram("moviender_stream_duration_seconds", "How long streamed responses stay open",
+                            ["route", "status"], buckets=(1, 10, 60, 300, 900, 1800, 3600, 4 * 3600))
+MONGO_COMMAND_DURATION = Histogram("moviender_mongo_command_duration_seconds", "MongoDB command latency",
+                                   ["collection", "command"])
+MONGO_COMMAND_FAILURES = Counter("moviender_mongo_command_failures_total", "Failed MongoDB commands",
+                                 ["collection", "command"])
+MODEL_LOAD_DURATION = Histogram("moviender_model_load_duration_seconds", "Time to load a trained model", ["model"],
+                                buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120))
+INFERENCE_DURATION = Histogram("moviender_inference_duration_seconds", "Time to compute recommendations",
+                               ["operation"])
+CACHE_LOOKUPS = Counter("moviender_cache_lookups_total", "Cache lookups by result", ["cache", "result"])
+
+# commands the driver sends on its own, they say nothing about the API's queries
+_IGNORED_COMMANDS = {"hello", "ismaster", "isMaster", "ping", "endSessions", "saslStart", "saslContinue",
+                     "buildInfo", "getnonce"}
+
+
+def record_cache_lookup(cache: str, hit: bool):
+    CACHE_LOOKUPS.labels(cache, "hit" if hit else "miss").inc()
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    # pymongo command monitoring, events are sent from the threads that run the commands
+    def __init__(self):
+        self._collections = {}
+
+    def started(self, event):
+        if event.command_name in _IGNORED_COMMANDS:
+            return
+        if event.command_name == "getMore":
+            collection = event.command.get("collection")
+        else:
+            collection = event.command.get(event.command_name)
+        self._collections[(event.connection_id, event.request_id)] = \
+            collection if isinstance(collection, str) else ""
+
+    def succeeded(self, event):
+        collection = self._collections.pop((event.connection_id, event.request_id), None)
+        if collection is not None:
+            MONGO_COMMAND_DURATION.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        collection = self._collections.pop((event.connection_id, event.request_id), None)
+        if collection is not None:
+            MONGO_COMMAND_DURATION.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+            MONGO_COMMAND_FAILURES.labels(collection, event.command_name).inc()
+
+
+class MetricsMiddleware:
+    # plain ASGI middleware, labels requests with the route template so ids in paths don't add series
+    def __init__(self, app):
+        self.app = app
+        self._route_paths = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+        streaming = False
+
+        async def send_with_status(message):
+            nonlocal status, streaming
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                streaming = any(name == b"content-type" and value.startswith(b"text/event-stream")
+                                for name, value in message.get("headers", []))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            if streaming:
+                STREAM_DURATION.labels(self._route(scope), status).observe(time.perf_counter() - started)
+            else:
+                REQUEST_DURATION.labels(scope["method"], self._route(scope), status).observe(
+                    time.perf_counter() - started)
+
+    def _route(self, scope):
+        if self._route_paths is None:
+            self._route_paths = {route.endpoint: route.path for route in scope["app"].routes
+                                 if hasattr(route, "endpoint")}
+        return self._route_paths.get(scope.get("endpoint"), "unmatched")
+
+
+def latest_metrics():
+    # with several worker processes every worker writes to PROMETHEUS_MULTIPROC_DIR and this merges them
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
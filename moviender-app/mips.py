@@ -0,0 +1,136 @@
+import threading
+
+import numpy as np
+
+from .model_registry import LoadedModel, ModelNotLoaded
+from .scoring import SVDFactors, top_n_indices
+
+
+def kmeans(points, n_clusters: int, n_iter: int = 10, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    centroids = points[rng.choice(len(points), n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        assignments = nearest_centroids(points, centroids)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, points)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, np.newaxis]
+        # clusters that lost all their points start over from a random point
+        centroids[empty] = points[rng.choice(len(points), int(empty.sum()), replace=False)]
+    return centroids
+
+
+def nearest_centroids(points, centroids, chunk_size: int = 8192):
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    assignments = np.empty(len(points), dtype=np.int64)
+    for start in range(0, len(points), chunk_size):
+        chunk = points[start:start + chunk_size]
+        assignments[start:start + chunk_size] = np.argmin(centroid_norms - 2 * chunk @ centroids.T, axis=1)
+    return assignments
+
+
+class InnerProductIndex:
+    # top-k maximum inner product search: the vectors are padded to the same norm so the nearest centroids are the
+    # ones with the largest inner products, k-means partitions them and a query re-ranks the items of the
+    # partitions closest to it exactly
+    def __init__(self, vectors, n_partitions: int = None, n_iter: int = 10, sample_size: int = 20000, seed: int = 0):
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float64)
+        n_items, dimensions = self.vectors.shape
+        n_partitions = min(n_partitions or max(1, int(np.sqrt(n_items))), n_items)
+
+        norms = (self.vectors ** 2).sum(axis=1)
+        padded = np.hstack([self.vectors, np.sqrt(norms.max() - norms)[:, np.newaxis]])
+        rng = np.random.default_rng(seed)
+        sample = padded[rng.choice(n_items, min(sample_size, n_items), replace=False)]
+        centroids = kmeans(sample, n_partitions, n_iter, seed)
+        assignments = nearest_centroids(padded, centroids)
+
+        # a query is padded with 0, so its distance to a centroid only needs the unpadded part
+        self._centroids = centroids[:, :dimensions]
+        self._centroid_norms = (centroids ** 2).sum(axis=1)
+        self.order = np.argsort(assignments, kind="stable")
+        self.offsets = np.searchsorted(assignments[self.order], np.arange(n_partitions + 1))
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @property
+    def n_partitions(self):
+        return len(self._centroids)
+
+    def search(self, query, k: int, n_probe: int, exclude=None):
+        # the k items with the largest inner product with query among the n_probe closest partitions, more
+        # partitions are scanned while too few items are left after the excluded ones
+        closeness = 2 * self._centroids @ query - self._centroid_norms
+        partitions = np.argsort(-closeness, kind="stable")
+
+        probed = 0
+        candidates = np.empty(0, dtype=np.int64)
+        while probed < len(partitions):
+            batch = partitions[probed:probed + n_probe]
+            probed += len(batch)
+            found = np.concatenate([self.order[self.offsets[partition]:self.offsets[partition + 1]]
+                                    for partition in batch])
+            if exclude is not None:
+                found = found[~exclude[found]]
+            candidates = np.concatenate([candidates, found])
+            if len(candidates) >= k:
+                break
+
+        scores = self.vectors[candidates] @ query
+        top = top_n_indices(scores, k)
+        return candidates[top], scores[top]
+
+    def brute_force(self, query, k: int, exclude=None):
+        scores = self.vectors @ query
+        if exclude is not None:
+            scores = np.where(exclude, -np.inf, scores)
+        top = top_n_indices(scores, k)
+        top = top[np.isfinite(scores[top])]
+        return top, scores[top]
+
+
+def item_vectors(model: SVDFactors):
+    # a user's predicted rating is global_mean + bu + bi + pu . qi, so within one user the order of the movies
+    # is the order of [1, pu] . [bi, qi]
+    if model.biased:
+        return np.hstack([np.asarray(model.bi)[:, np.newaxis], model.qi])
+    return np.asarray(model.qi)
+
+
+def user_query(model: SVDFactors, pu):
+    if model.biased:
+        return np.concatenate([[1.0], pu])
+    return np.asarray(pu, dtype=np.float64)
+
+
+class ItemFactorIndex:
+    # the inner product index of the latest SVD model, built by the model registry before the model is served
+    def __init__(self, n_probe: int = 16):
+        self.n_probe = n_probe
+        self._current = None
+        self._previous = None
+        self._lock = threading.Lock()
+
+    def rebuild(self, entry: LoadedModel):
+        index = InnerProductIndex(item_vectors(entry.model))
+        with self._lock:
+            # requests that still hold the previous model keep its index
+            self._previous, self._current = self._current, (entry.version, index)
+
+    def index_for(self, entry: LoadedModel):
+        for built in (self._current, self._previous):
+            if built is not None and built[0] == entry.version:
+                return built[1]
+        raise ModelNotLoaded(f"{entry.name} index")
+
+    def top_movies(self, entry: LoadedModel, pu, k: int, exclude_movie_ids=()):
+        # movielens ids of the k movies with the highest predicted rating for a user with factors pu
+        model = entry.model
+        exclude = np.zeros(len(model.item_ids), dtype=bool)
+        excluded = model.inner_iids(list(exclude_movie_ids))
+        exclude[excluded[excluded >= 0]] = True
+
+        items, _ = self.index_for(entry).search(user_query(model, pu), k, self.n_probe, exclude)
+        return [str(movie_id) for movie_id in model.item_ids[items]]
@@ -0,0 +1,140 @@
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Tuple
+
+from .metrics import MODEL_LOAD_DURATION
+
+logger = logging.getLogger(__name__)
+
+
+class ModelNotLoaded(Exception):
+    # raised to requests that need a model before the warm-up has loaded it, the API answers 503
+    def __init__(self, name: str):
+        super().__init__(f"Model {name} is not loaded yet")
+        self.name = name
+
+
+class LoadedModel(NamedTuple):
+    name: str
+    path: str
+    version: str
+    loaded_at: float
+    model: object
+
+
+def file_version(path: str):
+    stat = os.stat(path)
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+
+def load_surprise_model(path: str):
+    from surprise import dump
+
+    # load a tuple with (prediction, trained-algorithm) and keep just the algorithm
+    return dump.load(path)[1]
+
+
+class ModelRegistry:
+    def __init__(self, check_interval: float = 30.0):
+        self._check_interval = check_interval
+        self._sources: Dict[str, list] = {}
+        self._models: Dict[str, LoadedModel] = {}
+        self._last_check: Dict[str, float] = {}
+        self._reloading = set()
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._load_listeners: Dict[str, List[Callable[[LoadedModel], None]]] = {}
+
+    def register(self, name: str, path: str, loader: Callable[[str], object] = load_surprise_model,
+                 fallback: Tuple[str, Callable[[str], object]] = None):
+        # the fallback (path, loader) is used while path does not exist, the update check switches to path once
+        # it appears
+        self._sources[name] = [(path, loader)] + ([fallback] if fallback is not None else [])
+        self._load_locks[name] = threading.Lock()
+
+    def add_load_listener(self, name: str, listener: Callable[[LoadedModel], None]):
+        # called with every newly loaded version of the model, in the loading thread, before requests get it
+        self._load_listeners.setdefault(name, []).append(listener)
+
+    def _source(self, name: str):
+        sources = self._sources[name]
+        for path, loader in sources:
+            if os.path.exists(path):
+                return path, loader
+        return sources[0]
+
+    def load_all(self):
+        for name in self._sources:
+            self.load(name)
+
+    def load(self, name: str):
+        # blocking, called by the warm-up and the reload thread, never from a request on the event loop
+        path, loader = self._source(name)
+        with self._load_locks[name]:
+            version = file_version(path)
+            loaded = self._models.get(name)
+            if loaded is not None and loaded.path == path and loaded.version == version:
+                # another thread loaded this version while this one waited for the lock
+                return loaded
+
+            started = time.perf_counter()
+            model = loader(path)
+            MODEL_LOAD_DURATION.labels(name).observe(time.perf_counter() - started)
+            entry = LoadedModel(name=name, path=path, version=version, loaded_at=time.time(), model=model)
+            for listener in self._load_listeners.get(name, ()):
+                listener(entry)
+
+            # a single reference assignment, requests holding the previous model keep using it untouched
+            self._models[name] = entry
+            self._last_check[name] = time.monotonic()
+        logger.info("Loaded model %s version %s in %.2fs", name, version, time.perf_counter() - started)
+        return entry
+
+    def loaded(self, name: str):
+        return name in self._models
+
+    def entry(self, name: str):
+        entry = self._models.get(name)
+        if entry is None:
+            raise ModelNotLoaded(name)
+
+        self._check_for_update(entry)
+        return entry
+
+    def get(self, name: str):
+        return self.entry(name).model
+
+    def versions(self):
+        return {name: {"version": entry.version, "path": entry.path, "loaded_at": entry.loaded_at}
+                for name, entry in self._models.items()}
+
+    def _check_for_update(self, entry: LoadedModel):
+        now = time.monotonic()
+        if now - self._last_check.get(entry.name, 0.0) < self._check_interval:
+            return
+        self._last_check[entry.name] = now
+
+        try:
+            path, _ = self._source(entry.name)
+            changed = path != entry.path or file_version(path) != entry.version
+        except OSError:
+            return
+
+        if changed:
+            with self._lock:
+                if entry.name in self._reloading:
+                    return
+                self._reloading.add(entry.name)
+            threading.Thread(target=self._reload, args=(entry.name,), daemon=True).start()
+
+    def _reload(self, name: str):
+        try:
+            self.load(name)
+        except Exception:
+            # keep serving the model that is already loaded, the next check will try again
+            logger.exception("Reloading model %s failed", name)
+        finally:
+            with self._lock:
+                self._reloading.discard(name)
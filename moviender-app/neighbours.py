@@ -0,0 +1,66 @@
+from typing import List
+
+import numpy as np
+
+from .scoring import top_n_indices
+
+NO_NEIGHBOUR = -1
+NUM_OF_NEIGHBOURS = 50
+
+
+def neighbour_table_dtype(k: int):
+    return np.dtype([("movie_id", "<i4"), ("neighbours", "<i4", (k,)), ("similarities", "<f4", (k,))])
+
+
+def build_neighbour_table(algo, k: int = NUM_OF_NEIGHBOURS):
+    trainset = algo.trainset
+    movie_ids = np.array([int(trainset.to_raw_iid(inner_id)) for inner_id in trainset.all_items()], dtype=np.int32)
+
+    table = np.zeros(trainset.n_items, dtype=neighbour_table_dtype(k))
+    table["neighbours"] = NO_NEIGHBOUR
+
+    # rows are sorted by movielens id so the API can find a movie with a binary search
+    for row, inner_id in enumerate(np.argsort(movie_ids, kind="stable")):
+        similarities = algo.sim[inner_id].copy()
+        similarities[inner_id] = -np.inf
+
+        # same neighbours and order as algo.get_neighbors(inner_id, k)
+        nearest = top_n_indices(similarities, min(k, trainset.n_items - 1))
+
+        table["movie_id"][row] = movie_ids[inner_id]
+        table["neighbours"][row, :len(nearest)] = movie_ids[nearest]
+        table["similarities"][row, :len(nearest)] = similarities[nearest]
+    return table
+
+
+class NeighbourTable:
+    # top-k similar movies per movielens_id, rows sorted by movie_id and read straight from the memory-mapped file
+    def __init__(self, table):
+        self.table = table
+        self.movie_ids = table["movie_id"]
+
+    @classmethod
+    def load(cls, path: str):
+        return cls(np.load(path, mmap_mode="r"))
+
+    @classmethod
+    def from_algo(cls, algo, k: int = NUM_OF_NEIGHBOURS):
+        return cls(build_neighbour_table(algo, k))
+
+    def row(self, movielens_id: str):
+        movie_id = int(movielens_id)
+        row = int(np.searchsorted(self.movie_ids, movie_id))
+        if row == len(self.movie_ids) or self.movie_ids[row] != movie_id:
+            raise ValueError(f"Movie {movielens_id} is not part of the trained model")
+        return self.table[row]
+
+    def similar(self, movielens_id: str, k: int = 20) -> List[str]:
+        neighbours = self.row(movielens_id)["neighbours"][:k]
+        return [str(movie_id) for movie_id in neighbours.tolist() if movie_id != NO_NEIGHBOUR]
+
+
+def load_knn_neighbours(path: str):
+    # models trained before the table was exported, the table is built from the pickled similarity matrix
+    from .model_registry import load_surprise_model
+
+    return NeighbourTable.from_algo(load_surprise_model(path))
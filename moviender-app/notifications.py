@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import random
+from enum import Enum
+from typing import Dict, List, NamedTuple
+
+from pymongo import UpdateOne
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+
+class Notification(NamedTuple):
+    uid: str
+    token: str
+    data: Dict[str, str]
+    attempt: int = 0
+
+
+class Delivery(Enum):
+    SENT = "sent"
+    RETRY = "retry"
+    INVALID_TOKEN = "invalid_token"
+    FAILED = "failed"
+
+
+class FirebaseTransport:
+    # one FCM batch request for up to 500 messages
+    max_batch_size = 500
+
+    def initialize(self):
+        # credentials come from GOOGLE_APPLICATION_CREDENTIALS, read once the app starts instead of on import
+        import firebase_admin
+
+        try:
+            firebase_admin.get_app()
+        except ValueError:
+            firebase_admin.initialize_app()
+
+    def send(self, notifications: List[Notification]) -> List[Delivery]:
+        from firebase_admin import exceptions, messaging
+
+        messages = [messaging.Message(data=notification.data, token=notification.token)
+                    for notification in notifications]
+        send_each = getattr(messaging, "send_each", None) or messaging.send_all
+        responses = send_each(messages).responses
+        return [self._delivery(response, exceptions, messaging) for response in responses]
+
+    @staticmethod
+    def _delivery(response, exceptions, messaging):
+        if response.success:
+            return Delivery.SENT
+        error = response.exception
+        # only these say the token itself is gone, an invalid argument is just as likely a bad payload
+        if isinstance(error, (messaging.UnregisteredError, messaging.SenderIdMismatchError)):
+            return Delivery.INVALID_TOKEN
+        if isinstance(error, (messaging.QuotaExceededError, exceptions.UnavailableError, exceptions.InternalError,
+                              exceptions.DeadlineExceededError)):
+            return Delivery.RETRY
+        return Delivery.FAILED
+
+
+class LocalTransport:
+    # keeps what would have been sent, for tests and for running without Firebase credentials
+    max_batch_size = 500
+
+    def __init__(self, invalid_tokens=(), failures: int = 0):
+        self.batches: List[List[Notification]] = []
+        self.invalid_tokens = set(invalid_tokens)
+        # the first batches that fail as if the service were unavailable
+        self.failures = failures
+
+    def initialize(self):
+        pass
+
+    def send(self, notifications: List[Notification]) -> List[Delivery]:
+        if self.failures > 0:
+            self.failures -= 1
+            return [Delivery.RETRY] * len(notifications)
+
+        self.batches.append(notifications)
+        return [Delivery.INVALID_TOKEN if notification.token in self.invalid_tokens else Delivery.SENT
+                for notification in notifications]
+
+
+class NotificationDispatcher:
+    # a queue of push notifications sent in batches by one background worker, request handlers only enqueue
+    def __init__(self, db, transport, batch_size: int = 500, batch_wait: float = 0.05, max_retries: int = 5,
+                 backoff: float = 0.5, max_queue_size: int = 10000):
+        self._db = db
+        self._transport = transport
+        self._batch_size = min(batch_size, transport.max_batch_size)
+        self._batch_wait = batch_wait
+        self._max_retries = max_retries
+        self._backoff = backoff
+        self._queue = None
+        self._max_queue_size = max_queue_size
+        self._task = None
+        self._retrying = 0
+        self.counts = {delivery.value: 0 for delivery in Delivery}
+        self.counts["dropped"] = 0
+
+    @property
+    def queue(self):
+        # created on first use so it belongs to the running event loop
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self._max_queue_size)
+        return self._queue
+
+    def depth(self):
+        return self.queue.qsize() + self._retrying
+
+    def stats(self):
+        return {"queued": self.queue.qsize(), "retrying": self._retrying, **self.counts}
+
+    def enqueue(self, uid: str, token: str, data: Dict[str, str]):
+        try:
+            self.queue.put_nowait(Notification(uid, token, data))
+            return True
+        except asyncio.QueueFull:
+            self.counts["dropped"] += 1
+            logger.warning("Notification queue is full, dropped a notification to %s", uid)
+            return False
+
+    async def start(self):
+        self._transport.initialize()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout: float = 5.0):
+        # give queued notifications a chance to go out before shutting down
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Stopped with %s notifications still queued", self.depth())
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._send(batch)
+            except Exception:
+                logger.exception("Sending %s notifications failed", len(batch))
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    async def _next_batch(self):
+        batch = [await self.queue.get()]
+        deadline = asyncio.get_event_loop().time() + self._batch_wait
+        while len(batch) < self._batch_size:
+            remaining = deadline - asyncio.get_event_loop().time()
+            try:
+                batch.append(self.queue.get_nowait() if remaining <= 0 else
+                             await asyncio.wait_for(self.queue.get(), remaining))
+            except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                break
+        return batch
+
+    async def _send(self, batch: List[Notification]):
+        try:
+            deliveries = await run_in_threadpool(self._transport.send, batch)
+        except Exception:
+            logger.exception("Notification transport failed for %s notifications", len(batch))
+            deliveries = [Delivery.RETRY] * len(batch)
+
+        invalid = []
+        for notification, delivery in zip(batch, deliveries):
+            if delivery == Delivery.RETRY and notification.attempt >= self._max_retries:
+                delivery = Delivery.FAILED
+            self.counts[delivery.value] += 1
+
+            if delivery == Delivery.RETRY:
+                self._retry_later(notification._replace(attempt=notification.attempt + 1))
+            elif delivery == Delivery.INVALID_TOKEN:
+                invalid.append(notification)
+
+        if invalid:
+            await self._drop_tokens(invalid)
+
+    def _retry_later(self, notification: Notification):
+        # exponential backoff with jitter, so a provider outage is not hammered by every worker at once
+        delay = self._backoff * 2 ** (notification.attempt - 1) * random.uniform(0.5, 1.5)
+        self._retrying += 1
+        asyncio.get_event_loop().call_later(delay, self._requeue, notification)
+
+    def _requeue(self, notification: Notification):
+        self._retrying -= 1
+        try:
+            self.queue.put_nowait(notification)
+        except asyncio.QueueFull:
+            self.counts["dropped"] += 1
+
+    async def _drop_tokens(self, notifications: List[Notification]):
+        # only clears a token the user still has, not one registered since this notification was queued
+        await self._db.Users.bulk_write([UpdateOne({"uid": notification.uid, "fcm_token": notification.token},
+                                                   {"$set": {"fcm_token": None}})
+                                         for notification in notifications], ordered=False)
+        logger.info("Dropped %s invalid FCM tokens", len(notifications))
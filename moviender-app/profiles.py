@@ -0,0 +1,39 @@
+from typing import Dict, Iterable
+
+from cachetools import TTLCache
+
+from .metrics import record_cache_lookup
+
+PUBLIC_PROFILE_PROJECTION = {"_id": 0, "uid": 1, "username": 1, "profile_pic": 1}
+
+
+class ProfileCache:
+    # public profile fields (username, profile_pic) by uid, misses are read with a single $in query
+    def __init__(self, db, maxsize: int = 10000, ttl: float = 300):
+        self._db = db
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    async def get_many(self, uids: Iterable[str]) -> Dict[str, dict]:
+        profiles = {}
+        not_cached = []
+        for uid in uids:
+            profile = self._cache.get(uid)
+            record_cache_lookup("profile", profile is not None)
+            if profile is None:
+                not_cached.append(uid)
+            else:
+                profiles[uid] = profile
+
+        if not_cached:
+            async for user in self._db.Users.find({"uid": {"$in": not_cached}}, PUBLIC_PROFILE_PROJECTION):
+                profile = {"username": user["username"], "profile_pic": user["profile_pic"]}
+                self._cache[user["uid"]] = profile
+                profiles[user["uid"]] = profile
+
+        return profiles
+
+    async def get(self, uid: str):
+        return (await self.get_many([uid])).get(uid)
+
+    def invalidate(self, uid: str):
+        self._cache.pop(uid, None)
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# the result of pending_rating for a movie with no buffered rating
+NOT_BUFFERED = object()
+
+
+def ratings_update(operations: Dict[str, Optional[float]]):
+    # one update for a batch of ratings, None removes the movie's rating
+    update = {}
+    to_set = {f"ratings.{movie_id}": rating for movie_id, rating in operations.items() if rating is not None}
+    to_unset = {f"ratings.{movie_id}": 1 for movie_id, rating in operations.items() if rating is None}
+    if to_set:
+        update["$set"] = to_set
+    if to_unset:
+        update["$unset"] = to_unset
+    return update
+
+
+class RatingWriteBuffer:
+    # write-behind for ratings, every user's ratings within one window are coalesced into a single update
+    def __init__(self, db, window: float, max_retries: int = 5):
+        self._db = db
+        self.window = window
+        self.max_retries = max_retries
+        self._pending: Dict[str, Dict[str, Optional[float]]] = {}
+        # ratings being written, still newer than what reads get from the database
+        self._writing: Dict[str, Dict[str, Optional[float]]] = {}
+        self._failures: Dict[str, int] = {}
+        # one flush timer per user with pending ratings
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._flush_listeners: List[Callable[[str], None]] = []
+
+    @property
+    def enabled(self):
+        return self.window > 0
+
+    def add_flush_listener(self, listener: Callable[[str], None]):
+        self._flush_listeners.append(listener)
+
+    def pending(self):
+        return sum(len(operations) for operations in self._pending.values())
+
+    def is_buffering(self, uid: str):
+        return uid in self._pending or uid in self._writing
+
+    def add(self, uid: str, operations: Dict[str, Optional[float]]):
+        if uid not in self._timers:
+            self._schedule(uid, self.window)
+        # a later rating of the same movie replaces the earlier one
+        self._pending.setdefault(uid, {}).update(operations)
+
+    def _schedule(self, uid: str, delay: float):
+        timer = self._timers.pop(uid, None)
+        if timer is not None:
+            timer.cancel()
+        self._timers[uid] = asyncio.get_event_loop().call_later(delay, lambda: asyncio.ensure_future(self.flush(uid)))
+
+    def pending_rating(self, uid: str, movie_id: str):
+        # the rating a read should see before the database has it, None if it is being removed
+        for operations in (self._pending.get(uid, {}), self._writing.get(uid, {})):
+            if movie_id in operations:
+                return operations[movie_id]
+        return NOT_BUFFERED
+
+    def apply_pending(self, uid: str, ratings: Dict[str, float]):
+        # a user's ratings as read from the database with the buffered ones applied on top
+        operations = {**self._writing.get(uid, {}), **self._pending.get(uid, {})}
+        if not operations:
+            return ratings
+        ratings = dict(ratings)
+        for movie_id, rating in operations.items():
+            if rating is None:
+                ratings.pop(movie_id, None)
+            else:
+                ratings[movie_id] = rating
+        return ratings
+
+    async def flush(self, uid: str):
+        timer = self._timers.pop(uid, None)
+        if timer is not None:
+            timer.cancel()
+        operations = self._pending.pop(uid, None)
+        if not operations:
+            return
+
+        self._writing[uid] = operations
+        try:
+            result = await self._db.Ratings.update_one({"uid": uid}, ratings_update(operations))
+        except Exception:
+            failures = self._failures.get(uid, 0) + 1
+            if failures > self.max_retries:
+                logger.exception("Dropping %s buffered ratings of %s after %s failed writes", len(operations), uid,
+                                 failures)
+                self._failures.pop(uid, None)
+                return
+            logger.exception("Writing %s buffered ratings of %s failed", len(operations), uid)
+            self._failures[uid] = failures
+            # put them back under anything rated since, retried after twice as long as the last attempt, also when
+            # ratings added during the write already set a timer
+            self._pending[uid] = {**operations, **self._pending.get(uid, {})}
+            self._schedule(uid, self.window * 2 ** failures)
+            return
+        finally:
+            self._writing.pop(uid, None)
+
+        self._failures.pop(uid, None)
+        if result.matched_count == 0:
+            # apply_ratings checks the user exists before buffering, so only a user deleted since gets here
+            logger.warning("Dropping %s buffered ratings of %s, the user does not exist", len(operations), uid)
+        for listener in self._flush_listeners:
+            listener(uid)
+
+    async def flush_all(self):
+        for uid in list(self._pending):
+            await self.flush(uid)
@@ -1,17 +1,17 @@
-import bson
-from bson import ObjectId
-from fastapi import APIRouter, BackgroundTasks
+from fastapi import APIRouter
 
-from ..dependencies import get_db_client
-from ..utils import Status, State, send_friend_request_notification, find_session_id
+from ..dependencies import get_db_client, get_profile_cache
+from ..utils import Status, State, send_friend_request_notification, end_sessions_of_friends
 
 router = APIRouter()
 db = get_db_client()
+profile_cache = get_profile_cache()
 
 
 @router.post("/friend_request/{uid}", tags=["friends"])
-async def friend_request(uid: str, friend_username: str, background_task: BackgroundTasks):
-    result = db.Users.find_one({"username": friend_username}, {"_id": 0})
+async def friend_request(uid: str, friend_username: str):
+    result = await db.Users.find_one({"username": friend_username},
+                                     {"_id": 0, "uid": 1, "is_user_initialized": 1, "fcm_token": 1})
 
     if result is None:
         return Status.USERNAME_NOT_FOUND
@@ -21,28 +21,25 @@ async def friend_request(uid: str, friend_username: str, background_task: Backgr
     if uid == friend_uid:
         return Status.SAME_UID
 
-    cursor = db.Users.find_one({"uid": uid, f"friend_list.{friend_uid}": {"$exists": True}})
+    cursor = await db.Users.find_one({"uid": uid, f"friend_list.{friend_uid}": {"$exists": True}})
     if cursor is None:
 
         # check if friend account is initialized
-        current_friend = db.Users.find_one({"uid": friend_uid})
-        if not current_friend["is_user_initialized"]:
+        if not result["is_user_initialized"]:
             return Status.USERNAME_NOT_FOUND
 
+        username = (await profile_cache.get(uid))["username"]
 
-        username = db.Users.find_one({"uid": uid})["username"]
-
-        token = current_friend["fcm_token"]
+        token = result["fcm_token"]
 
         if token is not None:
-            background_task.add_task(send_friend_request_notification, username, token)
-            send_friend_request_notification(username, token)
+            send_friend_request_notification(friend_uid, username, token)
 
-        db.Users.update_one(
+        await db.Users.update_one(
             {"uid": uid},
             {"$set": {f"friend_list.{friend_uid}": State.PENDING}}
         )
-        db.Users.update_one(
+        await db.Users.update_one(
             {"uid": friend_uid},
             {"$set": {f"friend_list.{uid}": State.REQUEST}}
         )
@@ -55,21 +52,21 @@ async def friend_request(uid: str, friend_username: str, background_task: Backgr
 async def respond_friend_request(uid: str, friend_uid: str, response: int):
     try:
         if response == Status.ACCEPT_REQUEST:
-            db.Users.update_one(
+            await db.Users.update_one(
                 {"uid": uid},
                 {"$set": {f"friend_list.{friend_uid}": State.FRIEND}}
             )
-            db.Users.update_one(
+            await db.Users.update_one(
                 {"uid": friend_uid},
                 {"$set": {f"friend_list.{uid}": State.FRIEND}}
             )
         elif response == Status.DECLINE_REQUEST:
-            db.Users.update_one(
+            await db.Users.update_one(
                 {"uid": uid},
                 {"$unset": {f"friend_list.{friend_uid}": 1}},
                 False, True
             )
-            db.Users.update_one(
+            await db.Users.update_one(
                 {"uid": friend_uid},
                 {"$unset": {f"friend_list.{uid}": 1}},
                 False, True
@@ -83,23 +80,19 @@ async def respond_friend_request(uid: str, friend_uid: str, response: int):
 async def delete_friend(uid: str, friend_uid: str):
     try:
 
-        db.Users.update_one(
+        await db.Users.update_one(
             {"uid": uid},
             {"$unset": {f"friend_list.{friend_uid}": 1}},
             False, True
         )
 
-        db.Users.update_one(
+        await db.Users.update_one(
             {"uid": friend_uid},
             {"$unset": {f"friend_list.{uid}": 1}},
             False, True
         )
 
-        session_id = find_session_id(uid, friend_uid)
-
-        db.Sessions.delete_one({"_id": ObjectId(session_id)})
-        return True
-    except bson.errors.InvalidId:
+        await end_sessions_of_friends(uid, friend_uid)
         return True
     except Exception:
         return False
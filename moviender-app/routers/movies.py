@@ -1,29 +1,34 @@
-import re
 from typing import List
 
 from bson import ObjectId
-from fastapi import APIRouter, Query
+from fastapi import APIRouter, HTTPException, Path, Query, Request
 
-from ..dependencies import get_db_client, get_page_size
-from ..utils import UserRatings, get_movielens_id_rating, get_personal_recommendation
+from ..dependencies import get_db_client, get_page_size, get_catalog, get_title_search, get_response_cache, \
+    PERSONAL_MODEL_WEIGHT
+from ..http_cache import CachedBody, encode_json, make_etag
+from ..search import normalize_title
+from ..utils import UserRatings, get_personal_recommendation, get_movies_by_ids, apply_ratings, \
+    get_user_rating
 
 router = APIRouter()
 db = get_db_client()
+catalog = get_catalog()
+title_search = get_title_search()
+response_cache = get_response_cache()
 PAGE_SIZE = get_page_size()
 
 
 @router.get("/starter", tags=["movies"])
-async def get_starter():
+async def get_starter(request: Request):
     movies = ["260", "1270", "1240", "2571", "1", "595", "3785", "858", "1721", "586", "592", "1997", "1407", "2706",
               "2028", "553", "745"]
-    pipeline = [
-        {"$match": {"movielens_id": {"$in": movies}}},
-        {"$project": {"_id": 0, "movielens_id": 1, "poster_path": 1}}
-    ]
 
-    cursor = db.Movies.aggregate(pipeline)
+    async def build():
+        result, _ = await get_movies_by_ids(movies, ["movielens_id", "poster_path"])
+        return result
 
-    return [movie_metadata for movie_metadata in cursor]
+    snapshot = await catalog.current()
+    return await response_cache.respond(request, ("/starter",), snapshot.version, build)
 
 
 @router.get("/session_movies/{session_id}", tags=["movies"])
@@ -31,7 +36,7 @@ async def get_session_movies(session_id: str, uid: str, next_page_key: int = Non
     if next_page_key is None:
         next_page_key = 0
 
-    session = db.Sessions.find_one({"_id": ObjectId(session_id)})
+    session = await db.Sessions.find_one({"_id": ObjectId(session_id)})
 
     num_voted_movies = len(session["users_session_info"][uid]["voted_movies"])
     recommendations = session["recommendations"][num_voted_movies:]
@@ -39,107 +44,91 @@ async def get_session_movies(session_id: str, uid: str, next_page_key: int = Non
     skip = 10 * next_page_key
     limit = (10 * next_page_key) + 10
     recommendations = recommendations[skip:limit]
-    result = []
-    for recommendation in recommendations:
-        pipeline = [
-            {"$match": {"movielens_id": recommendation}},
-            {"$project": {"_id": 0, "movielens_id": 1, "genre_ids": 1, "title": 1, "overview": 1, "release_date": 1,
-                          "vote_average": 1, "poster_path": 1}}
-        ]
-        result.append(list(db.Movies.aggregate(pipeline))[0])
+
+    result, missing = await get_movies_by_ids(recommendations, ["movielens_id", "genre_ids", "title", "overview",
+                                                                "release_date", "vote_average", "poster_path"])
 
     if len(recommendations) < 10:
         next_page_key = None
     else:
         next_page_key += 1
 
-    return {"movies": result, "next_page_key": next_page_key}
+    return {"movies": result, "next_page_key": next_page_key, "missing": missing}
+
+
+@router.get("/movies", tags=["movies"])
+async def get_movies_page(request: Request, next_page_key: str = None, genres: List[int] = Query([])):
+    snapshot = await catalog.current()
+
+    async def build():
+        try:
+            rows, following_page_key = snapshot.page(PAGE_SIZE, next_page_key, genres)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return {"movies": snapshot.documents(rows, ["movielens_id", "poster_path"]),
+                "next_page_key": following_page_key}
+
+    key = ("/movies", next_page_key, tuple(sorted(set(genres))))
+    return await response_cache.respond(request, key, snapshot.version, build)
 
 
 @router.get("/movies/{page}", tags=["movies"])
-async def get_movies(page: int = 1, genres: List[int] = Query([])):
-    if genres:
-        match_genres = {"$or": [{"genre_ids": genre_id} for genre_id in genres]}
-    else:
-        match_genres = {}
-    pipeline = [
-        {"$match": match_genres},
-        {"$sort": {"popularity": -1}},
-        {"$project": {"_id": 0, "movielens_id": 1, "poster_path": 1}},
-        {"$skip": PAGE_SIZE * (page - 1)},
-        {"$limit": PAGE_SIZE}
-    ]
-    cursor = db.Movies.aggregate(pipeline)
+async def get_movies(request: Request, page: int = Path(..., ge=1), genres: List[int] = Query([])):
+    snapshot = await catalog.current()
 
-    return list(cursor)
+    async def build():
+        rows = snapshot.popularity_order
+        if genres:
+            rows = rows[snapshot.rows_with_any_genre(genres)[rows]]
 
+        skip = PAGE_SIZE * (page - 1)
+        return snapshot.documents(rows[skip:skip + PAGE_SIZE], ["movielens_id", "poster_path"])
 
-@router.get("/movie_details/{movie_id}", tags=["movies"])
-async def get_movie_details(movie_id: str, uid: str):
-    match_movie_id = {"movielens_id": movie_id}
-    pipeline = [
-        {"$match": match_movie_id},
-        {"$project": {"_id": 0, "poster_path": 1, "genre_ids": 1, "title": 1, "overview": 1, "release_date": 1,
-                      "vote_average": 1}}
-    ]
-
-    cursor = list(db.Movies.aggregate(pipeline))
-    result = cursor[0]
-
-    match_uid = {"uid": uid, f"ratings.{movie_id}": {"$exists": True}}
-    pipeline = [
-        {"$match": match_uid},
-        {"$project": {"_id": 0, f"ratings.{movie_id}": 1}}
-    ]
-
-    cursor = list(db.Ratings.aggregate(pipeline))
-    if cursor != []:
-        rating = cursor[0]["ratings"][movie_id]
-    else:
-        rating = 0.0
+    key = ("/movies/{page}", page, tuple(sorted(set(genres))))
+    return await response_cache.respond(request, key, snapshot.version, build)
 
-    result["user_rating"] = rating
-    return result
 
+@router.get("/movie_details/{movie_id}", tags=["movies"])
+async def get_movie_details(request: Request, movie_id: str, uid: str):
+    async def build():
+        movies, missing = await get_movies_by_ids([movie_id], ["poster_path", "genre_ids", "title", "overview",
+                                                               "release_date", "vote_average"])
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Movie {movie_id} not found")
+        return movies[0]
 
-@router.get("/movie_rating/{movie_id}", tags=["movies"])
-async def get_movie_rating(movie_id: str, uid: str):
-    match = {"uid": uid, f"ratings.{movie_id}": {"$exists": True}}
+    snapshot = await catalog.current()
+    metadata = await response_cache.body(("/movie_details/{movie_id}", movie_id), snapshot.version, build)
 
-    pipeline = [
-        {"$match": match},
-        {"$project": {"_id": 0, f"ratings.{movie_id}": 1}}
-    ]
+    rating = await get_user_rating(uid, movie_id)
 
-    cursor = list(db.Ratings.aggregate(pipeline))
+    # the cached metadata object with the user's rating appended as its last field
+    separator = b"," if metadata.body != b"{}" else b""
+    body = metadata.body[:-1] + separator + b'"user_rating":' + encode_json(rating) + b"}"
+    return response_cache.response(request, CachedBody(body, make_etag(body)), "private, no-cache")
 
-    if cursor != []:
-        rating = cursor[0]["ratings"][movie_id]
-    else:
-        rating = 0.0
 
-    return rating
+@router.get("/movie_rating/{movie_id}", tags=["movies"])
+async def get_movie_rating(movie_id: str, uid: str):
+    return await get_user_rating(uid, movie_id)
 
 
 @router.get("/search", tags=["movies"])
-async def get_search_results(title: str = ""):
-    regx = re.compile(f".*{title}.*", re.IGNORECASE)
+async def get_search_results(request: Request, title: str = ""):
+    snapshot = await catalog.current()
 
-    pipeline = [
-        {"$match": {"title": {"$regex": regx}}},
-        {"$sort": {"popularity": -1}},
-        {"$project": {"_id": 0, "movielens_id": 1, "poster_path": 1, "title": 1}},
-        {"$limit": 20}
-    ]
+    async def build():
+        return title_search.index.search(title, ["movielens_id", "poster_path", "title"], limit=20)
 
-    cursor = list(db.Movies.aggregate(pipeline))
-
-    return cursor
+    # titles that normalize the same have the same results
+    return await response_cache.respond(request, ("/search", normalize_title(title)), snapshot.version, build)
 
 
 @router.get("/user_recommendations/{page}", tags=["movies"])
-async def get_user_recommendations(page: int, uid: str):
-    recommended_movies = get_personal_recommendation(uid)
+async def get_user_recommendations(page: int, uid: str, model_weight: float = Query(None, ge=0, le=1)):
+    if model_weight is None:
+        model_weight = PERSONAL_MODEL_WEIGHT
+    recommended_movies = await get_personal_recommendation(uid, model_weight)
 
     results = [{"movielens_id": movie["movielens_id"], "poster_path": movie["poster_path"]} for movie in
                recommended_movies]
@@ -152,20 +141,15 @@ async def get_user_recommendations(page: int, uid: str):
 @router.post("/rating", tags=["movies"])
 async def update_rating(user_rating: UserRatings):
     try:
-        uid = user_rating.uid
-        movie_id, rating = get_movielens_id_rating(user_rating)
-
-        if rating != 0:
-            db.Ratings.update_one(
-                {"uid": uid},
-                {"$set": {f"ratings.{movie_id}": float(rating)}}
-            )
-        else:
-            db.Ratings.update_one(
-                {"uid": uid},
-                {"$unset": {f"ratings.{movie_id}": 1}},
-                False, True
-            )
+        # only the last rating is applied, /ratings takes a whole batch
+        await apply_ratings(user_rating.uid, user_rating.ratings[-1:])
         return True
     except:
         return False
+
+
+@router.post("/ratings", tags=["movies"])
+async def update_ratings(user_ratings: UserRatings):
+    results = await apply_ratings(user_ratings.uid, user_ratings.ratings)
+
+    return {"uid": user_ratings.uid, "results": results}
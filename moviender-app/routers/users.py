@@ -1,16 +1,18 @@
 import pymongo
 from fastapi import APIRouter
-from ..dependencies import get_db_client
-from ..utils import Friend, User, UserRatings, convert_user_ratings_to_json, UserGenrePreferences
+from ..dependencies import get_db_client, get_profile_cache
+from ..utils import Friend, User, UserRatings, convert_user_ratings_to_json, UserGenrePreferences, \
+    invalidate_personal_recommendation, invalidate_user_ratings
 
 router = APIRouter()
 db = get_db_client()
+profile_cache = get_profile_cache()
 
 
 @router.get("/initialized/{uid}", tags=["users"])
 async def is_user_initialized(uid: str):
     try:
-        result = db.Users.find_one({"uid": uid}, {"_id": 0, "is_user_initialized": 1})["is_user_initialized"]
+        result = (await db.Users.find_one({"uid": uid}, {"_id": 0, "is_user_initialized": 1}))["is_user_initialized"]
         return result
     except:
         return False
@@ -19,11 +21,14 @@ async def is_user_initialized(uid: str):
 @router.get("/friends/{uid}", tags=["users"])
 async def get_friend_list(uid: str):
     try:
-        friend_list = db.Users.find_one({"uid": uid})["friend_list"]
+        friend_list = (await db.Users.find_one({"uid": uid}, {"_id": 0, "friend_list": 1}))["friend_list"]
+        profiles = await profile_cache.get_many(friend_list.keys())
+
         friends = []
         for friend_uid in friend_list.keys():
-            # get current friend from uid
-            current_friend = db.Users.find_one({"uid": friend_uid})
+            current_friend = profiles.get(friend_uid)
+            if current_friend is None:
+                continue
 
             # create Friend object
             friend = Friend(uid=friend_uid, username=current_friend["username"],
@@ -37,12 +42,12 @@ async def get_friend_list(uid: str):
 
 @router.get("/genrePreferences/{uid}", tags=["users"])
 async def get_user_preferences(uid: str):
-    return db.Users.find_one({"uid": uid})["genre_preference"]
+    return (await db.Users.find_one({"uid": uid}))["genre_preference"]
 
 @router.post("/user", tags=["users"])
 async def insert_user(user: User):
     try:
-        result = db.Users.insert_one({
+        result = await db.Users.insert_one({
             "uid": user.uid,
             "username": user.username,
             "profile_pic": user.profile_pic_url,
@@ -50,6 +55,7 @@ async def insert_user(user: User):
             "genre_preference": [],
             "friend_list": {},
             "fcm_token": None})
+        profile_cache.invalidate(user.uid)
         return True
     except pymongo.errors.DuplicateKeyError:
         return False
@@ -60,7 +66,7 @@ async def insert_user(user: User):
 @router.post("/fcm_token/{uid}", tags=["users"])
 async def update_user_fcm_token(uid: str, token: str):
     try:
-        db.Users.update_one(
+        await db.Users.update_one(
             {"uid": uid},
             {"$set": {"fcm_token": token}}
         )
@@ -75,12 +81,13 @@ async def insert_ratings(user_ratings: UserRatings):
 
         json_ratings = convert_user_ratings_to_json(user_ratings=user_ratings)
 
-        db.Ratings.insert_one(json_ratings)
+        await db.Ratings.insert_one(json_ratings)
 
-        db.Users.update_one(
+        await db.Users.update_one(
             {"uid": user_ratings.uid},
             {"$set": {"is_user_initialized": True}}
         )
+        invalidate_user_ratings(user_ratings.uid)
         return True
     except Exception:
         return False
@@ -89,10 +96,11 @@ async def insert_ratings(user_ratings: UserRatings):
 @router.post("/userGenrePreference/", tags=["users"])
 async def insert_genre_preference(user_genre_pref: UserGenrePreferences):
     try:
-        db.Users.update_one(
+        await db.Users.update_one(
             {"uid": user_genre_pref.uid},
             {"$set": {"genre_preference": user_genre_pref.genres_ids}}
         )
+        invalidate_personal_recommendation(user_genre_pref.uid)
         return True
     except Exception:
         return False
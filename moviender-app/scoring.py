@@ -0,0 +1,193 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import Dict, List, Optional
+
+import numpy as np
+
+FACTOR_ARRAYS = ("bu", "bi", "pu", "qi", "user_ids", "item_ids")
+
+
+def file_sha256(path: str):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def sorted_ids(raw2inner: Dict[str, int]):
+    # raw ids in sorted order and the inner id of each, a binary search replaces the raw -> inner dict
+    raw_ids = np.array([str(raw_id) for raw_id in raw2inner.keys()], dtype=str)
+    inner_ids = np.fromiter(raw2inner.values(), dtype=np.int64, count=len(raw2inner))
+    order = np.argsort(raw_ids, kind="stable")
+    return raw_ids[order], inner_ids[order]
+
+
+def find_sorted(sorted_values, values):
+    # positions of values in sorted_values, -1 for values that are not there
+    if len(sorted_values) == 0:
+        return np.full(len(values), -1, dtype=np.int64)
+    positions = np.minimum(np.searchsorted(sorted_values, values), len(sorted_values) - 1)
+    return np.where(sorted_values[positions] == values, positions, -1).astype(np.int64)
+
+
+class SVDFactors:
+    # the parts of a trained Surprise SVD that are needed to score movies, without its trainset,
+    # users and movies are numbered by their position in the sorted user_ids and item_ids
+    def __init__(self, global_mean: float, rating_scale, bu, bi, pu, qi, biased: bool, user_ids, item_ids,
+                 reg_bu: float = 0.02, reg_pu: float = 0.02):
+        self.global_mean = global_mean
+        self.rating_scale = rating_scale
+        self.bu = bu
+        self.bi = bi
+        self.pu = pu
+        self.qi = qi
+        self.biased = biased
+        self.user_ids = user_ids
+        self.item_ids = item_ids
+        self.reg_bu = reg_bu
+        self.reg_pu = reg_pu
+
+    @classmethod
+    def from_algo(cls, algo):
+        trainset = algo.trainset
+        user_ids, users = sorted_ids(trainset._raw2inner_id_users)
+        item_ids, items = sorted_ids(trainset._raw2inner_id_items)
+        return cls(global_mean=trainset.global_mean, rating_scale=trainset.rating_scale, bu=algo.bu[users],
+                   bi=algo.bi[items], pu=algo.pu[users], qi=algo.qi[items], biased=algo.biased, user_ids=user_ids,
+                   item_ids=item_ids, reg_bu=algo.reg_bu, reg_pu=algo.reg_pu)
+
+    @classmethod
+    def load(cls, manifest_path: str, verify: bool = False):
+        # the arrays are memory-mapped read-only, every worker process shares the same page cache copy.
+        # save() hashed them once and never rewrites a directory, so a size check catches a truncated copy
+        # without reading every page, verify re-hashes them all
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        directory = os.path.join(os.path.dirname(manifest_path), manifest["directory"])
+
+        arrays = {}
+        for name, entry in manifest["files"].items():
+            path = os.path.join(directory, entry["file"])
+            # manifests written before sizes were recorded only have the checksum
+            if "size" in entry and os.path.getsize(path) != entry["size"]:
+                raise ValueError(f"{path} does not have the size recorded in {manifest_path}")
+            if verify and file_sha256(path) != entry["sha256"]:
+                raise ValueError(f"{path} does not match the checksum in {manifest_path}")
+            arrays[name] = np.load(path, mmap_mode="r")
+
+        return cls(global_mean=manifest["global_mean"], rating_scale=tuple(manifest["rating_scale"]),
+                   biased=manifest["biased"], reg_bu=manifest["reg_bu"], reg_pu=manifest["reg_pu"], **arrays)
+
+    def save(self, manifest_path: str):
+        # the arrays go to a directory named after their checksums, the manifest that points to it is replaced
+        # last, so a reader sees either the old model or the new one
+        parent = os.path.dirname(manifest_path)
+        name = os.path.splitext(os.path.basename(manifest_path))[0]
+        tmp_directory = os.path.join(parent, f"{name}.tmp-{os.getpid()}")
+        shutil.rmtree(tmp_directory, ignore_errors=True)
+        os.makedirs(tmp_directory)
+
+        files = {}
+        for array in FACTOR_ARRAYS:
+            file_name = f"{array}.npy"
+            np.save(os.path.join(tmp_directory, file_name), getattr(self, array))
+            path = os.path.join(tmp_directory, file_name)
+            files[array] = {"file": file_name, "sha256": file_sha256(path), "size": os.path.getsize(path)}
+
+        version = hashlib.sha256("".join(files[array]["sha256"] for array in FACTOR_ARRAYS).encode()).hexdigest()[:16]
+        directory = f"{name}-{version}"
+        if os.path.exists(os.path.join(parent, directory)):
+            shutil.rmtree(tmp_directory)
+        else:
+            os.rename(tmp_directory, os.path.join(parent, directory))
+
+        manifest = {"version": version, "directory": directory, "global_mean": float(self.global_mean),
+                    "rating_scale": [float(bound) for bound in self.rating_scale], "biased": bool(self.biased),
+                    "reg_bu": float(self.reg_bu), "reg_pu": float(self.reg_pu), "n_factors": int(self.qi.shape[1]),
+                    "files": files}
+        with open(f"{manifest_path}.tmp", "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(f"{manifest_path}.tmp", manifest_path)
+        return directory
+
+    def inner_uid(self, uid: str) -> Optional[int]:
+        row = int(find_sorted(self.user_ids, np.array([uid], dtype=str))[0])
+        return row if row >= 0 else None
+
+    def inner_iids(self, movie_ids: List[str]):
+        # -1 marks movies the model has never seen
+        return find_sorted(self.item_ids, np.array(movie_ids, dtype=str).reshape(len(movie_ids)))
+
+
+def load_svd_factors(path: str):
+    from .model_registry import load_surprise_model
+
+    return SVDFactors.from_algo(load_surprise_model(path))
+
+
+def user_factors(model: SVDFactors, uid: str, fold_ins: Dict[str, tuple] = None):
+    # (bias, factors) of a trained user, or of a user folded into the model afterwards, None if unknown
+    inner_uid = model.inner_uid(uid)
+    if inner_uid is not None:
+        return model.bu[inner_uid], model.pu[inner_uid]
+    if fold_ins:
+        return fold_ins.get(uid)
+    return None
+
+
+def estimate_ratings(model: SVDFactors, uids: List[str], inner_iids, fold_ins: Dict[str, tuple] = None):
+    # SVD.predict for every (user, movie) pair at once as a users x movies matrix,
+    # unknown users or movies fall back to the same estimates Surprise uses
+    factors = [user_factors(model, uid, fold_ins) for uid in uids]
+    known_users = np.array([user is not None for user in factors], dtype=bool)
+    known_bu = np.array([user[0] for user in factors if user is not None], dtype=np.float64)
+    known_pu = np.array([user[1] for user in factors if user is not None], dtype=np.float64).reshape(
+        len(known_bu), model.qi.shape[1])
+    known_items = inner_iids >= 0
+    known_iids = inner_iids[known_items]
+
+    estimates = np.full((len(uids), len(inner_iids)), model.global_mean, dtype=np.float64)
+    interactions = known_pu @ model.qi[known_iids].T
+    if model.biased:
+        estimates[known_users] += known_bu[:, np.newaxis]
+        estimates[:, known_items] += model.bi[known_iids]
+        estimates[np.ix_(known_users, known_items)] += interactions
+    else:
+        estimates[np.ix_(known_users, known_items)] = interactions
+
+    lower_bound, higher_bound = model.rating_scale
+    return np.clip(estimates, lower_bound, higher_bound, out=estimates)
+
+
+def top_n_indices(scores, n: int):
+    # indices of the n highest scores, ties keep their original order like a stable list.sort(reverse=True)
+    if n <= 0 or len(scores) == 0:
+        return np.empty(0, dtype=np.int64)
+
+    if len(scores) > n:
+        candidates = np.argpartition(-scores, n - 1)[:n]
+        candidates = np.flatnonzero(scores >= scores[candidates].min())
+    else:
+        candidates = np.arange(len(scores))
+
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order][:n]
+
+
+# how the estimates of the users in a group are combined into one score per movie
+AGGREGATIONS = {
+    "product": lambda estimates: estimates.prod(axis=0),
+    "average": lambda estimates: estimates.mean(axis=0),
+    "least_misery": lambda estimates: estimates.min(axis=0),
+}
+
+
+def score_group(model: SVDFactors, uids: List[str], movie_ids: List[str], aggregation: str = "product",
+                top_n: int = 50, fold_ins: Dict[str, tuple] = None):
+    inner_iids = model.inner_iids(movie_ids)
+    scores = AGGREGATIONS[aggregation](estimate_ratings(model, uids, inner_iids, fold_ins))
+
+    return [(movie_ids[index], float(scores[index])) for index in top_n_indices(scores, top_n)]
@@ -0,0 +1,76 @@
+import unicodedata
+from typing import Dict, List
+
+import numpy as np
+
+MAX_GRAM = 3
+_NO_RANKS = np.empty(0, dtype=np.int32)
+
+
+def normalize_title(title: str):
+    # case and accent folded, so "amelie" finds "Amélie"
+    decomposed = unicodedata.normalize("NFKD", title.casefold())
+    return "".join(character for character in decomposed if not unicodedata.combining(character))
+
+
+def title_grams(title: str, length: int):
+    return {title[start:start + length] for start in range(len(title) - length + 1)}
+
+
+class TitleSearchIndex:
+    # n-gram index over the normalized titles of one catalog snapshot, postings hold popularity ranks
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.version = snapshot.version
+
+        rows = [row for row in snapshot.popularity_order.tolist() if isinstance(snapshot.columns["title"][row], str)]
+        self._rows = np.array(rows, dtype=np.int64)
+        self._titles = [normalize_title(snapshot.columns["title"][row]) for row in rows]
+
+        postings: Dict[str, List[int]] = {}
+        for rank, title in enumerate(self._titles):
+            for length in range(1, MAX_GRAM + 1):
+                for gram in title_grams(title, length):
+                    postings.setdefault(gram, []).append(rank)
+        self._postings = {gram: np.array(ranks, dtype=np.int32) for gram, ranks in postings.items()}
+
+    def search_rows(self, title: str, limit: int = 20):
+        query = normalize_title(title)
+        if not query:
+            return self._rows[:limit]
+
+        if len(query) <= MAX_GRAM:
+            return self._rows[self._postings.get(query, _NO_RANKS)[:limit]]
+
+        # every title containing the query has all of its trigrams, check the survivors for the whole query
+        postings = sorted((self._postings.get(gram, _NO_RANKS) for gram in title_grams(query, MAX_GRAM)), key=len)
+        candidates = postings[0]
+        for ranks in postings[1:]:
+            if len(candidates) == 0:
+                break
+            candidates = np.intersect1d(candidates, ranks, assume_unique=True)
+
+        matches = []
+        for rank in candidates.tolist():
+            if query in self._titles[rank]:
+                matches.append(rank)
+                if len(matches) == limit:
+                    break
+        return self._rows[matches]
+
+    def search(self, title: str, fields: List[str], limit: int = 20):
+        return self.snapshot.documents(self.search_rows(title, limit), fields)
+
+
+class TitleSearch:
+    # keeps the index of the latest catalog snapshot, rebuilt from the catalog refresh hook before the catalog
+    # hands the snapshot out, so a request never builds one
+    def __init__(self):
+        self._index = None
+
+    def rebuild(self, snapshot):
+        self._index = TitleSearchIndex(snapshot)
+
+    @property
+    def index(self) -> TitleSearchIndex:
+        return self._index
@@ -1,12 +1,28 @@
-from typing import List
+import asyncio
+import json
+from typing import List, Optional
 from pydantic import BaseModel
 from bson import ObjectId
-from enum import IntEnum
-from firebase_admin import messaging
-from surprise import dump
-from .dependencies import get_db_client
+from pymongo import ReturnDocument
+from enum import Enum, IntEnum
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+from .dependencies import get_db_client, get_model_registry, get_catalog, get_recommendation_cache, \
+    get_fold_in_cache, get_event_hub, get_rating_buffer, get_notification_dispatcher, get_item_factor_index, \
+    SESSION_EVENTS_KEEPALIVE_SECONDS
+from .metrics import INFERENCE_DURATION, record_cache_lookup
+from .rating_buffer import NOT_BUFFERED, ratings_update
+from .scoring import estimate_ratings, score_group, top_n_indices, user_factors
 
 db = get_db_client()
+model_registry = get_model_registry()
+catalog = get_catalog()
+recommendation_cache = get_recommendation_cache()
+fold_in_cache = get_fold_in_cache()
+item_factor_index = get_item_factor_index()
+event_hub = get_event_hub()
+rating_buffer = get_rating_buffer()
+notification_dispatcher = get_notification_dispatcher()
 
 
 class User(BaseModel):
@@ -32,18 +48,43 @@ class UserRatings(BaseModel):
     ratings: List[Rating]
 
 
+class RatingStatus(str, Enum):
+    SET = "set"
+    UNSET = "unset"
+    BUFFERED = "buffered"
+    SUPERSEDED = "superseded"
+    INVALID = "invalid"
+    USER_NOT_FOUND = "user_not_found"
+
+
 class UserGenrePreferences(BaseModel):
     uid: str
     genres_ids: List[int]
 
 
-class SessionRequestBody(BaseModel):
-    friend_uid: str
+class Aggregation(str, Enum):
+    PRODUCT = "product"
+    AVERAGE = "average"
+    LEAST_MISERY = "least_misery"
+
+
+class GroupRequestBody(BaseModel):
+    # friend_uid is what two-person clients send, friend_uids invites any number of friends
+    friend_uid: Optional[str] = None
+    friend_uids: List[str] = []
+
+    def friends(self, uid: str):
+        friends = [self.friend_uid] if self.friend_uid else []
+        friends += self.friend_uids
+        return [friend for friend in dict.fromkeys(friends) if friend != uid]
+
+
+class SessionRequestBody(GroupRequestBody):
     genres_ids: List[int]
+    aggregation: Aggregation = Aggregation.PRODUCT
 
 
-class SessionRequestBodySim(BaseModel):
-    friend_uid: str
+class SessionRequestBodySim(GroupRequestBody):
     movielens_id: str
 
 
@@ -92,123 +133,97 @@ def convert_user_ratings_to_json(user_ratings: UserRatings):
     return convertedUserRatings
 
 
-def get_movielens_id_rating(user_ratings: UserRatings):
-    movie_id = None
-    rating = None
-
-    for movieid_tuple, rating_tuple in user_ratings.ratings:
-        rating = rating_tuple[1]
-        movie_id = movieid_tuple[1]
+def send_friend_request_notification(uid: str, username: str, token: str):
+    # queued, the dispatcher sends it in the background
+    notification_dispatcher.enqueue(uid, token, {"name": username})
 
-    return movie_id, rating
 
+async def get_recommendation(uids: List[str], genres_ids, aggregation: str = Aggregation.PRODUCT):
+    users_ratings = await fetch_users_ratings(uids)
+    list_of_movies = await fetch_movies(users_ratings, genres_ids)
+    result_tuple = await run_in_threadpool(get_final_list, uids, list_of_movies, users_ratings, aggregation)
+    return [recommendation[0] for recommendation in result_tuple]
 
-def send_friend_request_notification(username: str, token: str):
-    message = messaging.Message(
-        data={
-            'name': username
-        },
-        token=token
-    )
-
-    response = messaging.send(message)
-    # Response is a message ID string.
-    print('Successfully sent message:', response)
 
+async def fetch_users_ratings(uids: List[str]):
+    cursor = db.Ratings.find({"uid": {"$in": uids}}, {"_id": 0, "uid": 1, "ratings": 1})
+    users_ratings = {user["uid"]: rating_buffer.apply_pending(user["uid"], user["ratings"]) async for user in cursor}
 
-def get_recommendation(uid: str, friend_uid: str, genres_ids):
-    list_of_movies = fetch_movies(uid, friend_uid, genres_ids)
-    result_tuple = get_final_list(uid, friend_uid, list_of_movies)
-    return [recommendation[0] for recommendation in result_tuple]
+    return {uid: users_ratings[uid] for uid in uids}
 
 
-def fetch_movies(uid: str, friend_uid: str, genres_ids):
-    firstUser = list(db.Ratings.find_one({"uid": uid})["ratings"].keys())
-    secondUser = list(db.Ratings.find_one({"uid": friend_uid})["ratings"].keys())
+async def fetch_movies(users_ratings: dict, genres_ids):
+    watched_movies = set()
+    for ratings in users_ratings.values():
+        watched_movies.update(ratings.keys())
 
-    mergedMoviesList = list(set(firstUser + secondUser))
+    snapshot = await catalog.current()
 
+    unwatched = np.ones(len(snapshot), dtype=bool)
+    unwatched[snapshot.rows(watched_movies)] = False
     if genres_ids:
-        match_options = {"$and": [
-            {"genre_ids": {"$in": genres_ids}},
-            {"movielens_id": {"$nin": mergedMoviesList}}]}
-    else:
-        match_options = {"movielens_id": {"$nin": mergedMoviesList}}
+        unwatched &= snapshot.rows_with_any_genre(genres_ids)
+
+    return [snapshot.movielens_ids[row] for row in np.flatnonzero(unwatched)]
 
-    pipeline = [
-        {"$match": match_options},
-        {"$project": {"_id": 0, "movielens_id": 1}}
-    ]
 
-    cursor = db.Movies.aggregate(pipeline)
-    cursor = list(cursor)
-    return [movie_id["movielens_id"] for movie_id in cursor]
+@INFERENCE_DURATION.labels("group_recommendations").time()
+def get_final_list(uids: List[str], list_of_movies, users_ratings: dict = None,
+                   aggregation: str = Aggregation.PRODUCT):
+    entry = model_registry.entry("svd")
 
+    # users who signed up after the last training get factors solved from their current ratings
+    fold_ins = fold_in_cache.fold_in_users(entry, users_ratings) if users_ratings else None
 
-def get_final_list(uid: str, friend_uid: str, list_of_movies):
-    # load a tuple with (prediction, trained-algorithm)
-    algo = dump.load("TrainedModels/trainedSVDAlgo.model")
-    # get just the algorithm
-    algo = algo[1]
+    return score_group(entry.model, uids, list_of_movies, Aggregation(aggregation).value, top_n=50, fold_ins=fold_ins)
 
-    user_combined_predictions = []
-    for movie_id in list_of_movies:
-        user_pred = algo.predict(uid, movie_id)
-        friend_user_pred = algo.predict(friend_uid, movie_id)
-        # user_combined_predictions.append((movie_id, (user_pred.est + friend_user_pred.est) / 2.0))
-        user_combined_predictions.append((movie_id, user_pred.est * friend_user_pred.est))
 
-    user_combined_predictions.sort(key=lambda x: x[1], reverse=True)
-    if len(user_combined_predictions) > 50:
-        user_combined_predictions = user_combined_predictions[0:50]
-    return user_combined_predictions
+async def session_status_changed(currentSession):
+    status, update = evaluate_session(currentSession)
 
+    # only the vote that completed this round records its outcome, the filter matches nothing
+    # if another request has already moved the session on
+    session = await db.Sessions.find_one_and_update(
+        {"_id": currentSession["_id"],
+         "users_voted": currentSession["users_voted"],
+         "state": SessionStatus.WAITING_FOR_VOTES},
+        update,
+        return_document=ReturnDocument.AFTER
+    )
+    if session is not None:
+        await publish_session_event(session)
+    return status
 
-def session_status_changed(session_id: str):
-    currentSession = get_current_session(session_id)
 
+def evaluate_session(currentSession):
     recommendations = currentSession["recommendations"]
 
     result_movies, result_votes = get_result_movies_votes(currentSession, recommendations)
 
     if result_movies != []:
-        return update_session_to_successful(session_id, result_movies)
+        return SessionStatus.SUCCESSFUL_FINISH, {"$set": {
+            "results": result_movies,
+            "state": SessionStatus.SUCCESSFUL_FINISH}}
 
     elif all_movies_are_voted(len(result_votes), len(recommendations)):
-        return update_session_to_failed(session_id)
+        return SessionStatus.FAILED_FINISH, {"$set": {"state": SessionStatus.FAILED_FINISH}}
     else:
-        return change_users_state_that_can_keep_voting(session_id, currentSession)
+        return SessionStatus.WAITING_FOR_VOTES, users_that_can_keep_voting_update(currentSession)
 
 
 def get_result_movies_votes(currentSession, recommendations):
     all_votes = [currentSession["users_session_info"][user]["voted_movies"] for user in
                  currentSession["users_session_info"].keys()]
 
-    # todo change logic for more than 2 users
-    result_votes = [user1 and user2 for user1, user2 in zip(all_votes[0], all_votes[1])]
-
-    result_movies = []
+    # users x movies matrix of the votes every user has cast so far, a movie is a result when all users liked it
+    num_votes = min(len(votes) for votes in all_votes)
+    votes = np.array([votes[:num_votes] for votes in all_votes], dtype=bool).reshape(len(all_votes), num_votes)
+    result_votes = votes.all(axis=0)
 
-    for index, vote in enumerate(result_votes):
-        if vote:
-            result_movies.append(recommendations[index])
+    result_movies = [recommendations[index] for index in np.flatnonzero(result_votes)]
     return result_movies, result_votes
 
 
-def get_current_session(session_id: str):
-    return db.Sessions.find_one({"_id": ObjectId(session_id)})
-
-
-def update_session_to_successful(session_id: str, result_movies):
-    db.Sessions.update_one(
-        {"_id": ObjectId(session_id)},
-        {"$set": {
-            "results": result_movies,
-            "state": SessionStatus.SUCCESSFUL_FINISH}}
-    )
-    return SessionStatus.SUCCESSFUL_FINISH
-
-
 def all_movies_are_voted(num_result_votes, num_recommendations):
     return num_result_votes == num_recommendations
 
@@ -217,113 +232,310 @@ def user_have_more_movies_to_vote(num_user_votes: int, num_of_recommendations: i
     return num_user_votes < num_of_recommendations
 
 
-def update_session_to_failed(session_id: str):
-    db.Sessions.update_one(
-        {"_id": ObjectId(session_id)},
-        {"$set": {"state": SessionStatus.FAILED_FINISH}}
-    )
-    return SessionStatus.FAILED_FINISH
-
-
-def change_users_state_that_can_keep_voting(session_id, currentSession):
+def users_that_can_keep_voting_update(currentSession):
     num_of_recommendations = len(currentSession["recommendations"])
 
+    states = {}
     for user in currentSession["users_session_info"].keys():
 
         num_user_votes = len(currentSession["users_session_info"][user]["voted_movies"])
 
         if user_have_more_movies_to_vote(num_user_votes, num_of_recommendations):
-            db.Sessions.update_one(
-                {"_id": ObjectId(session_id)},
-                {
-                    "$set": {f"users_session_info.{user}.state": SessionUserStatus.VOTING_AGAIN},
-                    "$inc": {"users_voted": -1}}
-            )
-    return SessionStatus.WAITING_FOR_VOTES
+            states[f"users_session_info.{user}.state"] = SessionUserStatus.VOTING_AGAIN
 
+    return {"$set": states, "$inc": {"users_voted": -len(states)}}
 
-def check_if_users_are_in_session(uid, body):
-    return db.Users.find_one({"uid": uid, f"friend_list.{body.friend_uid}": State.FRIEND})
 
+def session_snapshot(session):
+    # what the polling endpoints return for a session, in one event
+    return {
+        "state": session["state"],
+        "users_voted": session["users_voted"],
+        "users": {user: {"state": info["state"], "num_votes": len(info["voted_movies"])}
+                  for user, info in session["users_session_info"].items()},
+        "results": session["results"] if session["state"] == SessionStatus.SUCCESSFUL_FINISH else []
+    }
 
-def get_similar_movies(movielens_id: str):
-    # load a tuple with (prediction, trained-algorithm)
-    algo = dump.load("TrainedModels/trainedKNNBaseline.model")
-    # get just the algorithm
-    algo = algo[1]
 
-    input_movie_inner_id = algo.trainset.to_inner_iid(movielens_id)
+async def publish_session_event(session):
+    await event_hub.publish(str(session["_id"]), {"type": "session", "data": session_snapshot(session)})
 
-    # Retrieve inner ids of the nearest neighbors of input movie
-    input_movie_neighbors = algo.get_neighbors(input_movie_inner_id, k=20)
 
-    # Convert inner ids of the neighbors into raw ids
-    input_movie_neighbors = [algo.trainset.to_raw_iid(inner_id) for inner_id in input_movie_neighbors]
+async def publish_session_closed(session_id: str):
+    await event_hub.publish(session_id, {"type": "closed", "data": {}})
 
-    return input_movie_neighbors
 
+def format_event(event_type: str, data: dict):
+    return f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
 
-def fetch_user_unwatched_movies(uid: str):
-    watched_movies = list(db.Ratings.find_one({"uid": uid})["ratings"].keys())
 
-    pipeline = [
-        {"$match": {"movielens_id": {"$nin": watched_movies}}},
-        {"$project": {"_id": 0, "movielens_id": 1, "vote_average": 1, "popularity": 1, "genre_ids": 1, "vote_count": 1,
-                      "poster_path": 1}}
-    ]
+async def stream_session_events(session_id: str, request):
+    # server-sent events with the session's state, first as it is now and then after every change
+    with event_hub.subscribe(session_id) as events:
+        # subscribed before the read, so a change made in between still arrives as an event
+        session = await db.Sessions.find_one({"_id": ObjectId(session_id)})
+        if session is None:
+            yield format_event("closed", {})
+            return
+        yield format_event("session", session_snapshot(session))
 
-    cursor = db.Movies.aggregate(pipeline)
-    cursor = list(cursor)
+        while True:
+            try:
+                event = await asyncio.wait_for(events.get(), SESSION_EVENTS_KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    return
+                yield ": keepalive\n\n"
+                continue
 
-    return cursor
+            yield format_event(event["type"], event["data"])
+            if event["type"] == "closed":
+                return
 
 
-def get_personal_recommendation(uid: str):
-    movies = fetch_user_unwatched_movies(uid)
-    genres_preferences = db.Users.find_one({"uid": uid})["genre_preference"]
-    movies = normalize_genres_based_on_preferences(movies, genres_preferences)
-    movies = calculate_score(movies)
+async def check_if_users_are_in_session(uid: str, friend_uids: List[str]):
+    # the user who starts the session has to be friends, and not in a session, with every invited friend
+    if not friend_uids:
+        return None
+    return await db.Users.find_one({"uid": uid, **{f"friend_list.{friend_uid}": State.FRIEND
+                                                   for friend_uid in friend_uids}})
 
-    movies.sort(reverse=True, key=lambda movie: movie["score"])
 
-    return movies[:20]
+async def start_session(uid: str, friend_uids: List[str], recommendations: list):
+    users = [uid] + friend_uids
+    result = await db.Sessions.insert_one({
+        "users_in_session": users,
+        "users_session_info": {user: {"state": SessionUserStatus.VOTING, "voted_movies": []} for user in users},
+        "results": [],
+        "users_voted": 0,
+        "recommendations": recommendations,
+        "is_active": True,
+        "state": SessionStatus.WAITING_FOR_VOTES
+    })
 
+    await set_session_friend_state(uid, friend_uids, State.SESSION)
+    return str(result.inserted_id)
+
+
+async def set_session_friend_state(uid: str, friend_uids: List[str], state: State):
+    # friend_list states between the user who started a session and each friend in it, both ways
+    await db.Users.update_one(
+        {"uid": uid},
+        {"$set": {f"friend_list.{friend_uid}": state for friend_uid in friend_uids}}
+    )
+    await db.Users.update_many(
+        {"uid": {"$in": friend_uids}},
+        {"$set": {f"friend_list.{uid}": state}}
+    )
 
-def normalize_genres_based_on_preferences(movies: list, preferences: list):
-    preferences_set = set(preferences)
-    for movie in movies:
-        movie["genre_score"] = len(preferences_set.intersection(movie["genre_ids"])) / len(movie["genre_ids"])
 
+@INFERENCE_DURATION.labels("similar_movies").time()
+def get_similar_movies(movielens_id: str):
+    # nearest neighbors of the input movie, precomputed by trainModels.py
+    neighbour_table = model_registry.get("knn_neighbours")
+
+    return neighbour_table.similar(movielens_id, k=20)
+
+
+async def get_movies_by_ids(movielens_ids: List[str], fields: List[str]):
+    # metadata in the order of movielens_ids, movies added after the last catalog refresh are read with one $in query
+    snapshot = await catalog.current()
+
+    not_in_catalog = [movielens_id for movielens_id in movielens_ids if movielens_id not in snapshot.index]
+    fetched = {}
+    if not_in_catalog:
+        projection = {"_id": 0, "movielens_id": 1, **{field: 1 for field in fields}}
+        async for movie in db.Movies.find({"movielens_id": {"$in": not_in_catalog}}, projection):
+            fetched[movie["movielens_id"]] = {field: movie[field] for field in fields if field in movie}
+
+    movies = []
+    missing = []
+    for movielens_id in movielens_ids:
+        row = snapshot.index.get(movielens_id)
+        if row is not None:
+            movies.append(snapshot.document(row, fields))
+        elif movielens_id in fetched:
+            movies.append(fetched[movielens_id])
+        else:
+            missing.append(movielens_id)
+
+    return movies, missing
+
+
+async def get_user_rating(uid: str, movie_id: str):
+    # 0 when the user has not rated the movie
+    rating = rating_buffer.pending_rating(uid, movie_id)
+    if rating is NOT_BUFFERED:
+        ratings = await db.Ratings.find_one({"uid": uid, f"ratings.{movie_id}": {"$exists": True}},
+                                            {"_id": 0, f"ratings.{movie_id}": 1})
+        rating = ratings["ratings"][movie_id] if ratings is not None else None
+    return rating if rating is not None else 0.0
+
+
+async def get_personal_recommendation(uid: str, model_weight: float = 0.0):
+    snapshot = await catalog.current()
+    model_version = model_registry.entry("svd").version if model_weight > 0 else None
+
+    cached = recommendation_cache.get(uid)
+    hit = cached is not None and cached[:3] == (snapshot.version, model_version, model_weight)
+    record_cache_lookup("personal_recommendations", hit)
+    if hit:
+        return cached[3]
+
+    ratings = rating_buffer.apply_pending(uid, (await db.Ratings.find_one({"uid": uid}))["ratings"])
+    genres_preferences = (await db.Users.find_one({"uid": uid}))["genre_preference"]
+    movies = await run_in_threadpool(rank_personal_recommendations, snapshot, list(ratings.keys()), genres_preferences,
+                                     20, uid, ratings, model_weight)
+
+    recommendation_cache[uid] = (snapshot.version, model_version, model_weight, movies)
     return movies
 
 
-def calculate_score(movies: list):
+def invalidate_personal_recommendation(uid: str):
+    recommendation_cache.pop(uid, None)
+
+
+def invalidate_user_ratings(uid: str):
+    invalidate_personal_recommendation(uid)
+    fold_in_cache.invalidate([uid])
+
+
+rating_buffer.add_flush_listener(invalidate_user_ratings)
+
+
+def valid_rating(rating: Rating):
+    # movie ids become field names of the ratings document
+    movie_id = rating.movielens_id
+    return movie_id != "" and "." not in movie_id and not movie_id.startswith("$") and 0 <= rating.rating <= 5
+
+
+def rating_operations(ratings: List[Rating]):
+    # the last rating of each movie in the batch wins, a rating of 0 removes the movie's rating
+    operations = {}
+    statuses = []
+    last_index = {rating.movielens_id: index for index, rating in enumerate(ratings)}
+    for index, rating in enumerate(ratings):
+        if not valid_rating(rating):
+            statuses.append(RatingStatus.INVALID)
+        elif last_index[rating.movielens_id] != index:
+            statuses.append(RatingStatus.SUPERSEDED)
+        elif rating.rating == 0:
+            operations[rating.movielens_id] = None
+            statuses.append(RatingStatus.UNSET)
+        else:
+            operations[rating.movielens_id] = float(rating.rating)
+            statuses.append(RatingStatus.SET)
+    return operations, statuses
+
+
+async def apply_ratings(uid: str, ratings: List[Rating]):
+    operations, statuses = rating_operations(ratings)
+
+    if not operations:
+        return [{"movielens_id": rating.movielens_id, "status": status} for rating, status in zip(ratings, statuses)]
+
+    if rating_buffer.enabled:
+        # a user whose ratings are already buffered was found when the first of them was
+        found = rating_buffer.is_buffering(uid) or await db.Ratings.find_one({"uid": uid}, {"_id": 1}) is not None
+        if found:
+            rating_buffer.add(uid, operations)
+    else:
+        found = (await db.Ratings.update_one({"uid": uid}, ratings_update(operations))).matched_count > 0
+
+    if found:
+        # reads see buffered ratings right away, so the caches are dropped right away too
+        invalidate_user_ratings(uid)
+    applied = RatingStatus.USER_NOT_FOUND if not found else RatingStatus.BUFFERED if rating_buffer.enabled else None
+    if applied is not None:
+        statuses = [applied if status in (RatingStatus.SET, RatingStatus.UNSET) else status for status in statuses]
+
+    return [{"movielens_id": rating.movielens_id, "status": status} for rating, status in zip(ratings, statuses)]
+
+
+@INFERENCE_DURATION.labels("personal_recommendations").time()
+def rank_personal_recommendations(snapshot, watched_movies: list, genres_preferences: list, top_n: int = 20,
+                                  uid: str = None, ratings: dict = None, model_weight: float = 0.0):
+    unwatched = np.ones(len(snapshot), dtype=bool)
+    unwatched[snapshot.rows(watched_movies)] = False
+    rows = np.flatnonzero(unwatched)
+
+    genre_counts = snapshot.genre_counts[rows]
+    genre_overlap = snapshot.genre_overlap(genres_preferences, rows)
+    genre_score = np.divide(genre_overlap, genre_counts, out=np.zeros(len(rows)), where=genre_counts > 0)
+
+    scores = calculate_score(genre_score, snapshot.vote_average[rows], snapshot.vote_count[rows],
+                             snapshot.popularity[rows])
+
+    if model_weight > 0:
+        rows, scores = blend_model_scores(snapshot, rows, scores, uid, ratings, model_weight, max(100, top_n * 5))
+
+    return snapshot.documents(rows[top_n_indices(scores, top_n)], ["movielens_id", "poster_path"])
+
+
+def blend_model_scores(snapshot, rows, scores, uid: str, ratings: dict, model_weight: float, pool_size: int):
+    # the best unwatched movies of the heuristic and of the svd, each scored by both: the heuristic is in [0, 1]
+    # and so is the predicted rating once scaled to the rating scale
+    entry = model_registry.entry("svd")
+    model = entry.model
+    # users who signed up after the last training get factors solved from their current ratings
+    fold_ins = fold_in_cache.fold_in_users(entry, {uid: ratings})
+    factors = user_factors(model, uid, fold_ins)
+    if factors is None:
+        return rows, scores
+
+    positions = np.full(len(snapshot), -1, dtype=np.int64)
+    positions[rows] = np.arange(len(rows))
+    model_best = positions[snapshot.rows(item_factor_index.top_movies(entry, factors[1], pool_size, ratings.keys()))]
+    candidates = np.union1d(top_n_indices(scores, pool_size), model_best[model_best >= 0])
+
+    candidate_rows = rows[candidates]
+    inner_iids = model.inner_iids([snapshot.movielens_ids[row] for row in candidate_rows])
+    predictions = estimate_ratings(model, [uid], inner_iids, fold_ins)[0]
+    lower_bound, higher_bound = model.rating_scale
+    predicted_score = (predictions - lower_bound) / (higher_bound - lower_bound)
+
+    return candidate_rows, (1 - model_weight) * scores[candidates] + model_weight * predicted_score
+
+
+def normalize_by_max(values):
+    maximum = values.max() if len(values) else 0
+    if maximum == 0:
+        return np.zeros(len(values))
+    return values / maximum
+
+
+def calculate_score(genre_score, vote_average, vote_count, popularity):
     genres_weight = 0.4
     vote_average_weight = 0.22
     vote_count_weight = 0.18
     popularity_weight = 0.20
 
-    vote_average_max = max(movies, key=lambda movie: movie["vote_average"])["vote_average"]
-    vote_count_max = max(movies, key=lambda movie: movie["vote_count"])["vote_count"]
-    popularity_max = max(movies, key=lambda movie: movie["popularity"])["popularity"]
-    genre_score_max = max(movies, key=lambda movie: movie["genre_score"])["genre_score"]
+    movie_average_score = normalize_by_max(vote_average) * vote_average_weight
+    movie_vote_count_score = normalize_by_max(vote_count) * vote_count_weight
+    movie_popularity_score = normalize_by_max(popularity) * popularity_weight
+    movie_genres_score = normalize_by_max(genre_score) * genres_weight
 
-    for movie in movies:
-        movie_average_score = (movie["vote_average"] / vote_average_max) * vote_average_weight
-        movie_vote_count_score = (movie["vote_count"] / vote_count_max) * vote_count_weight
-        movie_popularity_score = (movie["popularity"] / popularity_max) * popularity_weight
-        movie_genres_score = (movie["genre_score"] / genre_score_max) * genres_weight
-        movie["score"] = movie_genres_score + movie_popularity_score + movie_average_score + movie_vote_count_score
+    return movie_genres_score + movie_popularity_score + movie_average_score + movie_vote_count_score
 
-    return movies
+
+async def find_session_id(uid: str, friend_uid: str):
+    # the latest session both users are in, two users or a group
+    session = await db.Sessions.find_one({"users_in_session": {"$all": [uid, friend_uid]}}, {"_id": 1},
+                                         sort=[("_id", -1)])
+    return str(session["_id"]) if session is not None else ""
 
 
-def find_session_id(uid: str, friend_uid: str):
-    try:
-        session_id = str(db.Sessions.find_one({"$or": [
-            {"users_in_session": [uid, friend_uid]},
-            {"users_in_session": [friend_uid, uid]}]})["_id"])
+async def end_sessions_of_friends(uid: str, friend_uid: str):
+    # a deleted friendship ends every session both users were in, the other members become friends again
+    # without restoring the deleted one
+    removed = {uid, friend_uid}
+    sessions = db.Sessions.find({"users_in_session": {"$all": [uid, friend_uid]}}, {"users_in_session": 1})
+    async for session in sessions:
+        organizer, *friend_uids = session["users_in_session"]
+        if organizer in removed:
+            friend_uids = [friend for friend in friend_uids if friend not in removed]
+        if friend_uids:
+            await set_session_friend_state(organizer, friend_uids, State.FRIEND)
 
-        return session_id
-    except:
-        return ""
+        await db.Sessions.delete_one({"_id": session["_id"]})
+        await publish_session_closed(str(session["_id"]))
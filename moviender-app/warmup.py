@@ -0,0 +1,59 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class WarmUp:
+    # loads what the first requests would otherwise load, in the background so the worker answers liveness
+    # probes meanwhile, and reports ready once every step is done
+    def __init__(self, retry_interval: float = 5.0):
+        self.retry_interval = retry_interval
+        self.started_at = None
+        self.finished_at = None
+        # seconds each finished step took
+        self.steps = {}
+        self.error = None
+        self._task = None
+        self._done = None
+
+    @property
+    def ready(self):
+        return self.finished_at is not None
+
+    def start(self, steps: List[Tuple[str, Callable[[], Awaitable[None]]]]):
+        self.started_at = time.time()
+        self._done = asyncio.Event()
+        self._task = asyncio.create_task(self._run(steps))
+
+    async def wait(self):
+        await self._done.wait()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _run(self, steps):
+        for name, step in steps:
+            started = time.perf_counter()
+            while True:
+                try:
+                    await step()
+                    break
+                except Exception as e:
+                    # e.g. the database is not reachable yet, stay unready and try again
+                    self.error = f"{name}: {e}"
+                    logger.exception("Warm-up step %s failed, retrying in %ss", name, self.retry_interval)
+                    await asyncio.sleep(self.retry_interval)
+            self.steps[name] = time.perf_counter() - started
+
+        self.error = None
+        self.finished_at = time.time()
+        self._done.set()
+        logger.info("Ready %.2fs after startup", self.finished_at - self.started_at)
+
+    def status(self):
+        return {"ready": self.ready, "steps": self.steps, "error": self.error}
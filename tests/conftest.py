@@ -0,0 +1,52 @@
+import asyncio
+import importlib
+import os
+import sys
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+# no Firebase credentials or shared event collection in tests, set before the app modules are imported
+os.environ.setdefault("NOTIFICATION_TRANSPORT", "local")
+os.environ.setdefault("EVENT_BACKEND", "local")
+
+
+def app_module(name: str):
+    return importlib.import_module(f"moviender-app.{name}")
+
+
+class Interleaved:
+    # a collection that yields to the event loop before every command, so concurrent requests interleave the way
+    # they do against a real server instead of running one after the other
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if not asyncio.iscoroutinefunction(attribute):
+            return attribute
+
+        async def call(*args, **kwargs):
+            await asyncio.sleep(0)
+            return await attribute(*args, **kwargs)
+        return call
+
+
+@pytest.fixture
+def database(monkeypatch):
+    # the app's own Database with an in-memory client injected
+    database = app_module("dependencies").get_db_client()
+    database.connect(AsyncMongoMockClient())
+    connected = database.collection
+    monkeypatch.setattr(database, "collection", lambda name: Interleaved(connected(name)))
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def event_hub():
+    event_hub = app_module("dependencies").get_event_hub()
+    asyncio.run(event_hub.start())
+    yield event_hub
+    asyncio.run(event_hub.stop())
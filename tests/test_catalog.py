@@ -0,0 +1,171 @@
+import asyncio
+
+import httpx
+import pytest
+
+from conftest import app_module
+
+catalog_module = app_module("catalog")
+search = app_module("search")
+
+
+def movie(movielens_id: str, title: str):
+    return {"movielens_id": movielens_id, "title": title, "genre_ids": [28], "popularity": 1.0, "vote_average": 5,
+            "vote_count": 1}
+
+
+def test_refresh_publishes_the_snapshot_after_its_listeners(database):
+    catalog = catalog_module.MovieCatalog(database)
+    title_search = search.TitleSearch()
+    catalog.add_refresh_listener(title_search.rebuild)
+    seen_by_listener = []
+    catalog.add_refresh_listener(lambda snapshot: seen_by_listener.append(catalog.version))
+
+    async def scenario():
+        await database.Movies.insert_one(movie("1", "Amélie"))
+        first = await catalog.refresh()
+        await database.Movies.insert_one(movie("2", "Alien"))
+        second = await catalog.refresh()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+
+    # while the listeners run, requests still get the previous snapshot
+    assert seen_by_listener == [0, first.version]
+    assert title_search.index.version == second.version
+    assert title_search.index.search("alien", ["movielens_id"]) == [{"movielens_id": "2"}]
+
+
+def test_admin_refresh_reloads_the_catalog(database, event_hub, monkeypatch):
+    main = app_module("main")
+    catalog = app_module("dependencies").get_catalog()
+    monkeypatch.setattr(main, "ADMIN_TOKEN", "secret")
+
+    async def scenario():
+        await database.Movies.insert_one(movie("1", "Amélie"))
+        await catalog.refresh()
+        follower = asyncio.create_task(main.follow_catalog_refreshes())
+        await asyncio.sleep(0)
+
+        await database.Movies.insert_one(movie("2", "Alien"))
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            forbidden = await client.post("/admin/catalog_refresh", headers={"X-Admin-Token": "wrong"})
+            accepted = await client.post("/admin/catalog_refresh", headers={"X-Admin-Token": "secret"})
+        for _ in range(100):
+            if len(await catalog.current()) == 2:
+                break
+            await asyncio.sleep(0.01)
+        follower.cancel()
+        return forbidden.status_code, accepted.status_code, len(await catalog.current())
+
+    assert asyncio.run(scenario()) == (403, 200, 2)
+
+
+def test_movie_pages_start_at_one(database):
+    main = app_module("main")
+    catalog = app_module("dependencies").get_catalog()
+
+    async def scenario():
+        await database.Movies.insert_one(movie("1", "Amélie"))
+        await catalog.refresh()
+        async with httpx.AsyncClient(app=main.app, base_url="http://test") as client:
+            return [await client.get(f"/movies/{page}") for page in (-1, 0, 1)]
+
+    negative, zero, first = asyncio.run(scenario())
+    assert (negative.status_code, zero.status_code) == (422, 422)
+    assert first.json() == [{"movielens_id": "1"}]
+
+
+def test_refresh_keeps_the_version_of_an_unchanged_collection(database):
+    catalog = catalog_module.MovieCatalog(database)
+    rebuilt = []
+    catalog.add_refresh_listener(lambda snapshot: rebuilt.append(snapshot.version))
+
+    async def scenario():
+        await database.Movies.insert_one(movie("1", "Amélie"))
+        first = await catalog.refresh()
+        unchanged = await catalog.refresh()
+        await database.Movies.update_one({"movielens_id": "1"}, {"$set": {"popularity": 2.0}})
+        changed = await catalog.refresh()
+        return first, unchanged, changed
+
+    first, unchanged, changed = asyncio.run(scenario())
+
+    assert unchanged is first
+    assert changed.version == first.version + 1
+    assert rebuilt == [first.version, changed.version]
+
+
+def tied_movies(n: int = 100):
+    # three popularities only, so most pages start and end in the middle of a tie
+    return [{**movie(str(movielens_id), f"Movie {movielens_id}"), "popularity": float(movielens_id % 3),
+             "genre_ids": [genre for genre in (1, 2, 3) if movielens_id % (genre + 1) == 0]}
+            for movielens_id in range(n)]
+
+
+def popularity_order(movies, genres_ids=()):
+    return [m["movielens_id"] for m in sorted(movies, key=lambda m: (-m["popularity"], m["movielens_id"]))
+            if not genres_ids or set(m["genre_ids"]) & set(genres_ids)]
+
+
+def walk(snapshot, limit, genres_ids=(), page_key=None):
+    pages = []
+    # more pages than movies means a page key that does not move forward
+    for _ in range(len(snapshot) + 1):
+        rows, page_key = snapshot.page(limit, page_key, genres_ids)
+        pages.append([snapshot.movielens_ids[row] for row in rows])
+        if page_key is None:
+            return pages
+    pytest.fail("the pages never end")
+
+
+@pytest.mark.parametrize("genres_ids", [(), (1,), (2, 3), (99,)])
+@pytest.mark.parametrize("limit", [1, 7, 15, 100])
+def test_pages_cover_tied_popularities_without_overlaps_or_gaps(genres_ids, limit):
+    movies = tied_movies()
+    pages = walk(catalog_module.CatalogSnapshot(movies, 1), limit, genres_ids)
+
+    assert [movielens_id for page in pages for movielens_id in page] == popularity_order(movies, genres_ids)
+    assert all(len(page) == limit for page in pages[:-1])
+
+
+def test_a_page_key_survives_a_refresh_that_removes_the_next_movies():
+    movies = tied_movies()
+    rows, page_key = catalog_module.CatalogSnapshot(movies, 1).page(10)
+    seen = [movies[row]["movielens_id"] for row in rows]
+
+    removed = set(popularity_order(movies)[10:13])
+    remaining = [m for m in movies if m["movielens_id"] not in removed]
+    rest = walk(catalog_module.CatalogSnapshot(remaining, 2), 10, page_key=page_key)
+
+    assert seen + [movielens_id for page in rest for movielens_id in page] == popularity_order(remaining)
+
+
+def test_movie_pages_follow_their_keys_and_reject_invalid_ones(database):
+    main = app_module("main")
+    catalog = app_module("dependencies").get_catalog()
+    movies = tied_movies(40)
+
+    async def scenario():
+        await database.Movies.insert_many([dict(m) for m in movies])
+        await catalog.refresh()
+        pages = []
+        async with httpx.AsyncClient(app=main.app, base_url="http://test") as client:
+            for genres in ([], [2]):
+                page_key, walked = None, []
+                for _ in range(len(movies) + 1):
+                    params = {"genres": genres, **({"next_page_key": page_key} if page_key else {})}
+                    body = (await client.get("/movies", params=params)).json()
+                    walked += [m["movielens_id"] for m in body["movies"]]
+                    page_key = body["next_page_key"]
+                    if page_key is None:
+                        break
+                pages.append(walked)
+            invalid = await client.get("/movies", params={"next_page_key": "not a page key"})
+        return pages, invalid
+
+    (everything, second_genre), invalid = asyncio.run(scenario())
+    assert everything == popularity_order(movies)
+    assert second_genre == popularity_order(movies, [2])
+    assert invalid.status_code == 400
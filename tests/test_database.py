@@ -0,0 +1,45 @@
+import asyncio
+
+import httpx
+from mongomock_motor import AsyncMongoMockClient
+
+from conftest import app_module
+
+database = app_module("database")
+users = app_module("routers.users")
+
+
+def test_an_injected_client_serves_every_collection():
+    db = database.Database("mongodb://never-connected", name="MovienderDB")
+    client = AsyncMongoMockClient()
+    connected = db.connect(client, "Injected")
+
+    async def run():
+        await db.Users.insert_one({"uid": "user"})
+        return await client["Injected"]["Users"].count_documents({"uid": "user"})
+
+    assert connected is db.database
+    assert db.client is client
+    assert asyncio.run(run()) == 1
+    # connecting again without a client keeps the injected one
+    assert db.connect() is connected
+    db.close()
+    other = AsyncMongoMockClient()
+    db.connect(other)
+    assert db.client is other
+
+
+def test_routes_read_through_the_injected_client():
+    db = users.db
+    db.connect(AsyncMongoMockClient())
+    app = app_module("main").app
+
+    async def run():
+        await db.Users.insert_one({"uid": "user", "is_user_initialized": True})
+        async with httpx.AsyncClient(app=app, base_url="http://test") as client:
+            return [(await client.get(f"/initialized/{uid}")).json() for uid in ("user", "nobody")]
+
+    try:
+        assert asyncio.run(run()) == [True, False]
+    finally:
+        db.close()
@@ -0,0 +1,81 @@
+import asyncio
+
+from bson import ObjectId
+
+from conftest import app_module
+
+events = app_module("events")
+utils = app_module("utils")
+
+
+class Connected:
+    def __init__(self):
+        self.disconnected = False
+
+    async def is_disconnected(self):
+        return self.disconnected
+
+
+async def insert_session(database):
+    session = {"users_in_session": ["a", "b"], "users_session_info": {}, "results": [], "users_voted": 0,
+               "state": utils.SessionStatus.WAITING_FOR_VOTES}
+    return str((await database.Sessions.insert_one(session)).inserted_id)
+
+
+def test_events_reach_only_the_subscribers_of_their_channel():
+    hub = events.EventHub(events.LocalEventBackend(), queue_size=2)
+
+    async def run():
+        await hub.start()
+        with hub.subscribe("a") as first, hub.subscribe("a") as second, hub.subscribe("b") as other:
+            assert hub.subscribers("a") == 2
+            for number in range(3):
+                await hub.publish("a", {"type": "session", "data": {"number": number}})
+            received = [[queue.get_nowait()["data"]["number"] for _ in range(queue.qsize())]
+                        for queue in (first, second, other)]
+        await hub.stop()
+        return received
+
+    # a subscriber that fell behind keeps the latest events
+    assert asyncio.run(run()) == [[1, 2], [1, 2], []]
+    assert hub.subscribers("a") == 0
+
+
+def test_session_event_stream_ends_when_the_session_closes(database, event_hub, monkeypatch):
+    monkeypatch.setattr(utils, "SESSION_EVENTS_KEEPALIVE_SECONDS", 0.01)
+
+    async def run():
+        session_id = await insert_session(database)
+        stream = utils.stream_session_events(session_id, Connected())
+        received = [await stream.__anext__(), await stream.__anext__()]
+        await database.Sessions.delete_one({"_id": ObjectId(session_id)})
+        await utils.publish_session_closed(session_id)
+        received += [message async for message in stream]
+        return received, event_hub.subscribers(session_id)
+
+    received, subscribers = asyncio.run(run())
+    assert received[0].startswith("event: session\n")
+    assert received[1] == ": keepalive\n\n"
+    assert received[2:] == ["event: closed\ndata: {}\n\n"]
+    assert subscribers == 0
+
+
+def test_session_event_stream_ends_when_the_client_disconnects(database, event_hub, monkeypatch):
+    monkeypatch.setattr(utils, "SESSION_EVENTS_KEEPALIVE_SECONDS", 0.01)
+    request = Connected()
+
+    async def run():
+        session_id = await insert_session(database)
+        stream = utils.stream_session_events(session_id, request)
+        await stream.__anext__()
+        request.disconnected = True
+        return [message async for message in stream], event_hub.subscribers(session_id)
+
+    assert asyncio.run(run()) == ([], 0)
+
+
+def test_session_event_stream_of_a_missing_session_closes_right_away(database, event_hub):
+    async def run():
+        return [message async for message in utils.stream_session_events(str(ObjectId()), Connected())]
+
+    assert asyncio.run(run()) == ["event: closed\ndata: {}\n\n"]
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+from conftest import app_module
+
+fold_in = app_module("fold_in")
+scoring = app_module("scoring")
+
+
+@pytest.mark.parametrize("biased", [True, False])
+def test_fold_in_minimizes_the_objective_the_model_was_trained_with(biased):
+    rng = np.random.default_rng(0)
+    model = scoring.SVDFactors(global_mean=3.5, rating_scale=(0.5, 5), bu=np.zeros(1), bi=rng.normal(size=6),
+                               pu=np.zeros((1, 3)), qi=rng.normal(size=(6, 3)), biased=biased,
+                               user_ids=np.array(["1"]), item_ids=np.array([str(movie) for movie in range(10, 16)]),
+                               reg_bu=0.3, reg_pu=0.5)
+    ratings = {"10": 4.0, "11": 2.5, "13": 5.0, "15": 1.0, "99": 3.0}
+    bias, factors = fold_in.fold_in_user(model, ratings)
+
+    # sgd minimizes the sum over ratings of err² + reg_bu·bu² + reg_pu·|pu|², every rating adds the penalty
+    inner_iids = model.inner_iids(["10", "11", "13", "15"])
+    values = np.array([4.0, 2.5, 5.0, 1.0])
+    predictions = model.qi[inner_iids] @ factors
+    if biased:
+        predictions += model.global_mean + model.bi[inner_iids] + bias
+    errors = values - predictions
+
+    assert errors @ model.qi[inner_iids] == pytest.approx(len(values) * model.reg_pu * factors)
+    if biased:
+        assert errors.sum() == pytest.approx(len(values) * model.reg_bu * bias)
@@ -0,0 +1,79 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from conftest import app_module
+
+main = app_module("main")
+http_cache = app_module("http_cache")
+
+MOVIES = [{"movielens_id": "1", "title": "Amélie", "overview": "Paris", "release_date": "2001-04-25",
+           "poster_path": "/amelie.jpg", "genre_ids": [35], "vote_average": 7.9, "vote_count": 10, "popularity": 2.0},
+          {"movielens_id": "2", "popularity": 1.0}]
+
+
+async def get_all(database, requests, ratings=None):
+    await database.Movies.insert_many([dict(movie) for movie in MOVIES])
+    await database.Ratings.insert_one({"uid": "user", "ratings": ratings or {}})
+    await app_module("dependencies").get_catalog().refresh()
+    async with httpx.AsyncClient(app=main.app, base_url="http://test") as client:
+        responses = []
+        for path, if_none_match in requests:
+            headers = {}
+            if if_none_match:
+                # {first} is the ETag of the first response
+                headers["If-None-Match"] = if_none_match.format(first=responses[0].headers["etag"])
+            responses.append(await client.get(path, headers=headers))
+        return responses
+
+
+def test_catalog_responses_carry_an_etag_and_are_public(database):
+    first, again = asyncio.run(get_all(database, [("/movies/1", None), ("/movies/1", None)]))
+
+    assert first.status_code == 200
+    assert first.json() == [{"movielens_id": "1", "poster_path": "/amelie.jpg"}, {"movielens_id": "2"}]
+    assert first.headers["cache-control"] == "public, max-age=60"
+    assert first.headers["etag"] == http_cache.make_etag(first.content)
+    assert again.headers["etag"] == first.headers["etag"]
+
+
+@pytest.mark.parametrize("if_none_match, status", [
+    ("{first}", 304),
+    ("W/{first}", 304),
+    ('"other", {first}', 304),
+    ("*", 304),
+    ('"other"', 200),
+])
+def test_if_none_match_revalidates(database, if_none_match, status):
+    first, revalidated = asyncio.run(get_all(database, [("/movies/1", None),
+                                                         ("/movies/1", if_none_match)]))
+
+    assert revalidated.status_code == status
+    assert revalidated.headers["etag"] == first.headers["etag"]
+    assert revalidated.headers["cache-control"] == first.headers["cache-control"]
+    if status == 304:
+        assert revalidated.content == b""
+    else:
+        assert revalidated.content == first.content
+
+
+def test_movie_details_append_the_users_rating_to_the_cached_metadata(database):
+    rated, unrated, empty, revalidated = asyncio.run(get_all(database, [
+        ("/movie_details/1?uid=user", None),
+        ("/movie_details/1?uid=someone", None),
+        ("/movie_details/2?uid=user", None),
+        ("/movie_details/1?uid=user", "{first}"),
+    ], ratings={"1": 4.5}))
+
+    assert json.loads(rated.content) == {"poster_path": "/amelie.jpg", "genre_ids": [35], "title": "Amélie",
+                                         "overview": "Paris", "release_date": "2001-04-25", "vote_average": 7.9,
+                                         "user_rating": 4.5}
+    assert json.loads(unrated.content)["user_rating"] == 0.0
+    # a movie without any of the metadata fields
+    assert empty.content == b'{"user_rating":0.0}'
+    assert rated.headers["cache-control"] == "private, no-cache"
+    assert rated.headers["etag"] != unrated.headers["etag"]
+    assert rated.headers["etag"] == http_cache.make_etag(rated.content)
+    assert revalidated.status_code == 304
@@ -0,0 +1,182 @@
+import asyncio
+import os
+import uuid
+
+import httpx
+import pytest
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import MongoClient, monitoring
+from pymongo.errors import PyMongoError
+
+from conftest import app_module
+
+indexes = app_module("indexes")
+main = app_module("main")
+utils = app_module("utils")
+
+MONGO_URI = os.getenv("TEST_MONGO_URI", "mongodb://localhost:27017")
+EXPLAINABLE = {"find", "aggregate", "count", "distinct", "findAndModify", "update", "delete"}
+# fields of a sent command that an explain of it does not accept
+NOT_EXPLAINED = {"lsid", "txnNumber", "writeConcern", "$db", "$clusterTime", "$readPreference"}
+# the event stream never ends, its only query is a session by _id
+NOT_REQUESTED = {"/session_events/{session_id}"}
+
+
+def mongod_available():
+    try:
+        MongoClient(MONGO_URI, serverSelectionTimeoutMS=500).admin.command("ping")
+        return True
+    except PyMongoError:
+        return False
+
+
+needs_mongod = pytest.mark.skipif(not mongod_available(), reason=f"no mongod at {MONGO_URI}, set TEST_MONGO_URI")
+
+
+class CommandRecorder(monitoring.CommandListener):
+    def __init__(self):
+        self.commands = []
+
+    def started(self, event):
+        if event.command_name in EXPLAINABLE:
+            self.commands.append({key: value for key, value in event.command.items() if key not in NOT_EXPLAINED})
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def single_statements(command):
+    # an explain takes one update or delete statement at a time
+    for field in ("updates", "deletes"):
+        if field in command:
+            return [{**command, field: [statement]} for statement in command[field]]
+    return [command]
+
+
+def winning_plans(explanation):
+    if isinstance(explanation, dict):
+        for key, value in explanation.items():
+            if key == "winningPlan":
+                yield value
+            else:
+                yield from winning_plans(value)
+    elif isinstance(explanation, list):
+        for value in explanation:
+            yield from winning_plans(value)
+
+
+def requests(ids):
+    uid, friend_uid, other_uid = "uid-0", "uid-1", "uid-2"
+    session_id = ids["session"]
+    return [
+        ("/initialized/{uid}", "GET", f"/initialized/{uid}", None, None),
+        ("/friends/{uid}", "GET", f"/friends/{uid}", None, None),
+        ("/genrePreferences/{uid}", "GET", f"/genrePreferences/{uid}", None, None),
+        ("/user", "POST", "/user", None, {"uid": "uid-new", "username": "new", "profile_pic_url": "pic"}),
+        ("/fcm_token/{uid}", "POST", f"/fcm_token/{uid}", {"token": "token"}, None),
+        ("/userInitialization", "POST", "/userInitialization", None,
+         {"uid": "uid-new", "ratings": [{"movielens_id": "1", "rating": 4}]}),
+        ("/userGenrePreference/", "POST", "/userGenrePreference/", None, {"uid": "uid-new", "genres_ids": [28]}),
+        ("/friend_request/{uid}", "POST", f"/friend_request/{uid}", {"friend_username": "username-2"}, None),
+        ("/respond_friend_request/{uid}", "POST", f"/respond_friend_request/{other_uid}",
+         {"friend_uid": uid, "response": 12}, None),
+        ("/starter", "GET", "/starter", None, None),
+        ("/session_movies/{session_id}", "GET", f"/session_movies/{session_id}", {"uid": uid}, None),
+        ("/movies", "GET", "/movies", {"genres": [28]}, None),
+        ("/movies/{page}", "GET", "/movies/1", None, None),
+        ("/movie_details/{movie_id}", "GET", "/movie_details/1", {"uid": uid}, None),
+        ("/movie_details/{movie_id}", "GET", "/movie_details/not-in-catalog", {"uid": uid}, None),
+        ("/movie_rating/{movie_id}", "GET", "/movie_rating/1", {"uid": uid}, None),
+        ("/search", "GET", "/search", {"title": "movie"}, None),
+        ("/user_recommendations/{page}", "GET", "/user_recommendations/1", {"uid": uid}, None),
+        ("/rating", "POST", "/rating", None, {"uid": uid, "ratings": [{"movielens_id": "2", "rating": 3}]}),
+        ("/ratings", "POST", "/ratings", None, {"uid": uid, "ratings": [{"movielens_id": "3", "rating": 5}]}),
+        ("/session_id", "GET", "/session_id", {"uid": uid, "friend_uid": friend_uid}, None),
+        ("/user_state/{session_id}", "GET", f"/user_state/{session_id}", {"uid": uid}, None),
+        ("/session_state/{session_id}", "GET", f"/session_state/{session_id}", None, None),
+        ("/session_user_votes/{session_id}", "GET", f"/session_user_votes/{session_id}", {"uid": uid}, None),
+        ("/session_results/{session_id}", "GET", f"/session_results/{session_id}", None, None),
+        ("/session_recommendations/{uid}", "POST", f"/session_recommendations/{uid}", None,
+         {"friend_uid": other_uid, "genres_ids": []}),
+        ("/session_sim/{uid}", "POST", f"/session_sim/{uid}", None, {"friend_uid": other_uid, "movielens_id": "1"}),
+        ("/vote_in_session/{session_id}", "POST", f"/vote_in_session/{session_id}", None,
+         {"uid": uid, "votes": [True]}),
+        ("/vote_in_session/{session_id}", "POST", f"/vote_in_session/{session_id}", None,
+         {"uid": friend_uid, "votes": [True]}),
+        ("/delete_friend/{uid}", "POST", f"/delete_friend/{uid}", {"friend_uid": friend_uid}, None),
+        ("/close_session/{session_id}", "POST", f"/close_session/{session_id}", None, None),
+    ]
+
+
+async def seed(database):
+    movies = [{"movielens_id": str(movie), "title": f"Movie {movie}", "overview": "", "release_date": "2000-01-01",
+               "poster_path": f"/{movie}.jpg", "genre_ids": [28], "popularity": float(movie), "vote_average": 5,
+               "vote_count": 10} for movie in range(1, 6)]
+    await database.Movies.insert_many(movies)
+    uids = ["uid-0", "uid-1", "uid-2"]
+    friend_lists = {"uid-0": {"uid-1": 4}, "uid-1": {"uid-0": 4}, "uid-2": {}}
+    await database.Users.insert_many([{"uid": uid, "username": f"username-{user}", "profile_pic": "pic",
+                                       "is_user_initialized": True, "genre_preference": [28],
+                                       "friend_list": friend_lists[uid], "fcm_token": None}
+                                      for user, uid in enumerate(uids)])
+    await database.Ratings.insert_many([{"uid": uid, "ratings": {"1": 4.0}} for uid in uids])
+    session = await database.Sessions.insert_one(
+        {"users_in_session": ["uid-0", "uid-1"],
+         "users_session_info": {uid: {"state": 30, "voted_movies": []} for uid in ("uid-0", "uid-1")},
+         "results": [], "users_voted": 0, "recommendations": ["1"], "is_active": True, "state": 20})
+    return {"session": str(session.inserted_id)}
+
+
+@pytest.fixture
+def recorded_database():
+    recorder = CommandRecorder()
+    database = app_module("dependencies").get_db_client()
+    name = f"MovienderIndexTest{uuid.uuid4().hex[:8]}"
+    database.connect(AsyncIOMotorClient(MONGO_URI, event_listeners=[recorder]), name)
+    yield database, recorder
+    MongoClient(MONGO_URI).drop_database(name)
+    database.close()
+
+
+async def exercise(database, recorder):
+    await indexes.ensure_indexes(database)
+    ids = await seed(database)
+    # the catalog reads the whole Movies collection on purpose, it is loaded before recording starts,
+    # every command sent after that has to use an index, unfiltered ones included
+    await app_module("dependencies").get_catalog().refresh()
+    recorder.commands.clear()
+
+    transport = httpx.ASGITransport(app=main.app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        for _, method, path, params, body in requests(ids):
+            await client.request(method, path, params=params, json=body)
+    # reached only past a model lookup in the routes, the test has no trained models
+    await utils.check_if_users_are_in_session("uid-0", ["uid-2"])
+    await utils.start_session("uid-0", ["uid-2"], ["1"])
+
+    plans = []
+    for command in recorder.commands:
+        for statement in single_statements(command):
+            explanation = await database.database.command({"explain": statement, "verbosity": "queryPlanner"})
+            stages = [stage for plan in winning_plans(explanation) for stage in indexes.plan_stages(plan)]
+            plans.append((statement, stages))
+    return plans
+
+
+def test_every_route_is_exercised():
+    templates = {template for template, *_ in requests({"session": "id"})}
+    routes = {route.path for route in main.app.routes if getattr(route, "tags", None)}
+    assert routes - NOT_REQUESTED == templates
+
+
+@needs_mongod
+def test_no_query_scans_a_collection(recorded_database, event_hub):
+    database, recorder = recorded_database
+    plans = asyncio.run(exercise(database, recorder))
+
+    assert plans
+    full_scans = [(statement, stages) for statement, stages in plans if "COLLSCAN" in stages]
+    assert full_scans == []
@@ -0,0 +1,33 @@
+import asyncio
+
+import httpx
+from bson import ObjectId
+from prometheus_client import REGISTRY
+
+from conftest import app_module
+
+main = app_module("main")
+
+
+def test_event_streams_are_not_request_latencies(database, event_hub):
+    route = "/session_events/{session_id}"
+
+    def count(metric, **labels):
+        return REGISTRY.get_sample_value(f"{metric}_count", labels) or 0
+
+    async def run():
+        async with httpx.AsyncClient(app=main.app, base_url="http://test") as client:
+            # a missing session closes its stream right away
+            response = await client.get(f"/session_events/{ObjectId()}")
+            await client.get("/healthz")
+        return response
+
+    before = (count("moviender_stream_duration_seconds", route=route, status="200"),
+              count("moviender_request_duration_seconds", method="GET", route=route, status="200"),
+              count("moviender_request_duration_seconds", method="GET", route="/healthz", status="200"))
+    response = asyncio.run(run())
+
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert count("moviender_stream_duration_seconds", route=route, status="200") == before[0] + 1
+    assert count("moviender_request_duration_seconds", method="GET", route=route, status="200") == before[1]
+    assert count("moviender_request_duration_seconds", method="GET", route="/healthz", status="200") == before[2] + 1
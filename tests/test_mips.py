@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from conftest import app_module
+
+mips = app_module("mips")
+model_registry = app_module("model_registry")
+scoring = app_module("scoring")
+
+
+def factors(seed: int):
+    rng = np.random.default_rng(seed)
+    return scoring.SVDFactors(global_mean=3.5, rating_scale=(0.5, 5), bu=np.zeros(1), bi=rng.normal(size=50),
+                              pu=np.zeros((1, 4)), qi=rng.normal(size=(50, 4)), biased=True, user_ids=np.array(["1"]),
+                              item_ids=np.array([str(movie) for movie in range(100, 150)]))
+
+
+def test_the_index_is_built_with_every_model_load_before_requests_get_it(tmp_path):
+    path = tmp_path / "svd.json"
+    path.write_text("1")
+    loads = iter([factors(0), factors(1)])
+    index = mips.ItemFactorIndex(n_probe=50)
+    registry = model_registry.ModelRegistry()
+    registry.register("svd", str(path), lambda path: next(loads))
+    seen = []
+    registry.add_load_listener("svd", index.rebuild)
+
+    def check(entry):
+        served = registry.loaded("svd") and registry.entry("svd").version == entry.version
+        seen.append((index.index_for(entry) is not None, served))
+    registry.add_load_listener("svd", check)
+
+    first = registry.load("svd")
+    path.write_text("22")
+    second = registry.load("svd")
+
+    # built, and not served yet
+    assert seen == [(True, False), (True, False)]
+    # a request that still holds the previous model keeps its index
+    assert index.index_for(first) is not index.index_for(second)
+    pu = np.ones(4)
+    for entry in (first, second):
+        expected, _ = index.index_for(entry).brute_force(mips.user_query(entry.model, pu), 5)
+        assert index.top_movies(entry, pu, 5) == [str(movie) for movie in entry.model.item_ids[expected]]
+
+    stale = first._replace(version="unknown")
+    with pytest.raises(model_registry.ModelNotLoaded):
+        index.index_for(stale)
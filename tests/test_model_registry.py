@@ -0,0 +1,91 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import pytest
+
+from conftest import app_module
+
+model_registry = app_module("model_registry")
+main = app_module("main")
+
+
+def test_concurrent_loads_of_a_model_load_it_once(tmp_path):
+    path = tmp_path / "model"
+    path.write_text("model")
+    calls = []
+
+    def slow_loader(path):
+        calls.append(path)
+        time.sleep(0.05)
+        return object()
+
+    registry = model_registry.ModelRegistry()
+    registry.register("model", str(path), slow_loader)
+    with pytest.raises(model_registry.ModelNotLoaded):
+        registry.entry("model")
+
+    threads = [threading.Thread(target=registry.load, args=("model",)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert registry.entry("model").path == str(path)
+
+
+def test_requests_get_503_until_the_model_is_loaded(database):
+    async def request():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get("/user_recommendations/1", params={"uid": "uid", "model_weight": 1})
+
+    response = asyncio.run(request())
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "5"
+
+
+def test_update_check_switches_to_the_preferred_path_once_it_appears(tmp_path):
+    preferred, fallback = tmp_path / "model.json", tmp_path / "model.pickle"
+    fallback.write_text("pickle")
+
+    registry = model_registry.ModelRegistry(check_interval=0)
+    registry.register("model", str(preferred), lambda path: "export", fallback=(str(fallback), lambda path: "pickle"))
+    assert registry.load("model").model == "pickle"
+
+    preferred.write_text("export")
+    registry.entry("model")
+    for _ in range(100):
+        if registry.entry("model").model == "export":
+            break
+        time.sleep(0.01)
+
+    assert registry.entry("model").path == str(preferred)
+    assert registry.entry("model").model == "export"
+
+
+def test_the_neighbour_table_is_built_from_a_pickled_knn_model(tmp_path):
+    from surprise import Dataset, KNNBaseline, Reader, dump
+
+    neighbours = app_module("neighbours")
+    ratings = tmp_path / "ratings.csv"
+    ratings.write_text("".join(f"{user},{movie},{(user * movie) % 5 + 1}\n" for user in range(1, 8)
+                               for movie in range(1, 7)))
+    dataset = Dataset.load_from_file(str(ratings), Reader(line_format="user item rating", sep=",", rating_scale=(1, 5)))
+    algo = KNNBaseline(sim_options={"name": "pearson_baseline", "user_based": False}, verbose=False)
+    algo.fit(dataset.build_full_trainset())
+    pickle = tmp_path / "trainedKNNBaseline.model"
+    dump.dump(str(pickle), algo=algo)
+
+    registry = model_registry.ModelRegistry()
+    registry.register("knn_neighbours", str(tmp_path / "knnNeighbours.npy"), neighbours.NeighbourTable.load,
+                      fallback=(str(pickle), neighbours.load_knn_neighbours))
+    table = registry.load("knn_neighbours").model
+
+    for movie in ("1", "4"):
+        expected = [algo.trainset.to_raw_iid(inner_id)
+                    for inner_id in algo.get_neighbors(algo.trainset.to_inner_iid(movie), 5)]
+        assert table.similar(movie, 5) == expected
@@ -0,0 +1,60 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from firebase_admin import exceptions, messaging
+
+from conftest import app_module
+
+notifications = app_module("notifications")
+Delivery = notifications.Delivery
+
+
+@pytest.mark.parametrize("error, delivery", [
+    (messaging.UnregisteredError("unregistered"), Delivery.INVALID_TOKEN),
+    (messaging.SenderIdMismatchError("sender id mismatch"), Delivery.INVALID_TOKEN),
+    (exceptions.InvalidArgumentError("invalid data payload"), Delivery.FAILED),
+    (messaging.QuotaExceededError("quota exceeded"), Delivery.RETRY),
+    (exceptions.UnavailableError("unavailable"), Delivery.RETRY),
+])
+def test_only_unregistered_tokens_are_invalid(error, delivery):
+    response = SimpleNamespace(success=False, exception=error)
+    assert notifications.FirebaseTransport._delivery(response, exceptions, messaging) == delivery
+
+
+async def dispatch(database, transport, tokens, **options):
+    await database.Users.insert_many([{"uid": uid, "fcm_token": token} for uid, token in tokens.items()])
+    dispatcher = notifications.NotificationDispatcher(database, transport, batch_size=2, batch_wait=0.01,
+                                                      backoff=0.01, **options)
+    await dispatcher.start()
+    for uid, token in tokens.items():
+        dispatcher.enqueue(uid, token, {"type": "test"})
+
+    # retried notifications leave the queue until their backoff is over
+    await dispatcher.queue.join()
+    while dispatcher.depth():
+        await asyncio.sleep(0.01)
+        await dispatcher.queue.join()
+    await dispatcher.stop()
+    stored = {user["uid"]: user["fcm_token"] async for user in database.Users.find()}
+    return dispatcher.counts, stored
+
+
+def test_dispatcher_batches_retries_and_drops_invalid_tokens(database):
+    transport = notifications.LocalTransport(invalid_tokens={"stale"}, failures=1)
+    tokens = {"a": "token-a", "b": "stale", "c": "token-c", "d": "token-d", "e": "token-e"}
+    counts, stored = asyncio.run(dispatch(database, transport, tokens))
+
+    assert all(len(batch) <= 2 for batch in transport.batches)
+    assert sorted(notification.uid for batch in transport.batches for notification in batch) == sorted(tokens)
+    assert counts == {"sent": 4, "retry": 2, "invalid_token": 1, "failed": 0, "dropped": 0}
+    assert stored == {**tokens, "b": None}
+
+
+def test_dispatcher_gives_up_after_the_last_retry(database):
+    transport = notifications.LocalTransport(failures=10)
+    counts, stored = asyncio.run(dispatch(database, transport, {"a": "token-a"}, max_retries=2))
+
+    assert transport.batches == []
+    assert counts == {"sent": 0, "retry": 2, "invalid_token": 0, "failed": 1, "dropped": 0}
+    assert stored == {"a": "token-a"}
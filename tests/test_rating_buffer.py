@@ -0,0 +1,72 @@
+import asyncio
+
+from conftest import app_module
+
+rating_buffer = app_module("rating_buffer")
+utils = app_module("utils")
+
+
+class FailingRatings:
+    def __init__(self):
+        self.attempts = 0
+
+    async def update_one(self, *args, **kwargs):
+        self.attempts += 1
+        await asyncio.sleep(0)
+        raise ConnectionError("no primary")
+
+
+class FailingDatabase:
+    def __init__(self):
+        self.Ratings = FailingRatings()
+
+
+def rate(uid, *ratings):
+    return utils.apply_ratings(uid, [utils.Rating(movielens_id=movie_id, rating=rating)
+                                     for movie_id, rating in ratings])
+
+
+def test_buffered_ratings_are_read_before_they_are_written(database, monkeypatch):
+    monkeypatch.setattr(utils.rating_buffer, "window", 60)
+    monkeypatch.setattr(utils.rating_buffer, "_db", database)
+
+    async def run():
+        await database.Ratings.insert_one({"uid": "user", "ratings": {"1": 4.0, "2": 3.0}})
+        missing = await rate("nobody", ("1", 5))
+        buffered = await rate("user", ("1", 0), ("3", 5))
+        before = ([await utils.get_user_rating("user", movie_id) for movie_id in ("1", "2", "3")],
+                  (await utils.fetch_users_ratings(["user"]))["user"])
+        await utils.rating_buffer.flush_all()
+        stored = (await database.Ratings.find_one({"uid": "user"}))["ratings"]
+        return missing, buffered, before, stored
+
+    missing, buffered, before, stored = asyncio.run(run())
+    assert [result["status"] for result in missing] == [utils.RatingStatus.USER_NOT_FOUND]
+    assert [result["status"] for result in buffered] == [utils.RatingStatus.BUFFERED] * 2
+    assert before == ([0.0, 3.0, 5.0], {"2": 3.0, "3": 5.0})
+    assert stored == {"2": 3.0, "3": 5.0}
+    assert utils.rating_buffer.pending() == 0
+
+
+def test_failed_writes_back_off_and_are_dropped_after_the_last_retry():
+    db = FailingDatabase()
+    buffer = rating_buffer.RatingWriteBuffer(db, window=1, max_retries=2)
+
+    async def run():
+        loop = asyncio.get_event_loop()
+        delays = []
+        buffer.add("user", {"1": 4.0})
+        for rating in (3.0, 2.0, 1.0):
+            flushing = asyncio.ensure_future(buffer.flush("user"))
+            await asyncio.sleep(0)
+            # rated while the write is in flight, the retry still waits for the backoff
+            buffer.add("user", {"2": rating})
+            await flushing
+            delays.append(round(buffer._timers["user"].when() - loop.time()) if "user" in buffer._timers else None)
+        return delays, buffer._pending
+
+    delays, pending = asyncio.run(run())
+    assert db.Ratings.attempts == 3
+    assert delays == [2, 4, 1]
+    # the failed ratings are dropped, the one rated during the last write waits for its own window
+    assert pending == {"user": {"2": 1.0}}
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from conftest import app_module
+
+scoring = app_module("scoring")
+
+
+def export(tmp_path):
+    rng = np.random.default_rng(0)
+    factors = scoring.SVDFactors(global_mean=3.5, rating_scale=(0.5, 5), bu=rng.normal(size=3), bi=rng.normal(size=4),
+                                 pu=rng.normal(size=(3, 2)), qi=rng.normal(size=(4, 2)), biased=True,
+                                 user_ids=np.array(["1", "2", "3"]), item_ids=np.array(["10", "20", "30", "40"]))
+    manifest_path = str(tmp_path / "svd.json")
+    directory = factors.save(manifest_path)
+    return manifest_path, tmp_path / directory
+
+
+def test_a_truncated_export_is_rejected_without_hashing_it(tmp_path, monkeypatch):
+    manifest_path, directory = export(tmp_path)
+    monkeypatch.setattr(scoring, "file_sha256", lambda path: pytest.fail("hashed on a default load"))
+    assert list(scoring.SVDFactors.load(manifest_path).item_ids) == ["10", "20", "30", "40"]
+
+    path = directory / "qi.npy"
+    path.write_bytes(path.read_bytes()[:-8])
+    with pytest.raises(ValueError, match="size"):
+        scoring.SVDFactors.load(manifest_path)
+
+
+def test_verify_rehashes_the_export(tmp_path):
+    manifest_path, directory = export(tmp_path)
+    path = directory / "bu.npy"
+    content = bytearray(path.read_bytes())
+    content[-1] ^= 0xFF
+    path.write_bytes(bytes(content))
+
+    scoring.SVDFactors.load(manifest_path)
+    with pytest.raises(ValueError, match="checksum"):
+        scoring.SVDFactors.load(manifest_path, verify=True)
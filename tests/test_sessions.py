@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+from bson import ObjectId
+
+from conftest import app_module
+
+friends = app_module("routers.friends")
+sessions = app_module("routers.sessions")
+utils = app_module("utils")
+
+RECOMMENDATIONS = ["1", "2", "3", "4"]
+
+
+def new_session(uids):
+    return {"users_in_session": uids,
+            "users_session_info": {uid: {"state": utils.SessionUserStatus.VOTING, "voted_movies": []} for uid in uids},
+            "results": [], "users_voted": 0, "recommendations": RECOMMENDATIONS, "is_active": True,
+            "state": utils.SessionStatus.WAITING_FOR_VOTES}
+
+
+async def vote_at_once(database, event_hub, votes):
+    session_id = str((await database.Sessions.insert_one(new_session(list(votes)))).inserted_id)
+    with event_hub.subscribe(session_id) as events:
+        statuses = await asyncio.gather(*(sessions.vote_in_session(session_id, utils.UserVotesBody(uid=uid, votes=v))
+                                          for uid, v in votes.items()))
+        published = [events.get_nowait()["data"] for _ in range(events.qsize())]
+    return statuses, await database.Sessions.find_one({"_id": ObjectId(session_id)}), published
+
+
+@pytest.mark.parametrize("n_users", [2, 3, 8])
+def test_simultaneous_votes_finish_the_session_once(database, event_hub, n_users):
+    votes = {f"user-{user}": [False, True, user % 2 == 0, False] for user in range(n_users)}
+    statuses, session, published = asyncio.run(vote_at_once(database, event_hub, votes))
+
+    assert statuses.count(utils.SessionStatus.SUCCESSFUL_FINISH) == 1
+    assert statuses.count(utils.SessionStatus.WAITING_FOR_VOTES) == n_users - 1
+    assert session["state"] == utils.SessionStatus.SUCCESSFUL_FINISH
+    assert session["users_voted"] == n_users
+    assert session["results"] == ["2"]
+    assert [event["state"] for event in published].count(utils.SessionStatus.SUCCESSFUL_FINISH) == 1
+
+
+@pytest.mark.parametrize("n_users", [2, 3, 8])
+def test_simultaneous_votes_without_a_match_start_one_new_round(database, event_hub, n_users):
+    # every user likes a different one of the first two movies and has two more to vote on
+    votes = {f"user-{user}": [user == 0, user != 0] for user in range(n_users)}
+    statuses, session, published = asyncio.run(vote_at_once(database, event_hub, votes))
+
+    assert statuses.count(utils.SessionStatus.WAITING_FOR_VOTES) == n_users
+    assert session["state"] == utils.SessionStatus.WAITING_FOR_VOTES
+    assert session["users_voted"] == 0
+    assert all(info["state"] == utils.SessionUserStatus.VOTING_AGAIN
+               for info in session["users_session_info"].values())
+    new_rounds = [event for event in published
+                  if all(user["state"] == utils.SessionUserStatus.VOTING_AGAIN for user in event["users"].values())]
+    assert len(new_rounds) == 1
+
+
+@pytest.mark.parametrize("n_users", [2, 3, 8])
+def test_simultaneous_votes_on_every_movie_without_a_match_fail_once(database, event_hub, n_users):
+    votes = {f"user-{user}": [index == user % len(RECOMMENDATIONS) for index in range(len(RECOMMENDATIONS))]
+             for user in range(n_users)}
+    votes["user-0"] = [False] * len(RECOMMENDATIONS)
+    statuses, session, published = asyncio.run(vote_at_once(database, event_hub, votes))
+
+    assert statuses.count(utils.SessionStatus.FAILED_FINISH) == 1
+    assert session["state"] == utils.SessionStatus.FAILED_FINISH
+    assert session["users_voted"] == n_users
+    assert [event["state"] for event in published].count(utils.SessionStatus.FAILED_FINISH) == 1
+
+
+async def end_group_session_by_unfriending(database, event_hub, uid, friend_uid):
+    await database.Users.insert_many([
+        {"uid": "organizer", "friend_list": {"a": utils.State.SESSION, "b": utils.State.SESSION}},
+        {"uid": "a", "friend_list": {"organizer": utils.State.SESSION, "b": utils.State.FRIEND}},
+        {"uid": "b", "friend_list": {"organizer": utils.State.SESSION, "a": utils.State.FRIEND}},
+    ])
+    session_id = str((await database.Sessions.insert_one(new_session(["organizer", "a", "b"]))).inserted_id)
+    found = [await utils.find_session_id(*pair) for pair in (("a", "b"), ("b", "organizer"))]
+
+    with event_hub.subscribe(session_id) as events:
+        deleted = await friends.delete_friend(uid, friend_uid)
+        published = [events.get_nowait()["type"] for _ in range(events.qsize())]
+    users = {user["uid"]: user["friend_list"] async for user in database.Users.find()}
+    return session_id, found, deleted, published, await database.Sessions.count_documents({}), users
+
+
+def test_unfriending_the_organizer_ends_the_group_session(database, event_hub):
+    session_id, found, deleted, published, remaining, users = asyncio.run(
+        end_group_session_by_unfriending(database, event_hub, "organizer", "a"))
+
+    assert found == [session_id, session_id]
+    assert deleted is True
+    assert published == ["closed"]
+    assert remaining == 0
+    assert users == {"organizer": {"b": utils.State.FRIEND}, "a": {"b": utils.State.FRIEND},
+                     "b": {"organizer": utils.State.FRIEND, "a": utils.State.FRIEND}}
+
+
+def test_unfriending_between_invited_friends_ends_the_group_session(database, event_hub):
+    _, _, deleted, published, remaining, users = asyncio.run(
+        end_group_session_by_unfriending(database, event_hub, "a", "b"))
+
+    assert deleted is True
+    assert published == ["closed"]
+    assert remaining == 0
+    assert users == {"organizer": {"a": utils.State.FRIEND, "b": utils.State.FRIEND},
+                     "a": {"organizer": utils.State.FRIEND}, "b": {"organizer": utils.State.FRIEND}}
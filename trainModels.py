@@ -1,38 +1,109 @@
+import argparse
+import importlib
 import io
+import itertools
+import json
+import multiprocessing
 import os
+import random
+import resource
+import shutil
+import sys
+import time
+import numpy as np
 from pymongo import MongoClient
-from surprise import SVD, KNNBaseline, dump, Reader, Dataset
+from surprise import SVD, KNNBaseline, dump, Reader, Dataset, accuracy
+from surprise.dataset import DatasetAutoFolds
+from surprise.model_selection import KFold
+
+neighbours = importlib.import_module("moviender-app.neighbours")
+scoring = importlib.import_module("moviender-app.scoring")
 
 client = MongoClient('mongodb://localhost:27017')
 db = client.MovienderDB
+NUM_OF_NEIGHBOURS = neighbours.NUM_OF_NEIGHBOURS
+BATCH_SIZE = 10000
+PROGRESS_EVERY = 1000000
 
+SVD_PARAMS = {"n_factors": 150, "n_epochs": 25, "lr_all": 0.01, "reg_all": 0.5}
+KNN_PARAMS = {"k": 40, "min_k": 15, "sim_options": {"name": "pearson_baseline", "user_based": False}}
+SVD_PARAM_GRID = {"n_factors": [50, 100, 150], "n_epochs": [20, 25], "lr_all": [0.005, 0.01], "reg_all": [0.1, 0.5]}
+KNN_PARAM_GRID = {"k": [20, 40], "min_k": [5, 15],
+                  "sim_options": [{"name": "pearson_baseline", "user_based": False},
+                                  {"name": "msd", "user_based": False}]}
+ALGORITHMS = {"svd": SVD, "knn": KNNBaseline}
 
-def export_data_file():
-    filePath = "resources/initial_ratings.dat"
-    ratings = []
+# trainset and folds handed to the worker processes
+_shared = {}
 
-    with io.open(filePath, 'r', encoding='ISO-8859-1') as f:
-        for line in f:
-            line_split = line.split('::')
-            ratings.append(line_split)
 
-    cursor = list(db.Ratings.find())
+def read_initial_ratings(file_path="resources/initial_ratings.dat"):
+    with io.open(file_path, 'r', encoding='ISO-8859-1') as f:
+        for line in f:
+            uid, movie_id, rating, timestamp = line.split('::')
+            yield uid, movie_id, rating, timestamp.strip()
 
-    movies = list(db.Movies.find())
-    movies_ids = [movie["movielens_id"] for movie in movies]
 
+def read_user_ratings(batch_size=BATCH_SIZE):
+    cursor = db.Ratings.find({}, {"_id": 0, "uid": 1, "ratings": 1}, batch_size=batch_size)
     for user in cursor:
-        for movie_id in user["ratings"].keys():
-            ratings.append([user['uid'], movie_id, user["ratings"][movie_id], "000000000"])
+        for movie_id, rating in user["ratings"].items():
+            yield user['uid'], movie_id, rating, "000000000"
+
+
+def read_catalog_movie_ids(batch_size=BATCH_SIZE):
+    cursor = db.Movies.find({}, {"_id": 0, "movielens_id": 1}, batch_size=batch_size)
+    return {movie["movielens_id"] for movie in cursor}
+
+
+def filter_catalog_ratings(ratings, movies_ids):
+    for rating in ratings:
+        if rating[1] in movies_ids:
+            yield rating
+
+
+def report_progress(ratings, label, every=PROGRESS_EVERY):
+    started = time.perf_counter()
+    count = 0
+    for rating in ratings:
+        count += 1
+        if count % every == 0:
+            print(f"{label}: {count} ratings ({count / (time.perf_counter() - started):.0f} ratings/s)")
+        yield rating
 
+    elapsed = time.perf_counter() - started
+    print(f"{label}: {count} ratings in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f} ratings/s)")
+
+
+def export_ratings():
+    # initial MovieLens ratings followed by the app users' ratings, keeping only movies that are in the catalog
+    movies_ids = read_catalog_movie_ids()
+    ratings = itertools.chain(read_initial_ratings(), read_user_ratings())
+    return report_progress(filter_catalog_ratings(ratings, movies_ids), "Exported")
+
+
+def export_data_file():
     with open("resources/ratings.dat", 'w') as f:
-        for rating in ratings:
-            if rating[1] in movies_ids:
-                uid = rating[0]
-                movie_id = rating[1]
-                rating_value = int(rating[2])
-                timestamp = rating[3].strip()
-                f.write(f"{uid}::{movie_id}::{rating_value}::{timestamp}\n")
+        for uid, movie_id, rating, timestamp in export_ratings():
+            f.write(f"{uid}::{movie_id}::{int(rating)}::{timestamp}\n")
+
+
+class RatingsDataset(DatasetAutoFolds):
+    # a Surprise dataset built from raw (user, item, rating, timestamp) tuples instead of a ratings file
+    def __init__(self, raw_ratings, reader):
+        Dataset.__init__(self, reader)
+        self.has_been_split = False
+        self.raw_ratings = raw_ratings
+
+
+def load_in_memory_dataset():
+    reader = Reader(line_format='user item rating timestamp', sep='::')
+
+    # ids repeat once per rating, interning keeps a single copy of each
+    raw_ratings = [(sys.intern(uid), sys.intern(movie_id), float(int(rating)), timestamp)
+                   for uid, movie_id, rating, timestamp in export_ratings()]
+
+    return RatingsDataset(raw_ratings, reader)
 
 
 def load_custom_dataset():
@@ -43,41 +114,227 @@ def load_custom_dataset():
     return Dataset.load_from_file(file_path=file_path_large, reader=reader_large)
 
 
-def train_svd():
-    # load custom dataset
-    data = load_custom_dataset()
-    trainset = data.build_full_trainset()
+def dump_model(file_name, algo):
+    # write next to the target and swap it in, so the API never reads a half-written model
+    tmp_file_name = f"{file_name}.tmp"
+    dump.dump(file_name=tmp_file_name, algo=algo)
+    os.replace(tmp_file_name, file_name)
+
+
+def export_neighbour_table(algo, k=NUM_OF_NEIGHBOURS):
+    # the same table the API builds when it only finds the pickle
+    table = neighbours.build_neighbour_table(algo, k)
+
+    file_name = os.path.expanduser('TrainedModels/knnNeighbours.npy')
+    tmp_file_name = f"{file_name}.tmp"
+    with open(tmp_file_name, 'wb') as f:
+        np.save(f, table)
+    os.replace(tmp_file_name, file_name)
+
+
+def export_svd_factors(algo, keep=2):
+    # compact, memory-mappable form of the model that the API prefers over the pickle
+    manifest_path = os.path.expanduser('TrainedModels/svd.json')
+    current = scoring.SVDFactors.from_algo(algo).save(manifest_path)
+
+    # running workers may still map the previous version, older ones are removed
+    directory = os.path.dirname(manifest_path)
+    versions = sorted((entry for entry in os.scandir(directory) if entry.is_dir() and entry.name.startswith("svd-")),
+                      key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in versions[keep:]:
+        if entry.name != current:
+            shutil.rmtree(entry.path)
+
 
-    algo = SVD(n_factors=150, n_epochs=25, lr_all=0.01, reg_all=0.5, verbose=True)
+def train_svd(trainset, params=SVD_PARAMS):
+    algo = SVD(**params)
     algo.fit(trainset)
 
     # dump trained algorithm
     file_name = os.path.expanduser('TrainedModels/trainedSVDAlgo.model')
-    dump.dump(file_name=file_name, algo=algo)
+    dump_model(file_name, algo)
+    export_svd_factors(algo)
     print("SVD Training done!")
 
 
-def train_knn():
-    # load custom dataset
-    data = load_custom_dataset()
-    trainset = data.build_full_trainset()
-
+def train_knn(trainset, params=KNN_PARAMS):
     # First, train the algorithm to compute the similarities between items
-    sim_options = {'name': 'pearson_baseline', 'user_based': False}
-    algo = KNNBaseline(k=40, min_k=15, sim_options=sim_options)
+    algo = KNNBaseline(**params)
     algo.fit(trainset)
 
     # dump trained algorithm
     file_name = os.path.expanduser('TrainedModels/trainedKNNBaseline.model')
-    dump.dump(file_name=file_name, algo=algo)
+    dump_model(file_name, algo)
+    export_neighbour_table(algo)
     print("KNNBaseline Training done!")
 
 
-def main():
+TRAINERS = {"svd": train_svd, "knn": train_knn}
+
+
+def max_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def proc_status_mb(field):
+    # VmRSS or VmHWM of this process, None without /proc
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def memory_baseline_mb():
+    # a forked task starts with the parent's resident memory and peak, so the peak is reset to the current
+    # resident size and a task reports only the memory it added on top of it
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return max_rss_mb()
+    return proc_status_mb("VmRSS")
+
+
+def peak_memory_mb(baseline):
+    peak = proc_status_mb("VmHWM")
+    return (peak if peak is not None else max_rss_mb()) - baseline
+
+
+def set_shared(shared):
+    _shared.update(shared)
+
+
+def process_pool(workers, **shared):
+    # one fresh process per task, so the peak memory of a task is not mixed with the tasks before it
+    if "fork" in multiprocessing.get_all_start_methods():
+        # forked workers share the parent's trainset and folds instead of unpickling their own copies
+        set_shared(shared)
+        return multiprocessing.get_context("fork").Pool(processes=workers, maxtasksperchild=1)
+
+    return multiprocessing.Pool(processes=workers, initializer=set_shared, initargs=(shared,), maxtasksperchild=1)
+
+
+def run_training(task):
+    model, params = task
+    baseline = memory_baseline_mb()
+    started = time.perf_counter()
+    TRAINERS[model](_shared["trainset"], params)
+
+    return {"model": model, "params": params, "wall_time": time.perf_counter() - started,
+            "peak_memory_mb": peak_memory_mb(baseline)}
+
+
+def run_cross_validation(task):
+    model, params = task
+    baseline = memory_baseline_mb()
+    fit_times, test_times, rmses, maes = [], [], [], []
+
+    for trainset, testset in _shared["folds"]:
+        algo = ALGORITHMS[model](**params, verbose=False)
+
+        started = time.perf_counter()
+        algo.fit(trainset)
+        fit_times.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        predictions = algo.test(testset)
+        test_times.append(time.perf_counter() - started)
+
+        rmses.append(accuracy.rmse(predictions, verbose=False))
+        maes.append(accuracy.mae(predictions, verbose=False))
+
+    return {"model": model, "params": params, "rmse": float(np.mean(rmses)), "mae": float(np.mean(maes)),
+            "fit_time": float(np.mean(fit_times)), "test_time": float(np.mean(test_times)),
+            "wall_time": sum(fit_times) + sum(test_times), "peak_memory_mb": peak_memory_mb(baseline)}
+
+
+def train_models(trainset, svd_params, knn_params, workers):
+    tasks = [("svd", svd_params), ("knn", knn_params)]
+    with process_pool(min(workers, len(tasks)), trainset=trainset) as pool:
+        return pool.map(run_training, tasks, chunksize=1)
+
+
+def param_configs(grid, search, n_iter, rng):
+    configs = [dict(zip(grid.keys(), values)) for values in itertools.product(*grid.values())]
+    if search == "random":
+        return rng.sample(configs, min(n_iter, len(configs)))
+    return configs
+
+
+def search_params(data, search, n_folds, n_iter, workers, seed):
+    rng = random.Random(seed)
+    tasks = [("svd", params) for params in param_configs(SVD_PARAM_GRID, search, n_iter, rng)]
+    tasks += [("knn", params) for params in param_configs(KNN_PARAM_GRID, search, n_iter, rng)]
+
+    # the folds are built once and shared by every configuration
+    folds = list(KFold(n_splits=n_folds, random_state=seed).split(data))
+    with process_pool(workers, folds=folds) as pool:
+        results = pool.map(run_cross_validation, tasks, chunksize=1)
+
+    print(f"{'model':<6} {'rmse':>7} {'mae':>7} {'fit s':>8} {'test s':>8} {'+MB':>8}  params")
+    for result in sorted(results, key=lambda result: (result["model"], result["rmse"])):
+        print(f"{result['model']:<6} {result['rmse']:7.4f} {result['mae']:7.4f} {result['fit_time']:8.1f} "
+              f"{result['test_time']:8.1f} {result['peak_memory_mb']:8.0f}  {json.dumps(result['params'])}")
+    return results
+
+
+def best_params(results, model):
+    return min((result for result in results if result["model"] == model), key=lambda result: result["rmse"])["params"]
+
+
+def load_dataset(in_memory):
+    if in_memory:
+        return load_in_memory_dataset()
+
     export_data_file()
-    train_svd()
-    train_knn()
-    print("Training done!")
+    return load_custom_dataset()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the ratings and train the recommendation models")
+    parser.add_argument("--in-memory", action="store_true",
+                        help="build the dataset directly from the exported ratings instead of resources/ratings.dat")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of worker processes")
+    parser.add_argument("--svd-params", type=json.loads, default={}, help="JSON overrides of the SVD parameters")
+    parser.add_argument("--knn-params", type=json.loads, default={},
+                        help="JSON overrides of the KNNBaseline parameters")
+    parser.add_argument("--search", choices=["grid", "random"],
+                        help="cross-validate the SVD and KNNBaseline parameter grids before training")
+    parser.add_argument("--folds", type=int, default=3, help="number of cross-validation folds")
+    parser.add_argument("--n-iter", type=int, default=10, help="configurations per model for a random search")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--use-best", action="store_true",
+                        help="train the final models with the best parameters of the search")
+    parser.add_argument("--search-only", action="store_true", help="only run the search, do not train the models")
+    parser.add_argument("--report", default="TrainedModels/training_report.json")
+    args = parser.parse_args()
+
+    data = load_dataset(args.in_memory)
+    svd_params = {**SVD_PARAMS, **args.svd_params}
+    knn_params = {**KNN_PARAMS, **args.knn_params}
+    report = {"started_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "search": [], "training": []}
+
+    if args.search:
+        report["search"] = search_params(data, args.search, args.folds, args.n_iter, args.workers, args.seed)
+        if args.use_best:
+            svd_params = best_params(report["search"], "svd")
+            knn_params = best_params(report["search"], "knn")
+
+    if not args.search_only:
+        trainset = data.build_full_trainset()
+        report["training"] = train_models(trainset, svd_params, knn_params, args.workers)
+        for result in report["training"]:
+            print(f"{result['model']} trained in {result['wall_time']:.1f}s, "
+                  f"peak memory +{result['peak_memory_mb']:.0f} MB")
+        print("Training done!")
+
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
 
 
 if __name__ == "__main__":